@@ -1,19 +1,39 @@
-from flask import Flask, request, jsonify, render_template
+from flask import Flask, Response, request, jsonify, render_template, stream_with_context, url_for
 from flask_cors import CORS
 from werkzeug.utils import secure_filename
 import os
 import json
-import re
+import logging
 import time
+import uuid
 
+import batch_scoring
+import bulk_import
+import catalog_cache
+import combinations
 import comparateur
+import coverage_index
+import guarantee_matrix
+import metrics
 import pdf_json
+import ranking
 import delete_contract
+import extraction_jobs
+import similarity_index
+from contract_store import close_store, get_store
+from rate_limiter import QuotaExceededError
+from value_analyzer import normalize_contract, without_normalized
 from dotenv import load_dotenv
+from metrics import HTTP_SECONDS, STAGE_SECONDS
 
 # Load environment variables from .env file
 load_dotenv()
 
+# Log verbosity: DEBUG, INFO (default), WARNING or ERROR
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+logging.basicConfig(level=LOG_LEVEL, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+logger = logging.getLogger(__name__)
+
 # Create Flask app instance
 app = Flask(__name__)
 
@@ -22,8 +42,9 @@ app.config['UPLOAD_FOLDER'] = 'uploads'
 app.config['EXTRACTIONS_FOLDER'] = 'extractions'
 app.config['GOOGLE_API_KEY'] = os.getenv('GOOGLE_API_KEY')  # Explicit usage of environment variable
 
-# Debug log to verify API key is loaded (DO NOT log sensitive info in production)
-print(f"DEBUG: GOOGLE_API_KEY loaded as: {app.config['GOOGLE_API_KEY']}")
+# Only whether the key is set is logged, never its value
+if not app.config['GOOGLE_API_KEY']:
+    logger.warning("GOOGLE_API_KEY is not set: extraction and LLM comparison are unavailable")
 
 # Ensure folders exist
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
@@ -32,6 +53,21 @@ os.makedirs(app.config['EXTRACTIONS_FOLDER'], exist_ok=True)
 # Enable CORS
 CORS(app)
 
+@app.before_request
+def _start_timer():
+    request.environ['brokins.start'] = time.perf_counter()
+
+@app.after_request
+def _record_request_duration(response):
+    start = request.environ.get('brokins.start')
+    if start is not None:
+        # Route template rather than path, so that /extract/<job_id> stays a single series
+        endpoint = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        HTTP_SECONDS.observe(
+            time.perf_counter() - start, endpoint=endpoint, method=request.method, status=str(response.status_code)
+        )
+    return response
+
 # Routes
 @app.route('/')
 def index():
@@ -41,109 +77,443 @@ def index():
 def extractor():
     return render_template('extractor.html')
 
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """Prometheus metrics of this worker process (stage latencies, model tokens, cache and quota counters)."""
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
 @app.route('/extract', methods=['POST'])
 def extract_data():
-    print("--- Extract data route hit ---")
-
     if 'pdf_file' not in request.files:
-        print("ERROR: 'pdf_file' not in request.files")
+        logger.info("Extraction rejected: 'pdf_file' not in request.files")
         return jsonify({"error": "No PDF file provided"}), 400
     
     pdf_file = request.files['pdf_file']
     level_name = request.form.get('level_name')
 
-    print(f"Received file: {pdf_file.filename}")
-    print(f"Received level name: {level_name}")
+    # Several levels can be requested at once: one per line in level_name,
+    # repeated level_names fields, or all_levels=1 for every level of the PDF
+    level_names = [name.strip() for name in (level_name or '').splitlines() if name.strip()]
+    level_names += [name.strip() for name in request.form.getlist('level_names') if name.strip()]
+    if _form_flag('all_levels'):
+        level_names = pdf_json.ALL_LEVELS
+
+    logger.debug("Received file %s for levels %s", pdf_file.filename, level_names)
 
     if pdf_file.filename == '':
-        print("ERROR: No selected file")
+        logger.info("Extraction rejected: no selected file")
         return jsonify({"error": "No selected file"}), 400
 
-    if not level_name:
-        print("ERROR: No level name provided")
+    if not level_names:
+        logger.info("Extraction rejected: no level name provided")
         return jsonify({"error": "No level name provided"}), 400
 
+    force = _form_flag('force')
+    append = _form_flag('append')
+
     filename = secure_filename(pdf_file.filename)
-    pdf_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-    print(f"Saving file to: {pdf_path}")
-    pdf_file.save(pdf_path)
+    upload_name = f"{uuid.uuid4().hex}_{filename}"
+    pdf_path = os.path.join(app.config['UPLOAD_FOLDER'], upload_name)
+    with STAGE_SECONDS.time(pipeline="extract", stage="save_upload"):
+        pdf_file.save(pdf_path)
+
+    try:
+        job_id = extraction_jobs.get_job_queue().submit(
+            _process_extraction, pdf_path, filename, level_names, force, append
+        )
+    except extraction_jobs.QueueFullError as e:
+        os.remove(pdf_path)
+        return jsonify({"error": str(e)}), 503
+
+    logger.info("Extraction queued as job %s", job_id)
+    return jsonify({
+        "job_id": job_id,
+        "status": extraction_jobs.STATUS_QUEUED,
+        "status_url": url_for('extract_status', job_id=job_id),
+    }), 202
+
+@app.route('/extract/bulk', methods=['POST'])
+def extract_bulk():
+    """
+    Queues the extraction of every PDF in a ZIP archive.
+
+    The levels to extract per file come from the `manifest` form field or a manifest.json
+    inside the archive ({"file.pdf": ["Niveau 1", "Niveau 2"] or "all"}); files missing
+    from the manifest are extracted with all their levels. Progress is reported per file
+    by GET /extract/<job_id>.
+    """
+    zip_file = request.files.get('zip_file')
+    if zip_file is None or zip_file.filename == '':
+        return jsonify({"error": "No ZIP file provided"}), 400
+
+    zip_path = os.path.join(app.config['UPLOAD_FOLDER'], f"{uuid.uuid4().hex}_bulk.zip")
+    zip_file.save(zip_path)
+    files = []
+    try:
+        files, archived_manifest = bulk_import.unpack_pdfs(zip_path, app.config['UPLOAD_FOLDER'])
+        manifest = bulk_import.parse_manifest(request.form.get('manifest') or archived_manifest)
+        job_id = extraction_jobs.get_job_queue().submit_with_progress(
+            bulk_import.run_bulk_import, files, manifest,
+            force=_form_flag('force'), append=_form_flag('append'),
+            extractions_dir=app.config['EXTRACTIONS_FOLDER'],
+        )
+    except (bulk_import.BulkImportError, extraction_jobs.QueueFullError) as e:
+        for _, pdf_path in files:
+            os.remove(pdf_path)
+        status = 503 if isinstance(e, extraction_jobs.QueueFullError) else 400
+        return jsonify({"error": str(e)}), status
+    finally:
+        os.remove(zip_path)
+
+    logger.info("Bulk extraction of %d files queued as job %s", len(files), job_id)
+    return jsonify({
+        "job_id": job_id,
+        "status": extraction_jobs.STATUS_QUEUED,
+        "files": len(files),
+        "status_url": url_for('extract_status', job_id=job_id),
+    }), 202
 
+@app.route('/extract/<job_id>', methods=['GET'])
+def extract_status(job_id):
+    job = extraction_jobs.get_job_queue().get(job_id)
+    if job is None:
+        return jsonify({"error": f"Unknown extraction job: {job_id}"}), 404
+    return jsonify(job), 200
+
+def _form_flag(name):
+    return request.form.get(name, '').lower() in ('1', 'true', 'yes', 'on')
+
+def _process_extraction(pdf_path, filename, level_names, force=False, append=False):
+    """
+    Runs one extraction in a background worker and stores its result.
+
+    A single level is extracted with extract_contract_level_from_pdf; several levels
+    (or pdf_json.ALL_LEVELS) are extracted together in one model call and returned as a list.
+
+    Args:
+        pdf_path (str): Path of the uploaded PDF, removed once the extraction is done.
+        filename (str): Sanitized original filename, used to name the stored extraction.
+        level_names (list or str): Contract levels to extract, or pdf_json.ALL_LEVELS.
+        force (bool): Re-run the extraction even if a cached result exists.
+        append (bool): Add the extracted levels to the contract catalog.
+
+    Returns:
+        tuple: The response payload and its HTTP status code.
+    """
     response_payload = None
     status_code = 500
+    extracted_data = None
+    is_batch = level_names == pdf_json.ALL_LEVELS or len(level_names) > 1
+    append_to_file = 1 if append else 0
+    start = time.perf_counter()
 
     try:
-        print("Calling extract_contract_level_from_pdf...")
-        extracted_data = pdf_json.extract_contract_level_from_pdf(pdf_path, level_name)
-        print(f"Data returned from extraction: {extracted_data}")
+        if is_batch:
+            extracted_data = pdf_json.extract_contract_levels_from_pdf(
+                pdf_path, level_names, append_to_file=append_to_file, force=force
+            )
+        else:
+            extracted_data = pdf_json.extract_contract_level_from_pdf(
+                pdf_path, level_names[0], append_to_file=append_to_file, force=force
+            )
 
         if isinstance(extracted_data, str):
-            match = re.search(r'```json\s*([\s\S]*?)\s*```', extracted_data)
-            json_string = match.group(1) if match else extracted_data
-            parsed_json = json.loads(json_string)
+            with STAGE_SECONDS.time(pipeline="extract", stage="parse"):
+                parsed_json = pdf_json.parse_extraction_output(extracted_data)
+                if is_batch and not isinstance(parsed_json, list):
+                    parsed_json = [parsed_json]
+
+                # Typed guarantee values, computed once here rather than by every consumer
+                if isinstance(parsed_json, list):
+                    parsed_json = [normalize_contract(level) if isinstance(level, dict) else level for level in parsed_json]
+                elif isinstance(parsed_json, dict):
+                    parsed_json = normalize_contract(parsed_json)
 
             timestamp = int(time.time())
             original_filename = os.path.splitext(filename)[0]
             output_filename = f"{timestamp}_{original_filename}.json"
             output_path = os.path.join(app.config['EXTRACTIONS_FOLDER'], output_filename)
 
-            with open(output_path, 'w', encoding='utf-8') as f:
-                json.dump(parsed_json, f, ensure_ascii=False, indent=4)
+            with STAGE_SECONDS.time(pipeline="extract", stage="save_result"):
+                with open(output_path, 'w', encoding='utf-8') as f:
+                    json.dump(parsed_json, f, ensure_ascii=False, indent=4)
 
-            print(f"Successfully stored extraction in {output_path}")
-            response_payload = parsed_json
+            logger.info("Stored extraction in %s", output_path)
+            # The stored extraction keeps the normalized block; the API returns the contracts.json format
+            if isinstance(parsed_json, list):
+                response_payload = [without_normalized(level) if isinstance(level, dict) else level for level in parsed_json]
+            else:
+                response_payload = without_normalized(parsed_json) if isinstance(parsed_json, dict) else parsed_json
             status_code = 200
 
         elif isinstance(extracted_data, dict) and 'error' in extracted_data:
-            print(f"ERROR from extraction function: {extracted_data['error']}")
+            logger.warning("Extraction failed: %s", extracted_data['error'])
             response_payload = extracted_data
-            status_code = 400
+            status_code = 429 if 'retry_after' in extracted_data else 400
 
         else:
-            print(f"ERROR: Unexpected data format from extraction function: {type(extracted_data)}")
+            logger.error("Unexpected data format from extraction function: %s", type(extracted_data))
             response_payload = {"error": "Unexpected data format received from extraction function."}
             status_code = 500
 
     except json.JSONDecodeError:
-        print(f"ERROR: Failed to parse JSON from model output. Raw output: {extracted_data}")
+        # The raw model output is returned to the client but kept out of the logs
+        logger.error("Failed to parse JSON from model output (%d chars)", len(extracted_data))
         response_payload = {"error": "Failed to parse extraction result", "details": extracted_data}
         status_code = 500
     except Exception as e:
-        print(f"An unexpected error occurred in /extract: {e}")
+        logger.exception("An unexpected error occurred in /extract: %s", e)
         response_payload = {"error": "An unexpected server error occurred."}
         status_code = 500
     finally:
         if os.path.exists(pdf_path):
             os.remove(pdf_path)
-            print(f"Cleaned up local upload: {pdf_path}")
+        STAGE_SECONDS.observe(time.perf_counter() - start, pipeline="extract", stage="total")
+
+    return response_payload, status_code
+
+PROFILE_BODY_ERROR = "The request body must be a JSON object of guarantees by category"
 
-    return jsonify(response_payload), status_code
+def _profile_body():
+    """The profile posted to the /compare endpoints, or None if the body is not a JSON object."""
+    user_data = request.get_json(silent=True)
+    return user_data if isinstance(user_data, dict) else None
 
 @app.route('/compare', methods=['POST'])
 def compare_contracts():
-    user_data = request.json
-    top_contracts_md = comparateur.find_top_contracts(user_data)
+    user_data = _profile_body()
+    if user_data is None:
+        return jsonify({"error": PROFILE_BODY_ERROR}), 400
+    mode = request.args.get('mode')
+    if mode and mode.lower() not in comparateur.COMPARE_MODES:
+        return jsonify({"error": f"Unknown compare mode: {mode}"}), 400
+
+    # Opt-in: Gemini rephrases the locally computed strengths/weaknesses
+    polish = request.args.get('polish', '').lower() in ('1', 'true', 'yes', 'on')
+
+    prompt_stats = {}
+    top_contracts_md = comparateur.find_top_contracts(user_data, mode=mode, stats=prompt_stats, polish=polish)
 
     if isinstance(top_contracts_md, dict) and 'error' in top_contracts_md:
+        if 'retry_after' in top_contracts_md:
+            return jsonify(top_contracts_md), 429, {'Retry-After': str(top_contracts_md['retry_after'])}
         return jsonify(top_contracts_md), 500
 
-    return jsonify({"table": top_contracts_md})
+    response = {"table": top_contracts_md}
+    if prompt_stats:
+        response["prompt_stats"] = prompt_stats
+    return jsonify(response)
+
+@app.route('/compare/combinations', methods=['POST'])
+def compare_combinations():
+    """Ranks base contract + surcomplémentaire pairs, additive guarantees being summed"""
+    user_data = _profile_body()
+    if user_data is None:
+        return jsonify({"error": PROFILE_BODY_ERROR}), 400
+    try:
+        top_n = int(request.args.get('top_n', ranking.TOP_N))
+    except ValueError:
+        return jsonify({"error": "top_n must be an integer"}), 400
+    if not 1 <= top_n <= combinations.COMBINATIONS_MAX_TOP_N:
+        return jsonify({"error": f"top_n must be between 1 and {combinations.COMBINATIONS_MAX_TOP_N}"}), 400
+
+    search_stats = {}
+    ranked = comparateur.find_top_combinations(user_data, top_n=top_n, stats=search_stats)
+    if isinstance(ranked, dict) and 'error' in ranked:
+        return jsonify(ranked), 500
+
+    return jsonify({
+        "table": ranking.render_markdown_table(ranked),
+        "combinations": [
+            {
+                "rank": result["rank"],
+                "base": result["contract"].get("level_id"),
+                "surco": result["surco"].get("level_id"),
+                "name": result["name"],
+                "percentage": result["percentage"],
+            }
+            for result in ranked
+        ],
+        "search_stats": search_stats,
+    })
+
+@app.route('/compare/batch', methods=['POST'])
+def compare_batch():
+    """
+    Ranks the catalog for many profiles in one vectorized pass.
+
+    The body is either {"profiles": [...]} or a grid {"base": {...}, "vary": {guarantee: values}},
+    values being a list or {"start", "stop", "step", "unit"}. With ?stream=1 (or Accept:
+    application/x-ndjson), one JSON line is sent per profile as soon as its chunk is scored.
+    """
+    try:
+        top_k = int(request.args.get('top_k', ranking.TOP_N))
+        if top_k < 1:
+            raise ValueError("top_k must be a positive integer")
+        profiles, labels = batch_scoring.parse_batch_request(request.get_json(silent=True))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    try:
+        matrix = guarantee_matrix.get_guarantee_matrix()
+    except Exception as e:
+        logger.exception("An error occurred while loading the catalog in /compare/batch: %s", e)
+        return jsonify({"error": "Le catalogue de contrats est indisponible."}), 500
+
+    results = batch_scoring.score_batch(profiles, matrix, top_k=top_k, labels=labels)
+    stream = request.args.get('stream', '').lower() in ('1', 'true', 'yes', 'on') \
+        or request.accept_mimetypes.best == 'application/x-ndjson'
+    if stream:
+        lines = (json.dumps(result, ensure_ascii=False) + "\n" for result in results)
+        return Response(
+            stream_with_context(lines),
+            mimetype='application/x-ndjson',
+            headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+        )
+    return jsonify({"count": len(profiles), "profiles": list(results)})
+
+@app.route('/compare/stream', methods=['POST'])
+def compare_contracts_stream():
+    """Streams the comparison table row by row as Server-Sent Events"""
+    user_data = _profile_body()
+    if user_data is None:
+        return jsonify({"error": PROFILE_BODY_ERROR}), 400
+    mode = request.args.get('mode')
+    if mode and mode.lower() not in comparateur.COMPARE_MODES:
+        return jsonify({"error": f"Unknown compare mode: {mode}"}), 400
+
+    def events():
+        try:
+            for line in comparateur.stream_top_contracts(user_data, mode=mode):
+                yield _sse_event("row", {"line": line})
+            yield _sse_event("done", {})
+        except QuotaExceededError as e:
+            logger.warning("Quota exceeded in /compare/stream: %s", e)
+            yield _sse_event("error", {"error": str(e), "retry_after": round(e.retry_after)})
+        except ValueError as e:
+            logger.warning("A validation error occurred in /compare/stream: %s", e)
+            yield _sse_event("error", {"error": str(e)})
+        except Exception as e:
+            logger.exception("An unexpected error occurred in /compare/stream: %s", e)
+            yield _sse_event("error", {"error": "Une erreur inattendue est survenue lors de la comparaison des contrats."})
+
+    return Response(
+        stream_with_context(events()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+    )
+
+def _sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
 
 @app.route('/api/contracts', methods=['GET'])
 def get_contracts():
-    """Retourne le fichier contracts.json pour le frontend"""
+    """
+    Retourne le catalogue de contrats (format contracts.json) pour le frontend
+
+    ?fields=level_id,insurer projects top-level keys, ?insurer= and ?contract_type= filter
+    (comma-separated), ?limit= switches to cursor pagination ({items, next_cursor}, then ?cursor=).
+    Bodies are cached per catalog version and served precompressed, with a strong ETag.
+    """
+    try:
+        limit = request.args.get('limit')
+        payload = catalog_cache.get_catalog_cache().get(
+            fields=_list_arg('fields'),
+            insurer=_list_arg('insurer'),
+            contract_type=_list_arg('contract_type'),
+            limit=int(limit) if limit else None,
+            cursor=request.args.get('cursor'),
+        )
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        logger.exception("Erreur lors du chargement du catalogue: %s", e)
+        return jsonify({"error": str(e)}), 500
+
+    encoding = next(
+        (name for name in ('br', 'gzip') if name in payload.encodings and request.accept_encodings[name] > 0),
+        'identity',
+    )
+    headers = {
+        'ETag': f'"{payload.etag_for(encoding)}"',
+        'Vary': 'Accept-Encoding',
+        'Cache-Control': 'no-cache',
+    }
+    if any(request.if_none_match.contains(etag) for etag in payload.etags()) or request.if_none_match.star_tag:
+        return Response(status=304, headers=headers)
+
+    if encoding != 'identity':
+        headers['Content-Encoding'] = encoding
+    return Response(payload.encodings[encoding], status=200, mimetype='application/json', headers=headers)
+
+def _list_arg(name):
+    """Comma-separated query parameter as a list (None when absent or empty)"""
+    values = [value.strip() for value in request.args.get(name, '').split(',') if value.strip()]
+    return values or None
+
+@app.route('/api/contracts/covering', methods=['GET'])
+def get_covering_contracts():
+    """
+    Returns the contracts covering every threshold given in the query string,
+    e.g. ?honoraires_chirurgien_optam=150&chambre_particuliere=40 (bare numbers use the
+    guarantee's usual unit, "150 €" or "200 % BR" are also accepted).
+    """
     try:
-        contracts_path = os.path.join(os.path.dirname(__file__), 'contracts.json')
-        with open(contracts_path, 'r', encoding='utf-8') as f:
-            contracts = json.load(f)
-        print(f"✅ Contracts.json servi avec succès: {len(contracts)} contrats")
-        return jsonify(contracts), 200
-    except FileNotFoundError:
-        print("❌ Erreur: contracts.json non trouvé")
-        return jsonify({"error": "contracts.json not found"}), 404
+        index = coverage_index.get_coverage_index()
+        needs = index.parse_needs(request.args.to_dict())
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
-        print(f"❌ Erreur lors du chargement de contracts.json: {e}")
+        logger.exception("Erreur lors du chargement de l'index de couverture: %s", e)
         return jsonify({"error": str(e)}), 500
 
+    rows = index.covering(needs)
+    return jsonify({
+        "count": len(rows),
+        "contracts": [without_normalized(index.matrix.contracts[row]) for row in rows],
+    }), 200
+
+@app.route('/api/contracts/similar', methods=['GET'])
+def get_similar_contracts():
+    """
+    Returns the contracts closest to a profile given as guarantee thresholds
+    (same syntax as /api/contracts/covering) or to an existing level (?level_id=...).
+    ?k=N returns the N nearest levels (default 10); ?radius=R returns every level
+    within distance R, each guarantee being scaled by its slider maximum.
+    """
+    args = request.args.to_dict()
+    level_id = args.pop('level_id', None)
+    try:
+        k = int(args.pop('k', similarity_index.SIMILAR_DEFAULT_K))
+        radius = args.pop('radius', None)
+        radius = float(radius) if radius is not None else None
+        if k < 1 or (radius is not None and radius < 0):
+            raise ValueError("k must be positive and radius non-negative")
+
+        index = similarity_index.get_similarity_index()
+        if level_id is not None:
+            levels = get_store().find(level_id)
+            if not levels:
+                return jsonify({"error": f"Unknown level_id: {level_id}"}), 404
+            vector = index.vector(levels[0])
+        else:
+            vector = index.needs_vector(coverage_index.parse_thresholds(args))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    try:
+        if radius is not None:
+            results = index.within(vector, radius, exclude_level_id=level_id)
+        else:
+            results = index.nearest(vector, k, exclude_level_id=level_id)
+    except Exception as e:
+        logger.exception("Erreur lors de la recherche de contrats similaires: %s", e)
+        return jsonify({"error": str(e)}), 500
+
+    # The normalized block stays internal: clients get the contracts.json format
+    results = [{**result, "contract": without_normalized(result["contract"])} for result in results]
+    return jsonify({"count": len(results), "results": results}), 200
+
 @app.route('/api/contracts/delete/<level_id>', methods=['DELETE'])
 def delete_contract_endpoint(level_id):
     success, message = delete_contract.delete_contract_by_id(level_id)
@@ -152,6 +522,32 @@ def delete_contract_endpoint(level_id):
     else:
         return jsonify({"success": False, "message": message}), 404
 
+def warm_catalog():
+    """
+    Loads and compiles the contract catalog ahead of the first request.
+
+    Called by gunicorn in the master process before workers are forked (see gunicorn.conf.py),
+    so every worker starts with the catalog, the guarantee matrix, the indexes and the
+    serialized /api/contracts body already built, shared copy-on-write.
+    The SQLite connections opened meanwhile are closed before returning, so that no worker
+    inherits the master's handles and WAL shared-memory mapping.
+    Failures are logged only: each worker then builds what it needs on first use.
+    """
+    start = time.perf_counter()
+    try:
+        matrix = guarantee_matrix.get_guarantee_matrix()
+        coverage_index.get_coverage_index()
+        similarity_index.get_similarity_index().sync()
+        catalog_cache.get_catalog_cache().get()
+    except Exception as e:
+        logger.exception("Catalog warm-up failed, it will be loaded on first request: %s", e)
+        return
+    finally:
+        close_store()
+        metrics.close()
+    logger.info("Catalog warmed: %d levels in %.2f s", len(matrix), time.perf_counter() - start)
+
 if __name__ == '__main__':
     # Important: Flask only loads .env on fresh start
+    warm_catalog()
     app.run(debug=True)
@@ -0,0 +1,206 @@
+"""
+Évaluation d'un lot de profils en une passe
+Les profils (liste ou grille de valeurs d'un ou plusieurs sliders) sont évalués par blocs
+contre toute la matrice du catalogue : tableaux profils x contrats x garanties
+"""
+
+import itertools
+import os
+from typing import Dict, Iterator, List, Tuple
+
+import numpy as np
+
+from guarantee_matrix import GuaranteeMatrix, unit_code
+from ranking import (
+    BAND_EDGES, BAND_SCORES, SCORE_DECIMALS, TIERS, TOP_N, WEIGHT_COHERENCE, WEIGHT_COVERAGE, WEIGHT_PROXIMITY,
+    _tier_masks, contract_display_name, parse_user_needs, select_tiers,
+)
+from value_analyzer import GuaranteeAnalyzer
+
+BATCH_MAX_PROFILES = int(os.environ.get("BATCH_MAX_PROFILES", 10000))
+# Taille maximale d'un bloc (profils x contrats x garanties), pour borner la mémoire
+BATCH_CHUNK_CELLS = int(os.environ.get("BATCH_CHUNK_CELLS", 4_000_000))
+
+
+def _grid_values(guarantee_name: str, spec) -> List[str]:
+    """Valeurs d'un slider : liste de valeurs brutes, ou {"start", "stop", "step", "unit"} (stop inclus)"""
+    if isinstance(spec, list) and spec:
+        return [str(value) for value in spec]
+    if isinstance(spec, dict):
+        try:
+            start, stop, step = float(spec["start"]), float(spec["stop"]), float(spec["step"])
+        except (KeyError, TypeError, ValueError):
+            raise ValueError(f"Plage invalide pour {guarantee_name} : start, stop et step sont requis")
+        if step <= 0 or stop < start:
+            raise ValueError(f"Plage invalide pour {guarantee_name} : {spec}")
+        unit = spec.get("unit", "")
+        count = int(np.floor((stop - start) / step + 1e-9)) + 1
+        return [f"{start + i * step:g}{unit}" for i in range(count)]
+    raise ValueError(f"Valeurs invalides pour {guarantee_name} : {spec!r}")
+
+
+def expand_grid(base: Dict, vary: Dict) -> Tuple[List[Dict], List[Dict]]:
+    """
+    Produit cartésien des valeurs de sliders, appliqué à un profil de base
+
+    Args:
+        base (Dict): Profil de base ({catégorie: {garantie: valeur}}) ; chaque garantie
+            variée doit y figurer pour situer sa catégorie
+        vary (Dict): Valeurs par garantie (voir _grid_values)
+
+    Returns:
+        tuple: (profils, valeurs variées de chaque profil)
+
+    Raises:
+        ValueError: Si une garantie variée est absente du profil de base ou si la grille est trop grande
+    """
+    categories = {}
+    for guarantee_name in vary:
+        category = next((c for c, g in base.items() if isinstance(g, dict) and guarantee_name in g), None)
+        if category is None:
+            raise ValueError(f"Garantie absente du profil de base : {guarantee_name}")
+        categories[guarantee_name] = category
+
+    axes = [_grid_values(name, spec) for name, spec in vary.items()]
+    size = int(np.prod([len(axis) for axis in axes])) if axes else 1
+    if size > BATCH_MAX_PROFILES:
+        raise ValueError(f"La grille compte {size} profils (maximum {BATCH_MAX_PROFILES})")
+
+    profiles, labels = [], []
+    for combination in itertools.product(*axes):
+        profile = {c: dict(g) if isinstance(g, dict) else g for c, g in base.items()}
+        label = {}
+        for guarantee_name, value in zip(vary, combination):
+            profile[categories[guarantee_name]][guarantee_name] = value
+            label[guarantee_name] = value
+        profiles.append(profile)
+        labels.append(label)
+    return profiles, labels
+
+
+def parse_batch_request(payload: Dict) -> Tuple[List[Dict], List[Dict]]:
+    """
+    Profils d'une requête : {"profiles": [...]} ou {"base": {...}, "vary": {...}}
+
+    Returns:
+        tuple: (profils, valeurs variées de chaque profil, vides pour une liste)
+
+    Raises:
+        ValueError: Si la requête est mal formée ou dépasse BATCH_MAX_PROFILES
+    """
+    if not isinstance(payload, dict):
+        raise ValueError("Le corps de la requête doit être un objet JSON")
+    if "profiles" in payload:
+        profiles = payload["profiles"]
+        if not isinstance(profiles, list) or not all(isinstance(p, dict) for p in profiles):
+            raise ValueError("profiles doit être une liste de profils")
+        if len(profiles) > BATCH_MAX_PROFILES:
+            raise ValueError(f"{len(profiles)} profils (maximum {BATCH_MAX_PROFILES})")
+        return profiles, [{} for _ in profiles]
+    if isinstance(payload.get("base"), dict) and isinstance(payload.get("vary"), dict):
+        return expand_grid(payload["base"], payload["vary"])
+    raise ValueError("La requête doit contenir profiles, ou base et vary")
+
+
+def _needs_arrays(needs_list: List[List[Dict]]) -> Tuple[List[str], np.ndarray, np.ndarray, np.ndarray]:
+    """Besoins de chaque profil alignés sur l'union des garanties : (garanties, valeurs, unités, masque actif)"""
+    guarantees = list(dict.fromkeys(need["guarantee"] for needs in needs_list for need in needs))
+    column = {name: k for k, name in enumerate(guarantees)}
+    shape = (len(needs_list), len(guarantees))
+    values = np.ones(shape)
+    units = np.zeros(shape, dtype=np.int8)
+    active = np.zeros(shape, dtype=bool)
+    for p, needs in enumerate(needs_list):
+        for need in needs:
+            # Le formulaire ne place une garantie que dans une catégorie
+            k = column[need["guarantee"]]
+            values[p, k] = need["value"]
+            units[p, k] = unit_code(need["type"], need["value"])
+            active[p, k] = True
+    return guarantees, values, units, active
+
+
+def score_chunk(values: np.ndarray, units: np.ndarray, need_values: np.ndarray,
+                need_units: np.ndarray, active: np.ndarray) -> Dict:
+    """
+    Évalue un bloc de profils contre tout le catalogue, comme ranking.score_profile
+
+    Args:
+        values (np.ndarray): Valeurs du catalogue, (contrats, garanties)
+        units (np.ndarray): Codes d'unité du catalogue, (contrats, garanties)
+        need_values (np.ndarray): Besoins, (profils, garanties)
+        need_units (np.ndarray): Codes d'unité des besoins, (profils, garanties)
+        active (np.ndarray): Garanties renseignées de chaque profil, (profils, garanties)
+
+    Returns:
+        Dict: Tableaux (profils, contrats) : score, écarts max, couverture
+    """
+    active3 = active[:, None, :]
+    comparable = (units[None, :, :] == need_units[:, None, :]) & active3
+    gap = values[None, :, :] - need_values[:, None, :]
+    relative_gap = np.abs(gap) / need_values[:, None, :]
+    covered = comparable & (gap >= 0)
+    bands = np.where(comparable, BAND_SCORES[np.searchsorted(BAND_EDGES, relative_gap)], 0.0)
+
+    counts = active.sum(axis=1)[:, None]
+    denominator = np.maximum(counts, 1)
+    score = (
+        WEIGHT_PROXIMITY * bands.sum(axis=2) / denominator
+        + WEIGHT_COVERAGE * covered.sum(axis=2) / denominator
+        + WEIGHT_COHERENCE * comparable.sum(axis=2) / denominator
+    )
+    score = np.round(np.where(counts == 0, 1.0, score), SCORE_DECIMALS)
+
+    all_comparable = (comparable | ~active3).all(axis=2)
+    return {
+        "score": score,
+        "max_relative_gap": np.where(all_comparable, np.where(active3, relative_gap, 0.0).max(axis=2, initial=0.0), np.inf),
+        "max_absolute_gap": np.where(all_comparable, np.where(active3, np.abs(gap), 0.0).max(axis=2, initial=0.0), np.inf),
+        "covers_all": (covered | ~active3).all(axis=2),
+    }
+
+
+def score_batch(profiles: List[Dict], matrix: GuaranteeMatrix, top_k: int = TOP_N,
+                labels: List[Dict] = None) -> Iterator[Dict]:
+    """
+    Classe le catalogue pour chaque profil, bloc par bloc
+
+    Le classement de chaque profil est celui de ranking.rank_contracts (paliers compris).
+
+    Args:
+        profiles (List[Dict]): Profils issus du formulaire
+        matrix (GuaranteeMatrix): Catalogue compilé
+        top_k (int): Nombre de contrats retournés par profil
+        labels (List[Dict]): Valeurs variées de chaque profil (voir expand_grid)
+
+    Yields:
+        Dict: {"index", "values", "results": [{"rank", "level_id", "name", "tier", "percentage", "score"}]}
+    """
+    analyzer = GuaranteeAnalyzer()
+    needs_list = [parse_user_needs(profile, analyzer) for profile in profiles]
+    guarantees, need_values, need_units, active = _needs_arrays(needs_list)
+    values, units, _ = matrix.gather(guarantees)
+
+    cells_per_profile = max(len(matrix) * len(guarantees), 1)
+    chunk_size = max(1, BATCH_CHUNK_CELLS // cells_per_profile)
+    for start in range(0, len(profiles), chunk_size):
+        stop = min(start + chunk_size, len(profiles))
+        scores = score_chunk(values, units, need_values[start:stop], need_units[start:stop], active[start:stop])
+        for offset in range(stop - start):
+            profile_scores = {key: array[offset] for key, array in scores.items()}
+            score = profile_scores["score"]
+            masks = _tier_masks(profile_scores)
+            results = []
+            for rank, (row, tier_index) in enumerate(select_tiers(score, masks, matrix.level_id_order, top_k), start=1):
+                _, min_pct, max_pct = TIERS[tier_index]
+                contract = matrix.summary(row)
+                results.append({
+                    "rank": rank,
+                    "level_id": contract.get("level_id"),
+                    "name": contract_display_name(contract),
+                    "tier": tier_index + 1,
+                    "percentage": min_pct + round(float(score[row]) * (max_pct - min_pct)),
+                    "score": round(float(score[row]), 6),
+                })
+            index = start + offset
+            yield {"index": index, "values": labels[index] if labels else {}, "results": results}
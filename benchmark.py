@@ -0,0 +1,291 @@
+"""
+Mesures de performance des chemins critiques
+Catalogues synthétiques (niveaux au format examples.json, dérivés du catalogue réel) de 1k, 10k
+et 100k niveaux ; résultats écrits en JSON pour comparer deux commits
+
+Usage :
+    python benchmark.py --sizes 1000 10000 --output bench.json
+    python benchmark.py --baseline bench.json          # compare au résultat d'un autre commit
+"""
+
+import argparse
+import copy
+import json
+import os
+import platform
+import random
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, List
+
+import numpy as np
+
+import batch_scoring
+import catalog_snapshot
+import combinations
+import comparateur
+import contract_store
+import coverage_index
+import guarantee_matrix
+import ranking
+import similarity_index
+import value_analyzer
+from contract_store import ContractStore
+
+DEFAULT_SIZES = [1000, 10000, 100000]
+DEFAULT_REPEAT = 3
+DEFAULT_OUTPUT = "benchmark_results.json"
+# Écart de médiane signalé comme régression par --baseline
+REGRESSION_THRESHOLD = 1.2
+
+DELETE_SAMPLE = 20
+BATCH_PROFILES = 100
+
+# Profil du formulaire utilisé pour les mesures de classement
+BENCH_PROFILE = {
+    "HOSPITALISATION": {"honoraires_chirurgien_optam": "150 % BR", "chambre_particuliere": "60 €"},
+    "SOINS_COURANTS": {"consultation_generaliste_optam": "125 % BR"},
+    "DENTAIRE": {"soins_dentaires": "200 % BR", "implantologie": "300 €", "orthodontie": "200 % BR"},
+    "OPTIQUE": {"verres_complexes": "250 €"},
+}
+
+_NUMBER = re.compile(r"\d+(?:[.,]\d+)?")
+
+
+def _vary_value(value, rng: random.Random):
+    """Même libellé, montants tirés autour de l'original (arrondis à 5) : les valeurs restent variées"""
+    if not isinstance(value, str):
+        return value
+
+    def replace(match):
+        number = float(match.group().replace(",", "."))
+        return f"{max(5, round(number * rng.uniform(0.5, 2.0) / 5) * 5):g}"
+
+    return _NUMBER.sub(replace, value)
+
+
+def generate_catalog(size: int, templates: List[Dict], seed: int = 0) -> List[Dict]:
+    """
+    Catalogue synthétique de size niveaux
+
+    Chaque niveau copie un niveau réel (assureur, catégories, libellés) avec un level_id
+    unique et des montants perturbés.
+
+    Args:
+        size (int): Nombre de niveaux
+        templates (List[Dict]): Niveaux réels servant de modèles
+        seed (int): Graine, pour des catalogues identiques d'une exécution à l'autre
+
+    Returns:
+        List[Dict]: Niveaux au format examples.json
+    """
+    rng = random.Random(seed)
+    catalog = []
+    for i in range(size):
+        level = copy.deepcopy(value_analyzer.without_normalized(rng.choice(templates)))
+        level["level_id"] = f"bench_{i:06d}"
+        level["benefits"] = {
+            category: {name: _vary_value(value, rng) for name, value in guarantees.items()}
+            for category, guarantees in (level.get("benefits") or {}).items()
+            if isinstance(guarantees, dict)
+        }
+        catalog.append(level)
+    return catalog
+
+
+def _bench_profiles(count: int, seed: int) -> List[Dict]:
+    """Variantes de BENCH_PROFILE pour les mesures par lot"""
+    rng = random.Random(seed)
+    return [
+        {
+            category: {name: _vary_value(value, rng) for name, value in guarantees.items()}
+            for category, guarantees in BENCH_PROFILE.items()
+        }
+        for _ in range(count)
+    ]
+
+
+def measure(func: Callable, repeat: int) -> Dict:
+    """Durées de repeat exécutions, en millisecondes (la première isolée : caches froids)"""
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        durations.append((time.perf_counter() - start) * 1000)
+    return {
+        "runs": repeat,
+        "first_ms": round(durations[0], 3),
+        "min_ms": round(min(durations), 3),
+        "median_ms": round(statistics.median(durations), 3),
+        "mean_ms": round(statistics.mean(durations), 3),
+    }
+
+
+def run_size(size: int, templates: List[Dict], repeat: int, seed: int, workdir: str) -> Dict:
+    """Mesures sur un catalogue de size niveaux, dans une base temporaire"""
+    results = {}
+    catalog = generate_catalog(size, templates, seed)
+    seed_path = os.path.join(workdir, f"catalog_{size}.json")
+    with open(seed_path, "w", encoding="utf-8") as f:
+        json.dump(catalog, f, ensure_ascii=False)
+
+    def log(name):
+        print(f"[{size}] {name}: {results[name]['median_ms']} ms", file=sys.stderr)
+
+    # Chargement : import du JSON (normalisation à l'ingestion comprise), une seule fois
+    db_path = os.path.join(workdir, f"contracts_{size}.db")
+    store_box = {}
+    results["store_import"] = measure(lambda: store_box.update(store=ContractStore(db_path, seed_path)), 1)
+    log("store_import")
+    store = store_box["store"]
+    # Les modules qui passent par get_store() utilisent ce catalogue
+    contract_store._store = store
+
+    results["store_load_all"] = measure(store.all, repeat)
+    log("store_load_all")
+    export_path = os.path.join(workdir, f"export_{size}.json")
+    results["store_export_json"] = measure(lambda: store.export_json(export_path), repeat)
+    log("store_export_json")
+
+    contracts = store.all()
+    version = store.version()
+    analyzer = value_analyzer.GuaranteeAnalyzer()
+
+    def analyze_all():
+        for contract in contracts:
+            analyzer.analyze_contract_benefits(contract.get("benefits") or {})
+
+    def analyze_all_cold():
+        value_analyzer._analyze_cached.cache_clear()
+        analyze_all()
+
+    results["analyze_contract_benefits"] = measure(analyze_all, repeat)
+    log("analyze_contract_benefits")
+    results["analyze_contract_benefits_cold"] = measure(analyze_all_cold, repeat)
+    log("analyze_contract_benefits_cold")
+
+    results["matrix_build"] = measure(lambda: guarantee_matrix.GuaranteeMatrix(contracts, analyzer), repeat)
+    log("matrix_build")
+    compiled = guarantee_matrix.GuaranteeMatrix(contracts, analyzer)
+    snapshot = os.path.join(workdir, f"catalog_{size}.snapshot")
+    results["snapshot_write"] = measure(lambda: catalog_snapshot.write_snapshot(compiled, version, store.catalog_id, snapshot), repeat)
+    log("snapshot_write")
+    results["snapshot_load"] = measure(lambda: catalog_snapshot.SnapshotMatrix(snapshot), repeat)
+    log("snapshot_load")
+    # Classements mesurés sur la matrice partagée (instantané projeté en mémoire)
+    matrix = guarantee_matrix.get_guarantee_matrix(store)
+
+    results["rank_contracts"] = measure(lambda: ranking.rank_contracts(BENCH_PROFILE, matrix), repeat)
+    log("rank_contracts")
+    results["render_markdown_table"] = measure(
+        lambda: ranking.render_markdown_table(ranking.rank_contracts(BENCH_PROFILE, matrix)), repeat
+    )
+    log("render_markdown_table")
+
+    os.environ.setdefault("GOOGLE_API_KEY", "benchmark")   # genai.configure ne contacte pas l'API
+    results["compare_prompt"] = measure(lambda: comparateur._prepare_llm_prompt(BENCH_PROFILE, version), repeat)
+    log("compare_prompt")
+
+    profiles = _bench_profiles(BATCH_PROFILES, seed)
+    results[f"batch_scoring_{BATCH_PROFILES}"] = measure(
+        lambda: list(batch_scoring.score_batch(profiles, matrix)), repeat
+    )
+    log(f"batch_scoring_{BATCH_PROFILES}")
+    results["combinations"] = measure(lambda: combinations.rank_combinations(BENCH_PROFILE, matrix), repeat)
+    log("combinations")
+
+    index_box = {}
+    results["coverage_index_build"] = measure(
+        lambda: index_box.update(index=coverage_index.CoverageIndex(matrix)), repeat
+    )
+    log("coverage_index_build")
+    needs = index_box["index"].parse_needs({"honoraires_chirurgien_optam": "150", "chambre_particuliere": "60"})
+    results["coverage_query"] = measure(lambda: index_box["index"].covering(needs), repeat)
+    log("coverage_query")
+
+    similarity = similarity_index.SimilarityIndex(store)
+    results["similarity_index_sync"] = measure(similarity.sync, 1)
+    log("similarity_index_sync")
+    query = similarity.vector(contracts[0])
+    results["similarity_nearest"] = measure(lambda: similarity.nearest(query, similarity_index.SIMILAR_DEFAULT_K), repeat)
+    log("similarity_nearest")
+
+    # Suppressions en dernier : elles modifient le catalogue
+    level_ids = iter(random.Random(seed).sample([c["level_id"] for c in contracts], min(DELETE_SAMPLE, size)))
+    results["delete_level_id"] = measure(lambda: store.delete(next(level_ids)), min(DELETE_SAMPLE, size))
+    log("delete_level_id")
+    return results
+
+
+def _metadata() -> Dict:
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "commit": commit,
+        "timestamp": int(time.time()),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+    }
+
+
+def compare_results(baseline: Dict, current: Dict, threshold: float = REGRESSION_THRESHOLD) -> List[str]:
+    """
+    Lignes de comparaison des médianes, mesure par mesure
+
+    Returns:
+        List[str]: Une ligne par mesure présente dans les deux résultats
+    """
+    lines = []
+    for size, benches in current["results"].items():
+        for name, stats in benches.items():
+            before = baseline.get("results", {}).get(size, {}).get(name)
+            if not before or not before["median_ms"]:
+                continue
+            ratio = stats["median_ms"] / before["median_ms"]
+            flag = "  REGRESSION" if ratio > threshold else ""
+            lines.append(f"{size:>7} {name:<32} {before['median_ms']:>11.3f} -> {stats['median_ms']:>11.3f} ms  x{ratio:.2f}{flag}")
+    return lines
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="Mesures de performance du comparateur")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="Tailles de catalogue")
+    parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT, help="Exécutions par mesure")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--templates", default=contract_store.CONTRACTS_JSON, help="Niveaux réels servant de modèles")
+    parser.add_argument("--output", default=DEFAULT_OUTPUT, help="Fichier JSON des résultats")
+    parser.add_argument("--baseline", help="Résultats d'un autre commit, à comparer")
+    args = parser.parse_args(argv)
+
+    with open(args.templates, "r", encoding="utf-8") as f:
+        templates = json.load(f)
+
+    report = {"metadata": _metadata(), "repeat": args.repeat, "seed": args.seed, "results": {}}
+    with tempfile.TemporaryDirectory(prefix="benchmark_") as workdir:
+        for size in args.sizes:
+            report["results"][str(size)] = run_size(size, templates, args.repeat, args.seed, workdir)
+            contract_store._store = None
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"Benchmark results written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        print(f"Compared with {args.baseline} (commit {baseline.get('metadata', {}).get('commit')}):")
+        print("\n".join(compare_results(baseline, report)))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,296 @@
+"""
+Import en masse de PDF de contrats
+Une archive ZIP et un manifeste des niveaux par fichier ; les extractions tournent en parallèle
+(bornées, sous le limiteur Gemini partagé) et les niveaux extraits sont ajoutés au catalogue par lots
+"""
+
+import hashlib
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+import uuid
+import zipfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, Dict, List, Tuple, Union
+
+from werkzeug.utils import secure_filename
+
+import pdf_json
+from contract_store import get_store
+from extraction_jobs import EXTRACT_WORKERS
+from value_analyzer import normalize_contract
+
+BULK_CONCURRENCY = int(os.environ.get("BULK_CONCURRENCY", max(EXTRACT_WORKERS, 4)))
+BULK_MAX_FILES = int(os.environ.get("BULK_MAX_FILES", 200))
+BULK_MAX_FILE_SIZE = int(os.environ.get("BULK_MAX_FILE_SIZE", 50 * 1024 * 1024))
+BULK_COMMIT_BATCH = int(os.environ.get("BULK_COMMIT_BATCH", 25))
+
+MANIFEST_NAME = "manifest.json"
+
+logger = logging.getLogger(__name__)
+
+
+class BulkImportError(ValueError):
+    """Archive ou manifeste invalide"""
+
+
+def parse_manifest(text: str) -> Dict[str, Union[List[str], str]]:
+    """
+    Lit le manifeste : {"fichier.pdf": ["Niveau 1", "Niveau 2"]}, {"fichier.pdf": "Niveau 1"}
+    ou {"fichier.pdf": "all"}
+
+    Args:
+        text (str): Contenu JSON du manifeste
+
+    Returns:
+        Dict: Niveaux par fichier (liste de noms ou pdf_json.ALL_LEVELS)
+
+    Raises:
+        BulkImportError: Si le manifeste est mal formé
+    """
+    try:
+        manifest = json.loads(text) if text else {}
+    except json.JSONDecodeError as e:
+        raise BulkImportError(f"Manifeste JSON invalide : {e}")
+    if not isinstance(manifest, dict):
+        raise BulkImportError("Le manifeste doit associer chaque fichier à ses niveaux.")
+
+    levels = {}
+    for filename, spec in manifest.items():
+        if spec == pdf_json.ALL_LEVELS:
+            levels[filename] = pdf_json.ALL_LEVELS
+        elif isinstance(spec, str) and spec.strip():
+            levels[filename] = [spec.strip()]
+        elif isinstance(spec, list) and spec and all(isinstance(name, str) and name.strip() for name in spec):
+            levels[filename] = [name.strip() for name in spec]
+        else:
+            raise BulkImportError(f"Niveaux invalides pour {filename} : {spec!r}")
+    return levels
+
+
+def unpack_pdfs(zip_path: str, dest_dir: str) -> Tuple[List[Tuple[str, str]], str]:
+    """
+    Extrait les PDF d'une archive, entrée par entrée, sans charger l'archive en mémoire
+
+    Les chemins de l'archive ne sont jamais utilisés tels quels sur le disque.
+
+    Args:
+        zip_path (str): Archive envoyée
+        dest_dir (str): Dossier de destination
+
+    Returns:
+        tuple: ([(nom dans l'archive, chemin local)], contenu de manifest.json ou "")
+
+    Raises:
+        BulkImportError: Si l'archive est invalide, trop volumineuse ou sans PDF
+    """
+    files, manifest_text = [], ""
+    try:
+        with zipfile.ZipFile(zip_path) as archive:
+            for info in archive.infolist():
+                name = info.filename
+                if info.is_dir() or name.startswith("__MACOSX/"):
+                    continue
+                if os.path.basename(name) == MANIFEST_NAME:
+                    manifest_text = archive.read(info).decode("utf-8")
+                    continue
+                if not name.lower().endswith(".pdf"):
+                    continue
+                if len(files) >= BULK_MAX_FILES:
+                    raise BulkImportError(f"L'archive contient plus de {BULK_MAX_FILES} PDF.")
+                if info.file_size > BULK_MAX_FILE_SIZE:
+                    raise BulkImportError(f"{name} dépasse la taille maximale autorisée.")
+
+                local_path = os.path.join(dest_dir, f"{uuid.uuid4().hex}_{secure_filename(os.path.basename(name))}")
+                with archive.open(info) as source, open(local_path, "wb") as target:
+                    shutil.copyfileobj(source, target, 1024 * 1024)
+                files.append((name, local_path))
+    except (zipfile.BadZipFile, BulkImportError, UnicodeDecodeError) as e:
+        for _, local_path in files:
+            os.remove(local_path)
+        if isinstance(e, BulkImportError):
+            raise
+        raise BulkImportError("Le fichier envoyé n'est pas une archive ZIP valide.")
+
+    if not files:
+        raise BulkImportError("L'archive ne contient aucun PDF.")
+    return files, manifest_text
+
+
+def _levels_for(name: str, manifest: Dict) -> Union[List[str], str]:
+    """Niveaux demandés pour une entrée de l'archive (chemin complet, puis nom de fichier ; tous par défaut)"""
+    return manifest.get(name, manifest.get(os.path.basename(name), pdf_json.ALL_LEVELS))
+
+
+class _CatalogBatcher:
+    """
+    Accumule les niveaux extraits et les ajoute au catalogue par lots (une transaction par lot)
+
+    Un lot refusé par le catalogue est abandonné, jamais repris avec le suivant : ses niveaux sont
+    comptés dans failed et ses fichiers dans failed_files, pour que l'avancement reflète le catalogue.
+    """
+
+    def __init__(self, batch_size: int = BULK_COMMIT_BATCH):
+        self.batch_size = batch_size
+        self.committed = 0
+        self.failed = 0
+        self.failed_files: List[str] = []
+        self._pending: List[Tuple[str, List[Dict]]] = []
+        self._lock = threading.Lock()
+
+    def add(self, name: str, levels: List[Dict]):
+        with self._lock:
+            self._pending.append((name, levels))
+            if sum(len(pending) for _, pending in self._pending) >= self.batch_size:
+                self._flush()
+
+    def flush(self):
+        with self._lock:
+            self._flush()
+
+    def _flush(self):
+        batch = [level for _, levels in self._pending for level in levels]
+        names = [name for name, _ in self._pending]
+        self._pending = []
+        if not batch:
+            return
+        try:
+            get_store().add_many(batch)
+        except Exception as e:
+            logger.error("Bulk import: catalog commit of %d levels failed (%s): %s", len(batch), ", ".join(names), e)
+            self.failed += len(batch)
+            self.failed_files.extend(names)
+            return
+        self.committed += len(batch)
+        logger.info("Bulk import: committed %d levels to the catalog", len(batch))
+
+
+def _output_name(name: str) -> str:
+    """
+    Nom du JSON extrait pour une entrée de l'archive
+
+    Construit à partir du chemin complet dans l'archive, avec une empreinte de ce chemin :
+    deux fichiers homonymes de dossiers différents ne s'écrasent pas.
+    """
+    stem = secure_filename(os.path.splitext(name)[0]) or "contrat"
+    digest = hashlib.sha256(name.encode("utf-8")).hexdigest()[:8]
+    return f"{int(time.time())}_{stem}_{digest}.json"
+
+
+def _extract_file(pdf_path: str, level_names: Union[List[str], str], force: bool):
+    """Extrait un fichier ; retourne la liste des niveaux ou lève une erreur explicite"""
+    if level_names != pdf_json.ALL_LEVELS and len(level_names) == 1:
+        extracted = pdf_json.extract_contract_level_from_pdf(pdf_path, level_names[0], force=force)
+    else:
+        extracted = pdf_json.extract_contract_levels_from_pdf(pdf_path, level_names, force=force)
+
+    if isinstance(extracted, dict):
+        raise RuntimeError(extracted.get("error", "Extraction impossible"))
+    levels = pdf_json.parse_extraction_output(extracted)
+    levels = levels if isinstance(levels, list) else [levels]
+    return [normalize_contract(level) for level in levels if isinstance(level, dict)]
+
+
+def run_bulk_import(report: Callable[[Dict], None], files: List[Tuple[str, str]], manifest: Dict,
+                    force: bool = False, append: bool = True, extractions_dir: str = "extractions"):
+    """
+    Extrait tous les PDF d'une archive et publie l'avancement fichier par fichier
+
+    Args:
+        report (Callable): Publie le résultat provisoire (voir JobQueue.submit_with_progress)
+        files (List[Tuple[str, str]]): Résultat de unpack_pdfs
+        manifest (Dict): Résultat de parse_manifest
+        force (bool): Ignore le cache des extractions
+        append (bool): Ajoute les niveaux extraits au catalogue
+        extractions_dir (str): Dossier où sont enregistrés les JSON extraits
+
+    Returns:
+        tuple: (résultat final, code HTTP)
+    """
+    # total, completed, done et failed comptent des fichiers (extraction) ; levels, committed et
+    # append_failed des niveaux (ajout au catalogue)
+    progress = {
+        "total": len(files),
+        "completed": 0,
+        "done": 0,
+        "failed": 0,
+        "levels": 0,
+        "committed": 0,
+        "append_failed": 0,
+        "files": {name: {"status": "queued"} for name, _ in files},
+    }
+    # Entrées du manifeste absentes de l'archive : comptées comme fichiers en échec
+    archived = {name for name, _ in files} | {os.path.basename(name) for name, _ in files}
+    for name in manifest:
+        if name not in archived:
+            progress["files"][name] = {"status": "failed", "error": "Fichier absent de l'archive"}
+            progress["total"] += 1
+            progress["completed"] += 1
+            progress["failed"] += 1
+
+    lock = threading.Lock()
+    batcher = _CatalogBatcher()
+    started = time.time()
+
+    def publish():
+        progress["committed"] = batcher.committed
+        progress["append_failed"] = batcher.failed
+        progress["elapsed"] = round(time.time() - started, 1)
+        report(json.loads(json.dumps(progress)))
+
+    def process(name: str, pdf_path: str):
+        with lock:
+            progress["files"][name] = {"status": "running"}
+            publish()
+        try:
+            levels = _extract_file(pdf_path, _levels_for(name, manifest), force)
+            output_path = os.path.join(extractions_dir, _output_name(name))
+            with open(output_path, "w", encoding="utf-8") as f:
+                json.dump(levels, f, ensure_ascii=False, indent=4)
+        except Exception as e:
+            logger.warning("Bulk import: extraction failed for %s: %s", name, e)
+            return {"status": "failed", "error": str(e)}
+        finally:
+            if os.path.exists(pdf_path):
+                os.remove(pdf_path)
+
+        # Hors du try : un échec d'ajout au catalogue n'est pas un échec d'extraction (voir _CatalogBatcher)
+        if append:
+            batcher.add(name, levels)
+        return {"status": "done", "levels": len(levels), "level_ids": [l.get("level_id") for l in levels]}
+
+    with ThreadPoolExecutor(max_workers=BULK_CONCURRENCY, thread_name_prefix="bulk") as pool:
+        futures = {pool.submit(process, name, path): name for name, path in files}
+        for future in as_completed(futures):
+            result = future.result()
+            with lock:
+                progress["files"][futures[future]] = result
+                progress["completed"] += 1
+                if result["status"] == "failed":
+                    progress["failed"] += 1
+                else:
+                    progress["done"] += 1
+                    progress["levels"] += result["levels"]
+                publish()
+
+    batcher.flush()
+    progress["committed"] = batcher.committed
+    progress["append_failed"] = batcher.failed
+    progress["elapsed"] = round(time.time() - started, 1)
+    # Extraction réussie (JSON conservé dans extractions_dir) mais niveaux absents du catalogue
+    for name in batcher.failed_files:
+        progress["files"][name]["appended"] = False
+    if batcher.failed:
+        progress["error"] = f"{batcher.failed} niveaux extraits n'ont pas pu être ajoutés au catalogue."
+    logger.info("Bulk import finished: %d/%d files done, %d failed, %d levels extracted (%d committed, "
+                "%d not appended) in %ss", progress["done"], progress["total"], progress["failed"],
+                progress["levels"], progress["committed"], progress["append_failed"], progress["elapsed"])
+
+    if "error" in progress:
+        return progress, 500
+    if not progress["levels"]:
+        return progress, 400
+    return progress, 200
@@ -0,0 +1,192 @@
+"""
+Réponses de /api/contracts mises en cache
+Corps JSON sérialisés une fois par version du catalogue et par requête (projection, filtres, page),
+avec leurs variantes gzip et brotli précompressées et un ETag fort
+"""
+
+import base64
+import gzip
+import hashlib
+import json
+import os
+import threading
+import unicodedata
+from typing import List, Optional
+
+import numpy as np
+
+import guarantee_matrix
+from compare_cache import TTLCache
+from contract_store import ContractStore, get_store
+from guarantee_matrix import GuaranteeMatrix
+from value_analyzer import without_normalized
+
+try:
+    import brotli
+except ImportError:  # Installation sans brotli : seules les variantes identity et gzip sont servies
+    brotli = None
+
+CATALOG_CACHE_SIZE = int(os.environ.get("CATALOG_CACHE_SIZE", 64))
+CATALOG_CACHE_TTL = float(os.environ.get("CATALOG_CACHE_TTL", 3600))
+CATALOG_MAX_PAGE_SIZE = int(os.environ.get("CATALOG_MAX_PAGE_SIZE", 500))
+
+# Les corps plus petits ne sont pas compressés
+COMPRESS_MIN_SIZE = 1024
+
+
+def _normalize_type(contract_type: str) -> str:
+    """Forme comparable d'un contract_type, malgré les variantes d'écriture (casse, accents, tirets)"""
+    text = unicodedata.normalize("NFKD", contract_type or "")
+    text = "".join(char for char in text if not unicodedata.combining(char))
+    return text.lower().replace("-", "").replace(" ", "")
+
+
+def _map_distinct(column: np.ndarray, function) -> np.ndarray:
+    """Applique function une fois par valeur distincte d'une colonne de chaînes"""
+    if not len(column):
+        return np.array([], dtype=object)
+    unique, inverse = np.unique(column.astype(str), return_inverse=True)
+    return np.array([function(value) for value in unique], dtype=object)[inverse]
+
+
+def encode_cursor(contract_id: int) -> str:
+    return base64.urlsafe_b64encode(f"after:{contract_id}".encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> int:
+    """
+    Raises:
+        ValueError: Si le curseur n'a pas été produit par encode_cursor
+    """
+    try:
+        text = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        prefix, contract_id = text.split(":", 1)
+        if prefix != "after":
+            raise ValueError
+        return int(contract_id)
+    except (ValueError, UnicodeDecodeError):
+        raise ValueError(f"Curseur invalide : {cursor}")
+
+
+class CatalogPayload:
+    """Corps sérialisé d'une réponse, avec ses variantes compressées"""
+
+    def __init__(self, data):
+        self.body = json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        self.etag = hashlib.sha256(self.body).hexdigest()[:32]
+        self.encodings = {"identity": self.body}
+        if len(self.body) >= COMPRESS_MIN_SIZE:
+            self.encodings["gzip"] = gzip.compress(self.body, compresslevel=9, mtime=0)
+            if brotli is not None:
+                self.encodings["br"] = brotli.compress(self.body)
+
+    def etag_for(self, encoding: str) -> str:
+        """ETag fort de chaque variante : le codage fait partie de la représentation"""
+        return self.etag if encoding == "identity" else f"{self.etag}-{encoding}"
+
+    def etags(self) -> List[str]:
+        return [self.etag_for(encoding) for encoding in self.encodings]
+
+
+class CatalogCache:
+    """Réponses de /api/contracts, vidées automatiquement à chaque modification du catalogue"""
+
+    def __init__(self, store: ContractStore, maxsize: int = CATALOG_CACHE_SIZE, ttl: float = CATALOG_CACHE_TTL):
+        self.store = store
+        self._payloads = TTLCache(maxsize, ttl)
+        self._matrix: Optional[GuaranteeMatrix] = None
+        self._insurers: Optional[np.ndarray] = None
+        self._types: Optional[np.ndarray] = None
+        self._lock = threading.Lock()
+
+    def _snapshot(self) -> tuple:
+        """
+        Matrice de la version courante du catalogue, avec ses colonnes de filtrage
+
+        Les niveaux restent dans l'instantané partagé (voir catalog_snapshot) : seules les colonnes
+        assureur et type, une référence par niveau vers quelques chaînes distinctes, sont gardées ici.
+        """
+        matrix = guarantee_matrix.get_guarantee_matrix(self.store)
+        with self._lock:
+            if matrix is not self._matrix:
+                self._insurers = _map_distinct(matrix.text_column("insurer"), str.lower)
+                self._types = _map_distinct(matrix.text_column("contract_type"), _normalize_type)
+                self._payloads.clear()
+                self._matrix = matrix
+            return self._matrix, self._insurers, self._types
+
+    def get(self, fields: Optional[List[str]] = None, insurer: Optional[List[str]] = None,
+            contract_type: Optional[List[str]] = None, limit: Optional[int] = None,
+            cursor: Optional[str] = None) -> CatalogPayload:
+        """
+        Réponse de /api/contracts pour une requête
+
+        Sans limit, le corps est la liste des niveaux (format contracts.json) ; avec limit,
+        {"items": [...], "next_cursor": ...}, next_cursor valant null sur la dernière page.
+
+        Args:
+            fields (List[str]): Clés de premier niveau à conserver (toutes par défaut)
+            insurer (List[str]): Assureurs acceptés (sans tenir compte de la casse)
+            contract_type (List[str]): Types de contrat acceptés (variantes d'écriture confondues)
+            limit (int): Taille de page, au plus CATALOG_MAX_PAGE_SIZE
+            cursor (str): next_cursor de la page précédente
+
+        Raises:
+            ValueError: Si limit ou cursor est invalide
+        """
+        if limit is not None and not 1 <= limit <= CATALOG_MAX_PAGE_SIZE:
+            raise ValueError(f"limit doit être compris entre 1 et {CATALOG_MAX_PAGE_SIZE}")
+        after = decode_cursor(cursor) if cursor else None
+        if after is not None and limit is None:
+            raise ValueError("cursor nécessite limit")
+
+        snapshot = self._snapshot()
+        key = (
+            tuple(fields) if fields else None,
+            tuple(sorted(name.lower() for name in insurer)) if insurer else None,
+            tuple(sorted(_normalize_type(t) for t in contract_type)) if contract_type else None,
+            limit,
+            after,
+        )
+        payload = self._payloads.get(key)
+        if payload is None:
+            payload = CatalogPayload(self._build(*snapshot, *key))
+            self._payloads.set(key, payload)
+        return payload
+
+    @staticmethod
+    def _build(matrix: GuaranteeMatrix, insurer_column: np.ndarray, type_column: np.ndarray,
+               fields, insurers, contract_types, limit, after):
+        selected = np.ones(len(matrix), dtype=bool)
+        if after is not None:
+            selected &= matrix.contract_ids > after
+        if insurers is not None:
+            selected &= np.isin(insurer_column, list(insurers))
+        if contract_types is not None:
+            selected &= np.isin(type_column, list(contract_types))
+        rows = np.flatnonzero(selected)
+
+        next_cursor = None
+        if limit is not None and len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_cursor(int(matrix.contract_ids[rows[-1]]))
+
+        # Niveaux décodés un à un depuis l'instantané, le temps de sérialiser la réponse
+        items = []
+        for row in rows.tolist():
+            contract = without_normalized(matrix.contracts[row])
+            items.append({name: contract[name] for name in fields if name in contract} if fields else contract)
+        return items if limit is None else {"items": items, "next_cursor": next_cursor}
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_catalog_cache() -> CatalogCache:
+    """Cache partagé des réponses du catalogue, créé au premier appel"""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = CatalogCache(get_store())
+        return _cache
@@ -0,0 +1,294 @@
+"""
+Instantané binaire du catalogue compilé, partagé entre workers par mmap
+Colonnes numériques à largeur fixe, table de chaînes internées (assureurs, contrats, niveaux)
+et niveaux JSON décodés à la demande : N workers lisent la même copie physique du fichier
+"""
+
+import json
+import logging
+import mmap
+import os
+import struct
+from collections.abc import Sequence
+from contextlib import contextmanager
+from functools import lru_cache
+from typing import Dict, List, Optional
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows : pas de verrou, l'écriture reste atomique et la version est vérifiée après projection
+    fcntl = None
+
+from guarantee_matrix import TEXT_FIELDS, GuaranteeMatrix
+
+logger = logging.getLogger(__name__)
+
+# Niveaux décodés gardés en mémoire par worker (lignes les plus demandées)
+SNAPSHOT_RECORD_CACHE = int(os.environ.get("SNAPSHOT_RECORD_CACHE", 1024))
+
+MAGIC = b"BRKSNAP3"
+# magic, identité de la base (ContractStore.catalog_id), version du catalogue, niveaux, garanties,
+# chaînes internées
+HEADER = struct.Struct("<8s32sQQQQ")
+
+# Sections, dans l'ordre du fichier ; chacune commence sur un multiple de 8 octets
+SECTIONS = (
+    ("values", np.float64),          # (niveaux, garanties)
+    ("units", np.int8),              # (niveaux, garanties)
+    ("is_addition", np.bool_),       # (niveaux, garanties)
+    ("level_id_order", np.int64),    # (niveaux,)
+    ("contract_ids", np.int64),      # (niveaux,) : identifiants internes du catalogue
+    ("texts", np.int32),             # (niveaux, TEXT_FIELDS) : indices dans la table de chaînes
+    ("column_names", np.int32),      # (garanties,)
+    ("column_categories", np.int32), # (garanties,)
+    ("string_offsets", np.uint64),   # (chaînes + 1,)
+    ("strings", np.uint8),           # UTF-8, concaténées
+    ("record_offsets", np.uint64),   # (niveaux + 1,)
+    ("records", np.uint8),           # niveaux au format JSON, concaténés
+)
+SECTION_TABLE = struct.Struct("<" + "QQ" * len(SECTIONS))
+ALIGNMENT = 8
+
+
+def snapshot_path(db_path: str) -> str:
+    """Instantané associé à une base de catalogue, à côté d'elle"""
+    return f"{db_path}.snapshot"
+
+
+def _concat(blobs: List[bytes]) -> tuple:
+    """(décalages, octets) de blobs mis bout à bout"""
+    offsets = np.zeros(len(blobs) + 1, dtype=np.uint64)
+    offsets[1:] = np.cumsum([len(blob) for blob in blobs], dtype=np.uint64)
+    return offsets, np.frombuffer(b"".join(blobs), dtype=np.uint8)
+
+
+def write_snapshot(matrix: GuaranteeMatrix, version: int, catalog_id: str, path: str):
+    """
+    Écrit l'instantané d'une matrice compilée (écriture atomique)
+
+    Args:
+        matrix (GuaranteeMatrix): Matrice compilée à partir du catalogue
+        version (int): Version du catalogue compilé (voir ContractStore.version())
+        catalog_id (str): Identité de la base compilée (voir ContractStore.catalog_id)
+        path (str): Fichier de destination, remplacé d'un bloc
+    """
+    strings: Dict[str, int] = {}
+
+    def intern(text) -> int:
+        return strings.setdefault(str(text or ""), len(strings))
+
+    texts = np.array(
+        [[intern(contract.get(field)) for field in TEXT_FIELDS] for contract in matrix.contracts],
+        dtype=np.int32,
+    ).reshape(len(matrix), len(TEXT_FIELDS))
+    column_names = np.array([intern(name) for name in matrix.columns], dtype=np.int32)
+    column_categories = np.array([intern(matrix.column_categories[name]) for name in matrix.columns], dtype=np.int32)
+    string_offsets, string_bytes = _concat([text.encode("utf-8") for text in strings])
+    record_offsets, record_bytes = _concat([
+        json.dumps(contract, ensure_ascii=False, separators=(",", ":")).encode("utf-8") for contract in matrix.contracts
+    ])
+
+    arrays = {
+        "values": matrix.values, "units": matrix.units, "is_addition": matrix.is_addition,
+        "level_id_order": matrix.level_id_order, "contract_ids": matrix.contract_ids, "texts": texts,
+        "column_names": column_names, "column_categories": column_categories,
+        "string_offsets": string_offsets, "strings": string_bytes,
+        "record_offsets": record_offsets, "records": record_bytes,
+    }
+    table, position = [], HEADER.size + SECTION_TABLE.size
+    for name, dtype in SECTIONS:
+        position += -position % ALIGNMENT
+        size = np.ascontiguousarray(arrays[name], dtype=dtype).nbytes
+        table += [position, size]
+        position += size
+
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, catalog_id.encode("ascii"), version, len(matrix), len(matrix.columns), len(strings)))
+        f.write(SECTION_TABLE.pack(*table))
+        for (name, dtype), offset in zip(SECTIONS, table[::2]):
+            f.write(b"\0" * (offset - f.tell()))
+            f.write(np.ascontiguousarray(arrays[name], dtype=dtype).tobytes())
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def read_version(path: str, catalog_id: str) -> Optional[int]:
+    """Version du catalogue d'un instantané, None s'il est absent, illisible ou compilé depuis une autre base"""
+    try:
+        with open(path, "rb") as f:
+            magic, snapshot_id, version, *_ = HEADER.unpack(f.read(HEADER.size))
+    except (OSError, struct.error):
+        return None
+    return version if magic == MAGIC and snapshot_id.decode("ascii", "replace") == catalog_id else None
+
+
+@contextmanager
+def _build_lock(path: str):
+    """Verrou exclusif entre processus sur la reconstruction d'un instantané"""
+    with open(f"{path}.lock", "a") as lock:
+        if fcntl is not None:
+            fcntl.flock(lock.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock.fileno(), fcntl.LOCK_UN)
+
+
+class SnapshotContracts(Sequence):
+    """Niveaux de l'instantané, décodés à l'accès (les plus demandés restent en cache)"""
+
+    def __init__(self, offsets: np.ndarray, records: np.ndarray):
+        self._offsets = offsets
+        self._records = records
+        self._decode = lru_cache(maxsize=SNAPSHOT_RECORD_CACHE)(self._decode_row)
+
+    def _decode_row(self, row: int) -> Dict:
+        start, stop = int(self._offsets[row]), int(self._offsets[row + 1])
+        return json.loads(self._records[start:stop].tobytes())
+
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
+
+    def __getitem__(self, row):
+        if isinstance(row, slice):
+            return [self[i] for i in range(*row.indices(len(self)))]
+        row = int(row)
+        if row < 0:
+            row += len(self)
+        if not 0 <= row < len(self):
+            raise IndexError(row)
+        return self._decode(row)
+
+    def __iter__(self):
+        # Parcours complet sans passer par le cache, qui en évincerait les niveaux les plus demandés
+        return (self._decode_row(row) for row in range(len(self)))
+
+
+class SnapshotMatrix(GuaranteeMatrix):
+    """
+    Matrice compilée lue dans un instantané projeté en mémoire, sans copie
+
+    Les tableaux NumPy sont des vues en lecture seule sur le fichier ; seuls les noms des
+    garanties et les niveaux effectivement consultés sont décodés dans le worker.
+    """
+
+    def __init__(self, path: str):
+        """
+        Args:
+            path (str): Instantané écrit par write_snapshot
+
+        Raises:
+            ValueError: Si le fichier n'est pas un instantané valide
+        """
+        with open(path, "rb") as f:
+            # La projection reste valide après le remplacement du fichier par un nouvel instantané
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        buffer = memoryview(self._mmap)
+        try:
+            magic, catalog_id, self.version, rows, columns, _ = HEADER.unpack_from(buffer)
+            table = SECTION_TABLE.unpack_from(buffer, HEADER.size)
+        except struct.error:
+            raise ValueError(f"Instantané tronqué : {path}")
+        if magic != MAGIC:
+            raise ValueError(f"Format d'instantané inconnu : {path}")
+
+        sections = {}
+        for (name, dtype), offset, size in zip(SECTIONS, table[::2], table[1::2]):
+            if offset + size > len(buffer):
+                raise ValueError(f"Instantané tronqué : {path}")
+            sections[name] = np.frombuffer(buffer, dtype=dtype, count=size // np.dtype(dtype).itemsize, offset=offset)
+
+        self.path = path
+        self.catalog_id = catalog_id.decode("ascii", "replace")
+        self.values = sections["values"].reshape(rows, columns)
+        self.units = sections["units"].reshape(rows, columns)
+        self.is_addition = sections["is_addition"].reshape(rows, columns)
+        self.level_id_order = sections["level_id_order"]
+        self.contract_ids = sections["contract_ids"]
+        self._texts = sections["texts"].reshape(rows, len(TEXT_FIELDS))
+        self._string_offsets = sections["string_offsets"]
+        self._strings = sections["strings"]
+        self._string = lru_cache(maxsize=None)(self._decode_string)
+
+        self.columns = [self._string(i) for i in sections["column_names"]]
+        self.column_categories = {
+            name: self._string(i) for name, i in zip(self.columns, sections["column_categories"])
+        }
+        self.column_index = {name: j for j, name in enumerate(self.columns)}
+        self.contracts = SnapshotContracts(sections["record_offsets"], sections["records"])
+
+    def _decode_string(self, index: int) -> str:
+        start, stop = int(self._string_offsets[index]), int(self._string_offsets[index + 1])
+        return self._strings[start:stop].tobytes().decode("utf-8")
+
+    def text(self, row: int, field: str) -> str:
+        return self._string(int(self._texts[row, TEXT_FIELDS.index(field)]))
+
+    def text_column(self, field: str) -> np.ndarray:
+        # Une seule chaîne décodée par valeur distincte
+        unique, inverse = np.unique(self._texts[:, TEXT_FIELDS.index(field)], return_inverse=True)
+        return np.array([self._string(int(i)) for i in unique], dtype=object)[inverse]
+
+
+def compile_matrix(store) -> tuple:
+    """
+    Matrice compilée en mémoire à partir du catalogue, avec les identifiants internes des niveaux
+
+    Returns:
+        tuple: (version des niveaux compilés, GuaranteeMatrix), lus dans une même transaction
+    """
+    version, rows = store.versioned_rows()
+    return version, GuaranteeMatrix([contract for _, contract in rows], contract_ids=[cid for cid, _ in rows])
+
+
+def load_or_build(store, version: int) -> GuaranteeMatrix:
+    """
+    Matrice de la version courante du catalogue, depuis l'instantané partagé
+
+    L'instantané est (ré)écrit quand il est plus ancien que le catalogue ou compilé depuis une
+    autre base (base supprimée puis recréée : sa version repart de zéro), sous un verrou : les
+    workers qui attendent le trouvent ensuite à jour et se contentent de le projeter en mémoire,
+    et un worker en retard n'écrase jamais un instantané plus récent. L'instantané porte la
+    version lue avec ses niveaux, dans la même transaction. Si le fichier ne peut pas être
+    écrit, ou si l'instantané projeté n'est pas au moins de cette version et de cette base, la
+    matrice est compilée en mémoire comme auparavant.
+
+    Args:
+        store (ContractStore): Catalogue source
+        version (int): Version courante du catalogue
+
+    Returns:
+        GuaranteeMatrix: SnapshotMatrix, ou GuaranteeMatrix en mémoire à défaut
+    """
+    path = snapshot_path(store.db_path)
+    if (read_version(path, store.catalog_id) or 0) < version:
+        matrix = None
+        try:
+            with _build_lock(path):
+                # Relu sous le verrou : un autre worker a pu l'écrire pendant l'attente
+                if (read_version(path, store.catalog_id) or 0) < version:
+                    built_version, matrix = compile_matrix(store)
+                    write_snapshot(matrix, built_version, store.catalog_id, path)
+                    logger.info("Wrote catalog snapshot %s (version %d)", path, built_version)
+        except OSError as e:
+            logger.warning("Could not write catalog snapshot %s, keeping the matrix in memory: %s", path, e)
+            return matrix if matrix is not None else compile_matrix(store)[1]
+    try:
+        matrix = SnapshotMatrix(path)
+    except (OSError, ValueError) as e:
+        logger.warning("Could not map catalog snapshot %s, compiling in memory: %s", path, e)
+        return compile_matrix(store)[1]
+    if matrix.catalog_id != store.catalog_id or matrix.version < version:
+        # Instantané remplacé entre la vérification et la projection par celui d'une autre base
+        # ou d'une version plus ancienne
+        logger.warning("Catalog snapshot %s holds version %d of catalog %s, not %d of %s: compiling in memory",
+                       path, matrix.version, matrix.catalog_id, version, store.catalog_id)
+        return compile_matrix(store)[1]
+    # Une version plus récente que celle demandée est servie telle quelle : elle ne contient que des
+    # niveaux du catalogue courant, et la prochaine lecture de version la rechargera
+    return matrix
@@ -0,0 +1,269 @@
+"""
+Classement des combinaisons contrat de base + surcomplémentaire
+Les garanties additives des surcomplémentaires (ex: "+100% BR", "+30 €") s'ajoutent à celles
+de la base ; la recherche par séparation et évaluation évite de parcourir toutes les paires
+"""
+
+import heapq
+import os
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from guarantee_matrix import GuaranteeMatrix, unit_code
+from ranking import (
+    BAND_EDGES, BAND_SCORES, RANK1_MAX_RELATIVE_GAP, RANK2_MAX_ABSOLUTE_GAP, TIERS, TOP_N,
+    WEIGHT_COHERENCE, WEIGHT_COVERAGE, WEIGHT_PROXIMITY, _find_guarantee, contract_display_name,
+    parse_user_needs, select_tiers,
+)
+from value_analyzer import GuaranteeAnalyzer
+
+# Au-delà, la recherche par séparation et évaluation revient à énumérer toutes les paires
+COMBINATIONS_MAX_TOP_N = int(os.environ.get("COMBINATIONS_MAX_TOP_N", 100))
+
+
+def is_surcomplementaire(contract: Dict) -> bool:
+    """Reconnaît les surcomplémentaires malgré les variantes d'écriture du contract_type"""
+    contract_type = (contract.get("contract_type") or "").lower().replace("-", "").replace(" ", "")
+    return "surcompl" in contract_type or "sucompl" in contract_type
+
+
+def guarantee_scores(values: np.ndarray, comparable: np.ndarray, need_values: np.ndarray) -> np.ndarray:
+    """
+    Contribution de chaque garantie au score de ranking.score_profile
+
+    Le score global est la moyenne de ces contributions : il se décompose garantie par garantie.
+
+    Args:
+        values (np.ndarray): Valeurs, de forme (..., besoins)
+        comparable (np.ndarray): Masque des valeurs dans l'unité du besoin
+        need_values (np.ndarray): Valeurs demandées
+
+    Returns:
+        np.ndarray: Contributions, de même forme que values
+    """
+    relative_gap = np.abs(values - need_values) / need_values
+    band = BAND_SCORES[np.searchsorted(BAND_EDGES, relative_gap)]
+    covered = values >= need_values
+    return np.where(
+        comparable,
+        WEIGHT_PROXIMITY * band + WEIGHT_COVERAGE * covered + WEIGHT_COHERENCE,
+        0.0,
+    )
+
+
+class CombinationSearch:
+    """Évaluation des paires base + surcomplémentaire pour un profil donné"""
+
+    def __init__(self, matrix: GuaranteeMatrix, needs: List[Dict]):
+        self.matrix = matrix
+        self.needs = needs
+        self.need_values = np.array([need["value"] for need in needs], dtype=np.float64)
+        need_units = np.array([unit_code(need["type"], need["value"]) for need in needs], dtype=np.int8)
+
+        values, units, is_addition = matrix.gather([need["guarantee"] for need in needs])
+        matches = units == need_units
+        # Un test par contract_type distinct, sans décoder les niveaux
+        contract_types, inverse = np.unique(matrix.text_column("contract_type"), return_inverse=True)
+        surco_mask = np.array([is_surcomplementaire({"contract_type": t}) for t in contract_types], dtype=bool)[inverse]
+        self.bases = np.flatnonzero(~surco_mask)
+        self.surcos = np.flatnonzero(surco_mask)
+
+        # Bases : valeur dans l'unité du besoin, 0 sinon
+        self.base_ok = matches[self.bases]
+        self.base_values = np.where(self.base_ok, values[self.bases], 0.0)
+
+        # Surcomplémentaires : montants additifs ou niveaux absolus, dans l'unité du besoin
+        surco_matches = matches[self.surcos]
+        surco_additive = is_addition[self.surcos]
+        self.surco_add = np.where(surco_matches & surco_additive, values[self.surcos], 0.0)
+        self.surco_abs = np.where(surco_matches & ~surco_additive, values[self.surcos], 0.0)
+        self.surco_ok = surco_matches
+
+        # Valeurs triées par garantie, pour les bornes supérieures
+        self._sorted_add = [np.unique(self.surco_add[surco_matches[:, k] & surco_additive[:, k], k])
+                            for k in range(len(needs))]
+        self._sorted_abs = [np.unique(self.surco_abs[surco_matches[:, k] & ~surco_additive[:, k], k])
+                            for k in range(len(needs))]
+
+    def combine(self, base: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Valeurs combinées d'une base avec chaque surcomplémentaire
+
+        Additif : base + surco ; absolu : le plus élevé des deux ; absent : la base seule.
+
+        Returns:
+            tuple: (valeurs, masque comparable), de forme (surcos, besoins)
+        """
+        base_values = self.base_values[base]
+        combined = np.maximum(base_values + self.surco_add, self.surco_abs)
+        return combined, self.base_ok[base] | self.surco_ok
+
+    def pair_scores(self, base: int) -> np.ndarray:
+        """Score de chaque paire (base, surcomplémentaire)"""
+        if not self.needs:
+            return np.ones(len(self.surcos))
+        combined, comparable = self.combine(base)
+        return guarantee_scores(combined, comparable, self.need_values).mean(axis=1)
+
+    def upper_bounds(self) -> np.ndarray:
+        """
+        Meilleur score atteignable par chaque base, toutes surcomplémentaires confondues
+
+        Chaque contribution croît jusqu'au besoin puis décroît : pour chaque garantie, il suffit
+        d'examiner les valeurs combinées encadrant le besoin (recherche dichotomique).
+
+        Returns:
+            np.ndarray: Une borne par base
+        """
+        if not self.needs:
+            return np.ones(len(self.bases))
+        best = np.zeros((len(self.bases), len(self.needs)))
+        for k, need_value in enumerate(self.need_values):
+            base_values = self.base_values[:, k]
+            base_ok = self.base_ok[:, k]
+            # La base seule (surcomplémentaire sans cette garantie ou inférieure)
+            candidates = [(base_values, base_ok)]
+
+            additive = self._sorted_add[k]
+            if len(additive):
+                idx = np.searchsorted(additive, need_value - base_values)
+                for j in (np.clip(idx - 1, 0, len(additive) - 1), np.clip(idx, 0, len(additive) - 1)):
+                    candidates.append((base_values + additive[j], np.ones(len(base_values), dtype=bool)))
+
+            absolute = self._sorted_abs[k]
+            if len(absolute):
+                idx = np.searchsorted(absolute, np.maximum(need_value, base_values))
+                for j in (np.clip(idx - 1, 0, len(absolute) - 1), np.clip(idx, 0, len(absolute) - 1)):
+                    candidates.append((np.maximum(base_values, absolute[j]), np.ones(len(base_values), dtype=bool)))
+
+            for values, comparable in candidates:
+                best[:, k] = np.maximum(best[:, k], guarantee_scores(values, comparable, need_value))
+        return best.mean(axis=1)
+
+    def search(self, top_n: int) -> Tuple[List[Tuple[float, int, int]], Dict]:
+        """
+        Les top_n meilleures paires, par séparation et évaluation
+
+        Les bases sont examinées par borne décroissante ; la recherche s'arrête dès que
+        la borne de la base suivante ne peut plus battre la moins bonne paire retenue.
+
+        Returns:
+            tuple: ([(score, base, surco)] du meilleur au moins bon, statistiques)
+        """
+        heap: List[Tuple[float, int, int]] = []   # (score, -base, -surco) : la moins bonne en tête
+        explored = 0
+        if len(self.surcos) and top_n > 0:
+            bounds = self.upper_bounds()
+            for base in np.argsort(-bounds, kind="stable"):
+                if len(heap) == top_n and bounds[base] <= heap[0][0]:
+                    break
+                explored += 1
+                scores = self.pair_scores(base)
+                for surco in np.argsort(-scores, kind="stable")[:top_n]:
+                    candidate = (float(scores[surco]), -int(base), -int(surco))
+                    if len(heap) < top_n:
+                        heapq.heappush(heap, candidate)
+                    elif candidate > heap[0]:
+                        heapq.heapreplace(heap, candidate)
+                    else:
+                        break
+
+        pairs = sorted(((score, -neg_base, -neg_surco) for score, neg_base, neg_surco in heap),
+                       key=lambda pair: (-pair[0], pair[1], pair[2]))
+        stats = {
+            "bases": len(self.bases),
+            "surcos": len(self.surcos),
+            "bases_explored": explored,
+            "pairs_evaluated": explored * len(self.surcos),
+        }
+        return pairs, stats
+
+    def build_result(self, score: float, base: int, surco: int) -> Dict:
+        """Détaille une paire au format des résultats de ranking.rank_contracts"""
+        base_contract = self.matrix.contracts[self.bases[base]]
+        surco_contract = self.matrix.contracts[self.surcos[surco]]
+        combined, comparable = self.combine(base)
+        combined, comparable = combined[surco], comparable[surco]
+
+        details = []
+        for k, need in enumerate(self.needs):
+            raw_values = [
+                _find_guarantee(c.get("benefits") or {}, need["category"], need["guarantee"])
+                for c in (base_contract, surco_contract)
+            ]
+            raw_values = [str(raw) for raw in raw_values if raw not in (None, "", "-")]
+            gap = float(combined[k] - need["value"]) if comparable[k] else None
+            details.append({
+                "need": need,
+                "raw_value": " / ".join(raw_values) or None,
+                "value": float(combined[k]) if comparable[k] else None,
+                "gap": gap,
+                "relative_gap": abs(gap) / need["value"] if gap is not None else None,
+                "covered": bool(comparable[k] and gap >= 0),
+            })
+        return {
+            "contract": base_contract,
+            "surco": surco_contract,
+            "name": f"{contract_display_name(base_contract)} + {contract_display_name(surco_contract)}",
+            "details": details,
+            "score": score,
+        }
+
+
+def _tier_masks(results: List[Dict]) -> List[np.ndarray]:
+    """Masques d'éligibilité des paires à chaque palier, dans l'ordre de TIERS (voir ranking._tier_masks)"""
+    def eligible(predicate) -> np.ndarray:
+        return np.array([all(predicate(d) for d in result["details"]) for result in results], dtype=bool)
+
+    return [
+        eligible(lambda d: d["value"] is not None and d["relative_gap"] <= RANK1_MAX_RELATIVE_GAP),
+        eligible(lambda d: d["value"] is not None and abs(d["gap"]) <= RANK2_MAX_ABSOLUTE_GAP),
+        eligible(lambda d: d["covered"]),
+        np.ones(len(results), dtype=bool),
+    ]
+
+
+def rank_combinations(user_data: Dict, matrix: GuaranteeMatrix, top_n: int = TOP_N, stats: Dict = None) -> List[Dict]:
+    """
+    Classe les meilleures paires base + surcomplémentaire pour un profil
+
+    Les paires retenues (meilleurs scores) sont réparties entre les paliers de ranking_logic.md
+    comme les contrats seuls (ranking.select_tiers) : chaque palier prend, dans la limite de ses
+    places, les meilleures paires éligibles restantes, et le dernier palier reçoit le reste.
+
+    Args:
+        user_data (Dict): Profil issu du formulaire
+        matrix (GuaranteeMatrix): Catalogue compilé
+        top_n (int): Nombre de paires à retourner, au plus COMBINATIONS_MAX_TOP_N
+        stats (Dict): Si fourni, reçoit les statistiques de la recherche
+
+    Returns:
+        List[Dict]: Paires classées avec rang, palier et pourcentage de correspondance
+
+    Raises:
+        ValueError: Si top_n est hors de [1, COMBINATIONS_MAX_TOP_N]
+    """
+    if not 1 <= top_n <= COMBINATIONS_MAX_TOP_N:
+        raise ValueError(f"top_n doit être compris entre 1 et {COMBINATIONS_MAX_TOP_N}")
+    search = CombinationSearch(matrix, parse_user_needs(user_data, GuaranteeAnalyzer()))
+    pairs, search_stats = search.search(top_n)
+    if stats is not None:
+        stats.update(search_stats)
+
+    candidates = [search.build_result(score, base, surco) for score, base, surco in pairs]
+    scores = np.array([result["score"] for result in candidates], dtype=np.float64)
+    # Égalités départagées dans l'ordre de la recherche (base puis surcomplémentaire)
+    search_order = np.arange(len(candidates), dtype=np.int64)
+
+    results = []
+    for index, tier_index in select_tiers(scores, _tier_masks(candidates), search_order, len(candidates)):
+        result = candidates[index]
+        _, min_pct, max_pct = TIERS[tier_index]
+        result["tier"] = tier_index + 1
+        result["percentage"] = min_pct + round(result["score"] * (max_pct - min_pct))
+        results.append(result)
+
+    for rank, result in enumerate(results, start=1):
+        result["rank"] = rank
+    return results
@@ -1,38 +1,290 @@
 import json
+import logging
 import os
-import google.generativeai as genai
+import time
 
+import combinations
+import guarantee_matrix
+import ranking
+from compare_cache import CompareCache
+from contract_store import get_store
+from metrics import CACHE_LOOKUPS, MODEL_CALLS, PROMPT_TOKENS, STAGE_SECONDS, record_usage
+from rate_limiter import QuotaExceededError, get_rate_limiter
+from value_analyzer import without_normalized
 
+logger = logging.getLogger(__name__)
 
-def find_top_contracts(user_data):
+# Mode de comparaison par défaut : "local" (moteur de classement) ou "llm" (Gemini)
+COMPARE_MODE = os.environ.get("COMPARE_MODE", "local")
+COMPARE_MODES = ("local", "llm")
+
+# Nombre de contrats présélectionnés localement avant l'envoi au modèle
+LLM_SHORTLIST_SIZE = int(os.environ.get("LLM_SHORTLIST_SIZE", 30))
+
+# /compare attend au plus quelques secondes un jeton, puis répond 429 plutôt que de bloquer la requête
+COMPARE_MAX_WAIT = float(os.environ.get("COMPARE_MAX_WAIT", 5))
+
+PROFILE_ERROR = "Le profil doit être un objet JSON {catégorie: {garantie: valeur}}."
+TABLE_ERROR = "Le modèle n'a pas renvoyé de tableau de contrats exploitable."
+
+# Résultats récents, invalidés à chaque modification du catalogue
+_compare_cache = CompareCache()
+
+# Taille estimée du catalogue complet dans le prompt, par version du catalogue
+_catalog_tokens = {}
+
+
+def estimate_tokens(text):
+    """Estimation grossière du nombre de tokens (environ 4 caractères par token)."""
+    return (len(text) + 3) // 4
+
+
+def _full_catalog_tokens(matrix, catalog_version):
+    """Tokens qu'aurait coûté l'envoi du catalogue complet (format indent=2 historique)."""
+    if catalog_version not in _catalog_tokens:
+        # Longueur de json.dumps(catalogue, indent=2) calculée niveau par niveau, sans construire
+        # la liste ni le texte complets : "[\n", puis chaque niveau indenté de 2 espaces par ligne,
+        # séparés par ",\n", et "\n]"
+        length = 4
+        for contract in matrix.contracts:
+            text = json.dumps(without_normalized(contract), indent=2, ensure_ascii=False)
+            length += len(text) + 2 * (text.count("\n") + 1) + 2
+        length = length - 2 if len(matrix) else 2
+        _catalog_tokens.clear()
+        _catalog_tokens[catalog_version] = (length + 3) // 4   # même arrondi qu'estimate_tokens
+    return _catalog_tokens[catalog_version]
+
+
+def find_top_contracts(user_data, mode=None, stats=None, polish=False):
     """
-    Trouve les 5 meilleurs contrats d'assurance en fonction des données de l'utilisateur en utilisant Gemini Pro.
-    
+    Trouve les 10 meilleurs contrats d'assurance en fonction des données de l'utilisateur.
+
     Args:
         user_data (dict): Un dictionnaire contenant les préférences de l'utilisateur issues du formulaire.
-        
+        mode (str): "local" pour le moteur de classement déterministe, "llm" pour Gemini Pro.
+            Par défaut, la valeur de COMPARE_MODE.
+        stats (dict): Si fourni, reçoit les statistiques du prompt en mode "llm"
+            (contrats présélectionnés, tokens économisés).
+        polish (bool): En mode "local", fait reformuler les points forts / faibles par Gemini ;
+            le tableau local est retourné tel quel si le modèle est indisponible.
+
     Returns:
-        list: Une liste des 5 meilleurs contrats recommandés.
+        str or dict: Le tableau Markdown des contrats recommandés, ou un dictionnaire d'erreur.
     """
-    print("--- In find_top_contracts ---")
-    print(f"User data received: {json.dumps(user_data, indent=2)}")
-    
+    mode = (mode or COMPARE_MODE).lower()
+    if mode not in COMPARE_MODES:
+        return {"error": f"Mode de comparaison inconnu : {mode}"}
+    if not isinstance(user_data, dict):
+        return {"error": PROFILE_ERROR}
+
     try:
-        # Assurez-vous que votre clé API est définie comme variable d'environnement
-        api_key = os.environ.get("GOOGLE_API_KEY")
-        if not api_key:
-            print("ERROR: GOOGLE_API_KEY environment variable not set.")
-            raise ValueError("La variable d'environnement GOOGLE_API_KEY n'est pas définie.")
-        
-        print("Successfully retrieved GOOGLE_API_KEY.")
+        catalog_version = get_store().version()
+    except Exception as e:
+        logger.error("An error occurred while reading the catalog version: %s", e)
+        return {"error": "Le catalogue de contrats est indisponible."}
+
+    polish = polish and mode == "local"
+    cache_mode = "local+polish" if polish else mode
+    cached = _compare_cache.get(user_data, cache_mode, catalog_version)
+    CACHE_LOOKUPS.inc(cache="compare", result="miss" if cached is None else "hit")
+    if cached is not None:
+        logger.debug("Compare cache hit")
+        return cached
+
+    if mode == "llm":
+        result = _find_top_contracts_llm(user_data, catalog_version, stats)
+    else:
+        result = _find_top_contracts_local(user_data)
+        if polish and isinstance(result, str):
+            polished = polish_table(result)
+            if polished is None:
+                # Tableau local complet, mais pas mis en cache comme reformulé
+                return result
+            result = polished
+
+    # Les erreurs ne sont pas mises en cache
+    if isinstance(result, str):
+        _compare_cache.set(user_data, cache_mode, catalog_version, result)
+    return result
+
+
+def _find_top_contracts_local(user_data):
+    """
+    Classe les contrats localement selon ranking_logic.md, sans appel au modèle.
+
+    Args:
+        user_data (dict): Les préférences de l'utilisateur issues du formulaire.
+
+    Returns:
+        str or dict: Le tableau Markdown des 10 meilleurs contrats, ou un dictionnaire d'erreur.
+    """
+    try:
+        with STAGE_SECONDS.time(pipeline="compare", stage="catalog_load"):
+            matrix = guarantee_matrix.get_guarantee_matrix()
+        with STAGE_SECONDS.time(pipeline="compare", stage="rank"):
+            ranked = ranking.rank_contracts(user_data, matrix)
+        logger.debug("Local ranking complete: %d contracts selected", len(ranked))
+        with STAGE_SECONDS.time(pipeline="compare", stage="render"):
+            return ranking.render_markdown_table(ranked)
+
+    except (ValueError, json.JSONDecodeError, FileNotFoundError) as e:
+        logger.warning("A validation or JSON error occurred: %s", e)
+        return {"error": str(e)}
+    except Exception as e:
+        logger.exception("An unexpected error occurred in _find_top_contracts_local: %s", e)
+        return {"error": "Une erreur inattendue est survenue lors de la comparaison des contrats."}
+
+
+def _table_rows(table):
+    """Cellules de chaque ligne de données d'un tableau Markdown (en-tête et séparateur exclus)."""
+    rows = []
+    for line in table.splitlines():
+        line = line.strip()
+        if not line.startswith("|") or set(line) <= set("|-: "):
+            continue
+        rows.append([cell.strip() for cell in line.strip("|").split("|")])
+    return rows[1:]
+
+
+def _is_complete_table(table):
+    """Indique si un texte contient un tableau Markdown complet : en-tête, séparateur et au moins une ligne."""
+    lines = [line.strip() for line in table.splitlines() if line.strip().startswith("|")]
+    is_separator = [set(line) <= set("|-: ") and "-" in line for line in lines]
+    return len(lines) >= 3 and not is_separator[0] and is_separator[1] and not all(is_separator[2:])
+
+
+def polish_table(table):
+    """
+    Fait reformuler les colonnes points forts / faibles du tableau local par Gemini.
+
+    Les contrats, leur ordre et les pourcentages doivent être conservés à l'identique ;
+    sinon la reformulation est écartée.
+
+    Args:
+        table (str): Tableau Markdown produit par ranking.render_markdown_table.
+
+    Returns:
+        str or None: Le tableau reformulé, ou None si le modèle est indisponible ou a modifié le classement.
+    """
+    api_key = os.environ.get("GOOGLE_API_KEY")
+    if not api_key:
+        logger.info("Polish skipped: GOOGLE_API_KEY is not set")
+        return None
+
+    prompt = f"""
+Voici un tableau comparatif de contrats de mutuelle santé, calculé à partir des garanties :
+
+{table}
+
+Reformulez uniquement les colonnes **"Points forts"** et **"Points faibles"** en phrases courtes et claires
+pour un particulier, en conservant chaque garantie, ses valeurs et l'écart au besoin.
+
+⚠️ Ne modifiez ni les colonnes "Contrat" et "Pourcentage de correspondance", ni l'ordre ou le nombre des lignes.
+⚠️ Retournez uniquement le tableau Markdown, avec le même en-tête.
+"""
+    PROMPT_TOKENS.observe(estimate_tokens(prompt), pipeline="polish")
+    try:
+        import google.generativeai as genai
         genai.configure(api_key=api_key)
+        model = genai.GenerativeModel('gemini-2.5-pro')
+        with STAGE_SECONDS.time(pipeline="polish", stage="generate"):
+            response = get_rate_limiter().call(
+                model.generate_content, prompt, max_wait=COMPARE_MAX_WAIT, max_attempts=1
+            )
+        record_usage("polish", response)
+        polished = response.text.strip()
+    except QuotaExceededError as e:
+        MODEL_CALLS.inc(pipeline="polish", outcome="quota")
+        logger.warning("Polish skipped, returning the local table: %s", e)
+        return None
+    except Exception as e:
+        MODEL_CALLS.inc(pipeline="polish", outcome="error")
+        logger.warning("Polish skipped, returning the local table: %s", e)
+        return None
+
+    original_rows, polished_rows = _table_rows(table), _table_rows(polished)
+    if len(polished_rows) != len(original_rows) or any(
+        len(new) != 4 or new[:2] != old[:2] for old, new in zip(original_rows, polished_rows)
+    ):
+        MODEL_CALLS.inc(pipeline="polish", outcome="discarded")
+        logger.info("Polish discarded: the model changed the ranking or the table format")
+        return None
+    MODEL_CALLS.inc(pipeline="polish", outcome="ok")
+    return "\n".join(ranking.TABLE_HEADER + [f"| {' | '.join(row)} |" for row in polished_rows])
+
+
+def find_top_combinations(user_data, top_n=ranking.TOP_N, stats=None):
+    """
+    Classe les meilleures combinaisons contrat de base + surcomplémentaire.
+
+    Args:
+        user_data (dict): Les préférences de l'utilisateur issues du formulaire.
+        top_n (int): Nombre de combinaisons à retourner.
+        stats (dict): Si fourni, reçoit les statistiques de la recherche (bases explorées, paires évaluées).
+
+    Returns:
+        list or dict: Les combinaisons classées (voir combinations.rank_combinations), ou un dictionnaire d'erreur.
+    """
+    try:
+        with STAGE_SECONDS.time(pipeline="combinations", stage="catalog_load"):
+            matrix = guarantee_matrix.get_guarantee_matrix()
+        with STAGE_SECONDS.time(pipeline="combinations", stage="rank"):
+            ranked = combinations.rank_combinations(user_data, matrix, top_n=top_n, stats=stats)
+        logger.debug("Combination search complete: %d pairs selected, %s", len(ranked), stats)
+        return ranked
+
+    except (ValueError, json.JSONDecodeError, FileNotFoundError) as e:
+        logger.warning("A validation or JSON error occurred: %s", e)
+        return {"error": str(e)}
+    except Exception as e:
+        logger.exception("An unexpected error occurred in find_top_combinations: %s", e)
+        return {"error": "Une erreur inattendue est survenue lors de la comparaison des combinaisons."}
+
+
+def _prepare_llm_prompt(user_data, catalog_version, stats=None):
+    """
+    Configure Gemini et construit le prompt de classement sur la présélection locale.
+
+    Seuls les LLM_SHORTLIST_SIZE contrats les mieux classés par le moteur local
+    sont envoyés au modèle.
+
+    Args:
+        user_data (dict): Les préférences de l'utilisateur issues du formulaire.
+        catalog_version (int): Version du catalogue utilisée pour la présélection.
+        stats (dict): Si fourni, reçoit les statistiques du prompt.
+
+    Returns:
+        str: Le prompt à envoyer au modèle.
+    """
+    # Assurez-vous que votre clé API est définie comme variable d'environnement
+    api_key = os.environ.get("GOOGLE_API_KEY")
+    if not api_key:
+        logger.error("GOOGLE_API_KEY environment variable not set")
+        raise ValueError("La variable d'environnement GOOGLE_API_KEY n'est pas définie.")
+
+    # SDK importé au premier appel au modèle : les workers qui n'en ont pas besoin démarrent plus vite
+    import google.generativeai as genai
+    genai.configure(api_key=api_key)
+
+    with STAGE_SECONDS.time(pipeline="compare", stage="catalog_load"):
+        matrix = guarantee_matrix.get_guarantee_matrix()
+    with STAGE_SECONDS.time(pipeline="compare", stage="rank"):
+        shortlist = ranking.rank_contracts(user_data, matrix, top_n=LLM_SHORTLIST_SIZE)
+    prompt_start = time.perf_counter()
+    # Le modèle raisonne sur les valeurs brutes : le bloc normalisé n'est pas envoyé
+    candidates = [without_normalized(result["contract"]) for result in shortlist]
+    candidates_json = json.dumps(candidates, ensure_ascii=False, separators=(",", ":"))
+
+    tokens_saved = _full_catalog_tokens(matrix, catalog_version) - estimate_tokens(candidates_json)
+    logger.debug("Shortlisted %d/%d contracts, ~%d prompt tokens saved", len(candidates), len(matrix), tokens_saved)
+    if stats is not None:
+        stats.update({
+            "catalog_size": len(matrix),
+            "candidates": len(candidates),
+            "prompt_tokens_saved": tokens_saved,
+        })
         
-        print("Loading contracts.json...")
-        with open('contracts.json', 'r', encoding='utf-8') as f:
-            contracts = json.load(f)
-        print("Successfully loaded contracts.json.")
-            
-        prompt = f"""
+    prompt = f"""
 Bonjour ! Vous allez analyser attentivement une liste de contrats afin de recommander **les 10 meilleurs** en fonction de leur adéquation avec les **besoins précis de l'utilisateur**.
 
 Prenez **tout le temps nécessaire** pour effectuer une évaluation **rigoureuse, complète et méthodique**. La précision doit être **absolue (100%)** : chaque correspondance ou écart entre les besoins et les garanties doit être justifié avec soin.
@@ -42,8 +294,8 @@ Voici les informations à prendre en compte :
 Besoins de l'utilisateur :
 {json.dumps(user_data, indent=2, ensure_ascii=False)}
 
-Contrats disponibles :
-{json.dumps(contracts, indent=2, ensure_ascii=False)}
+Contrats disponibles (présélection des {len(candidates)} plus pertinents parmi {len(matrix)}) :
+{candidates_json}
 
 **Instructions spécifiques de sélection avec logique de classement précise :**
 
@@ -98,25 +350,143 @@ Pour chaque contrat sélectionné, vous devez :
 
 Soyez **exhaustif, objectif et précis au maximum**.
 """
-        print("Prompt generated. Preparing to call the generative model.")
+    STAGE_SECONDS.observe(time.perf_counter() - prompt_start, pipeline="compare", stage="prompt_build")
+    PROMPT_TOKENS.observe(estimate_tokens(prompt), pipeline="compare")
+    return prompt
+
+
+def _find_top_contracts_llm(user_data, catalog_version, stats=None):
+    """
+    Trouve les 10 meilleurs contrats d'assurance en utilisant Gemini Pro.
+
+    Args:
+        user_data (dict): Un dictionnaire contenant les préférences de l'utilisateur issues du formulaire.
+        catalog_version (int): Version du catalogue utilisée pour la présélection.
+        stats (dict): Si fourni, reçoit les statistiques du prompt.
 
+    Returns:
+        str or dict: Le tableau Markdown généré par le modèle, ou un dictionnaire d'erreur.
+    """
+    try:
+        prompt = _prepare_llm_prompt(user_data, catalog_version, stats)
 
+        import google.generativeai as genai
         model = genai.GenerativeModel('gemini-2.5-pro')
 
-        print("Calling generate_content...")
-        response = model.generate_content(
-            prompt
-        )
-        print("Successfully received response from the model.")
-        
+        with STAGE_SECONDS.time(pipeline="compare", stage="generate"):
+            response = get_rate_limiter().call(
+                model.generate_content, prompt, max_wait=COMPARE_MAX_WAIT, max_attempts=1
+            )
+        record_usage("compare", response)
+
+        # Refus, texte libre ou réponse vide : renvoyés comme erreur, donc jamais mis en cache
+        if not _is_complete_table(response.text):
+            MODEL_CALLS.inc(pipeline="compare", outcome="discarded")
+            logger.warning("Discarded a model answer without a complete table")
+            return {"error": TABLE_ERROR}
+        MODEL_CALLS.inc(pipeline="compare", outcome="ok")
+
         # Since we expect a markdown table, we will return the text directly
-        print(f"Model response text (first 500 chars): {response.text[:500]}")
         return response.text
 
+    except QuotaExceededError as e:
+        MODEL_CALLS.inc(pipeline="compare", outcome="quota")
+        logger.warning("Quota exceeded in _find_top_contracts_llm: %s", e)
+        return {"error": str(e), "retry_after": round(e.retry_after)}
     except (ValueError, json.JSONDecodeError) as e:
-        print(f"A validation or JSON error occurred: {e}")
+        logger.warning("A validation or JSON error occurred: %s", e)
         # En cas d'erreur, renvoyer un message d'erreur au frontend
         return {"error": str(e)}
     except Exception as e:
-        print(f"An unexpected error occurred in find_top_contracts: {e}")
+        logger.exception("An unexpected error occurred in _find_top_contracts_llm: %s", e)
         return {"error": "Une erreur inattendue est survenue lors de la comparaison des contrats."}
+
+
+def stream_top_contracts(user_data, mode=None):
+    """
+    Produit le tableau Markdown des meilleurs contrats ligne par ligne, dès que chaque ligne est disponible.
+
+    Args:
+        user_data (dict): Les préférences de l'utilisateur issues du formulaire.
+        mode (str): "local" ou "llm", par défaut la valeur de COMPARE_MODE.
+
+    Yields:
+        str: Les lignes du tableau (en-tête compris).
+
+    Raises:
+        ValueError: Si le mode est inconnu, si le profil n'est pas un objet, si la configuration est incomplète
+            ou si le modèle n'a pas produit de tableau complet.
+    """
+    mode = (mode or COMPARE_MODE).lower()
+    if mode not in COMPARE_MODES:
+        raise ValueError(f"Mode de comparaison inconnu : {mode}")
+    if not isinstance(user_data, dict):
+        raise ValueError(PROFILE_ERROR)
+
+    catalog_version = get_store().version()
+    cached = _compare_cache.get(user_data, mode, catalog_version)
+    CACHE_LOOKUPS.inc(cache="compare", result="miss" if cached is None else "hit")
+    if cached is not None:
+        logger.debug("Compare cache hit")
+        yield from cached.splitlines()
+        return
+
+    if mode == "llm":
+        lines = _stream_top_contracts_llm(user_data, catalog_version)
+    else:
+        lines = _stream_top_contracts_local(user_data)
+
+    produced = []
+    for line in lines:
+        produced.append(line)
+        yield line
+
+    # Seul un tableau complet est mis en cache : un flux interrompu ou une réponse du modèle sans
+    # tableau lève une exception avant d'arriver ici
+    _compare_cache.set(user_data, mode, catalog_version, "\n".join(produced))
+
+
+def _stream_top_contracts_local(user_data):
+    """Lignes du tableau produit par le moteur de classement local."""
+    with STAGE_SECONDS.time(pipeline="compare", stage="catalog_load"):
+        matrix = guarantee_matrix.get_guarantee_matrix()
+    with STAGE_SECONDS.time(pipeline="compare", stage="rank"):
+        ranked = ranking.rank_contracts(user_data, matrix)
+    yield from ranking.TABLE_HEADER
+    yield from ranking.render_markdown_rows(ranked)
+
+
+def _stream_top_contracts_llm(user_data, catalog_version):
+    """Lignes du tableau généré par Gemini, transmises au fil de la génération."""
+    prompt = _prepare_llm_prompt(user_data, catalog_version)
+    import google.generativeai as genai
+    model = genai.GenerativeModel('gemini-2.5-pro')
+
+    start = time.perf_counter()
+    try:
+        response = get_rate_limiter().call(
+            model.generate_content, prompt, stream=True, max_wait=COMPARE_MAX_WAIT, max_attempts=1
+        )
+    except QuotaExceededError:
+        MODEL_CALLS.inc(pipeline="compare", outcome="quota")
+        raise
+
+    buffer, produced = "", []
+    for chunk in response:
+        buffer += chunk.text
+        while "\n" in buffer:
+            line, buffer = buffer.split("\n", 1)
+            if line.strip().startswith("|"):
+                produced.append(line.strip())
+                yield line.strip()
+    if buffer.strip().startswith("|"):
+        produced.append(buffer.strip())
+        yield buffer.strip()
+    # Durée de génération complète : temps d'attente du client compris entre deux fragments
+    STAGE_SECONDS.observe(time.perf_counter() - start, pipeline="compare", stage="generate")
+    record_usage("compare", response)
+    if not _is_complete_table("\n".join(produced)):
+        MODEL_CALLS.inc(pipeline="compare", outcome="discarded")
+        logger.warning("Discarded a streamed model answer without a complete table")
+        raise ValueError(TABLE_ERROR)
+    MODEL_CALLS.inc(pipeline="compare", outcome="ok")
@@ -0,0 +1,107 @@
+"""
+Cache des résultats de /compare
+LRU borné avec expiration, indexé sur le profil normalisé et la version du catalogue
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Hashable, List, Optional
+
+from value_analyzer import GuaranteeAnalyzer
+
+COMPARE_CACHE_SIZE = int(os.environ.get("COMPARE_CACHE_SIZE", 512))
+COMPARE_CACHE_TTL = float(os.environ.get("COMPARE_CACHE_TTL", 3600))
+
+
+class TTLCache:
+    """Cache LRU borné dont les entrées expirent après ttl secondes"""
+
+    def __init__(self, maxsize: int = COMPARE_CACHE_SIZE, ttl: float = COMPARE_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable):
+        """Retourne la valeur associée à la clé, ou None si absente ou expirée"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: Hashable, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+def normalize_profile(user_data: Dict) -> List[tuple]:
+    """
+    Forme canonique d'un profil : "125 % BR" et "125% BR" donnent la même entrée
+
+    Args:
+        user_data (Dict): Profil issu du formulaire
+
+    Returns:
+        List[tuple]: (catégorie, garantie, valeur, type) triés
+    """
+    analyzer = GuaranteeAnalyzer()
+    normalized = []
+    for category, guarantees in (user_data or {}).items():
+        if not isinstance(guarantees, dict):
+            continue
+        for guarantee_name, raw_value in guarantees.items():
+            analysis = analyzer.analyze_value(str(raw_value))
+            normalized.append((category, guarantee_name, analysis["numeric_value"], analysis["type"]))
+    return sorted(normalized)
+
+
+def profile_cache_key(user_data: Dict, mode: str, catalog_version: int) -> str:
+    """Empreinte SHA-256 du profil normalisé, du mode et de la version du catalogue"""
+    payload = json.dumps([mode, catalog_version, normalize_profile(user_data)], ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class CompareCache:
+    """Résultats de comparaison, vidés automatiquement à chaque modification du catalogue"""
+
+    def __init__(self, maxsize: int = COMPARE_CACHE_SIZE, ttl: float = COMPARE_CACHE_TTL):
+        self._cache = TTLCache(maxsize, ttl)
+        self._catalog_version: Optional[int] = None
+        self._lock = threading.Lock()
+
+    def _sync_version(self, catalog_version: int):
+        with self._lock:
+            if catalog_version != self._catalog_version:
+                self._cache.clear()
+                self._catalog_version = catalog_version
+
+    def get(self, user_data: Dict, mode: str, catalog_version: int):
+        self._sync_version(catalog_version)
+        return self._cache.get(profile_cache_key(user_data, mode, catalog_version))
+
+    def set(self, user_data: Dict, mode: str, catalog_version: int, result):
+        self._sync_version(catalog_version)
+        self._cache.set(profile_cache_key(user_data, mode, catalog_version), result)
+
+    def clear(self):
+        self._cache.clear()
@@ -0,0 +1,280 @@
+"""
+Stockage transactionnel du catalogue de contrats
+Base SQLite en mode WAL indexée sur level_id, exportable au format contracts.json
+"""
+
+import json
+import logging
+import os
+import sqlite3
+import sys
+import threading
+import uuid
+from contextlib import contextmanager
+from typing import Dict, List, Tuple
+
+from value_analyzer import NORMALIZED_KEY, GuaranteeAnalyzer, normalize_contract, without_normalized
+
+logger = logging.getLogger(__name__)
+
+CONTRACTS_DB = os.environ.get("CONTRACTS_DB", "contracts.db")
+CONTRACTS_JSON = "contracts.json"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS contracts (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    level_id TEXT,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_contracts_level_id ON contracts(level_id);
+CREATE TABLE IF NOT EXISTS changes (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    op TEXT NOT NULL,
+    contract_id INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+
+class ContractStore:
+    """Catalogue de niveaux de contrat stocké dans SQLite"""
+
+    def __init__(self, db_path: str = CONTRACTS_DB, seed_file: str = CONTRACTS_JSON):
+        """
+        Args:
+            db_path (str): Chemin de la base SQLite
+            seed_file (str): Catalogue JSON importé à la création de la base
+        """
+        self.db_path = db_path
+        self.seed_file = seed_file
+        self._local = threading.local()
+        # Identité de la base, tirée à sa création : la version seule repart de zéro si la base est recréée
+        self.catalog_id = ""
+        self._init_schema()
+
+    def _connect(self) -> sqlite3.Connection:
+        """Connexion propre au thread et au processus courants (sûre après fork)"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def close(self):
+        """Ferme la connexion du thread courant ; la prochaine requête en rouvre une"""
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    @contextmanager
+    def _transaction(self):
+        """Transaction en écriture, sérialisée entre processus par SQLite"""
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def _init_schema(self):
+        """Crée les tables et importe le catalogue JSON si la base n'a jamais été alimentée"""
+        self._connect().executescript(SCHEMA)
+        with self._transaction() as conn:
+            conn.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('catalog_id', ?)", (uuid.uuid4().hex,))
+            self.catalog_id = conn.execute("SELECT value FROM meta WHERE key = 'catalog_id'").fetchone()[0]
+            if conn.execute("SELECT 1 FROM changes LIMIT 1").fetchone():
+                self._backfill_normalized(conn)
+                return
+            if not os.path.exists(self.seed_file):
+                return
+            with open(self.seed_file, "r", encoding="utf-8") as f:
+                content = f.read()
+            contracts = json.loads(content) if content else []
+            if not isinstance(contracts, list):
+                raise ValueError(f"Les données de {self.seed_file} ne sont pas une liste.")
+            self._insert(conn, contracts)
+            logger.info("Imported %d contracts from %s into %s", len(contracts), self.seed_file, self.db_path)
+
+    def _backfill_normalized(self, conn: sqlite3.Connection):
+        """Ajoute le bloc normalisé aux niveaux enregistrés avant son introduction"""
+        rows = conn.execute(
+            "SELECT id, data FROM contracts WHERE json_extract(data, ?) IS NULL", (f"$.{NORMALIZED_KEY}",)
+        ).fetchall()
+        analyzer = GuaranteeAnalyzer()
+        for contract_id, data in rows:
+            contract = normalize_contract(json.loads(data), analyzer)
+            conn.execute(
+                "UPDATE contracts SET data = ? WHERE id = ?", (json.dumps(contract, ensure_ascii=False), contract_id)
+            )
+        if rows:
+            logger.info("Normalized %d existing contracts in %s", len(rows), self.db_path)
+
+    @staticmethod
+    def _insert(conn: sqlite3.Connection, contracts: List[Dict]) -> List[int]:
+        """Insère des niveaux, normalisés une fois pour toutes à l'ingestion"""
+        ids = []
+        analyzer = GuaranteeAnalyzer()
+        for contract in contracts:
+            contract = normalize_contract(contract, analyzer)
+            cursor = conn.execute(
+                "INSERT INTO contracts (level_id, data) VALUES (?, ?)",
+                (contract.get("level_id"), json.dumps(contract, ensure_ascii=False)),
+            )
+            ids.append(cursor.lastrowid)
+            conn.execute("INSERT INTO changes (op, contract_id) VALUES ('insert', ?)", (cursor.lastrowid,))
+        return ids
+
+    def add(self, contract: Dict) -> int:
+        """
+        Ajoute un niveau de contrat
+
+        Args:
+            contract (Dict): Niveau de contrat au format examples.json
+
+        Returns:
+            int: Identifiant interne de la ligne créée
+        """
+        return self.add_many([contract])[0]
+
+    def add_many(self, contracts: List[Dict]) -> List[int]:
+        """
+        Ajoute plusieurs niveaux de contrat dans une seule transaction
+
+        Args:
+            contracts (List[Dict]): Niveaux de contrat au format examples.json
+
+        Returns:
+            List[int]: Identifiants internes des lignes créées
+        """
+        with self._transaction() as conn:
+            return self._insert(conn, contracts)
+
+    def delete(self, level_id: str) -> int:
+        """
+        Supprime tous les niveaux portant ce level_id
+
+        Args:
+            level_id (str): Identifiant du niveau
+
+        Returns:
+            int: Nombre de niveaux supprimés
+        """
+        with self._transaction() as conn:
+            rows = conn.execute("SELECT id FROM contracts WHERE level_id = ?", (level_id,)).fetchall()
+            for (contract_id,) in rows:
+                conn.execute("DELETE FROM contracts WHERE id = ?", (contract_id,))
+                conn.execute("INSERT INTO changes (op, contract_id) VALUES ('delete', ?)", (contract_id,))
+            return len(rows)
+
+    def find(self, level_id: str) -> List[Dict]:
+        """Niveaux portant ce level_id, dans l'ordre d'insertion"""
+        rows = self._connect().execute(
+            "SELECT data FROM contracts WHERE level_id = ? ORDER BY id", (level_id,)
+        ).fetchall()
+        return [json.loads(data) for (data,) in rows]
+
+    def all(self) -> List[Dict]:
+        """Catalogue complet, dans l'ordre d'insertion (format contracts.json)"""
+        rows = self._connect().execute("SELECT data FROM contracts ORDER BY id").fetchall()
+        return [json.loads(data) for (data,) in rows]
+
+    def versioned_rows(self) -> Tuple[int, List[tuple]]:
+        """
+        Version et contenu du catalogue lus dans une même transaction de lecture
+
+        Returns:
+            tuple: (version, [(identifiant interne, niveau)]), les niveaux dans l'ordre d'insertion
+        """
+        conn = self._connect()
+        conn.execute("BEGIN")
+        try:
+            version = conn.execute("SELECT COALESCE(MAX(seq), 0) FROM changes").fetchone()[0]
+            rows = conn.execute("SELECT id, data FROM contracts ORDER BY id").fetchall()
+        finally:
+            conn.execute("COMMIT")
+        return version, [(contract_id, json.loads(data)) for contract_id, data in rows]
+
+    def get_many(self, contract_ids: List[int]) -> Dict[int, Dict]:
+        """Niveaux indexés par identifiant interne (les identifiants supprimés sont absents)"""
+        result = {}
+        conn = self._connect()
+        for start in range(0, len(contract_ids), 500):
+            chunk = contract_ids[start:start + 500]
+            rows = conn.execute(
+                f"SELECT id, data FROM contracts WHERE id IN ({','.join('?' * len(chunk))})", chunk
+            ).fetchall()
+            result.update((contract_id, json.loads(data)) for contract_id, data in rows)
+        return result
+
+    def changes_since(self, seq: int) -> List[tuple]:
+        """
+        Modifications postérieures à une version
+
+        Args:
+            seq (int): Version déjà connue (voir version())
+
+        Returns:
+            List[tuple]: (seq, "insert" ou "delete", identifiant interne), dans l'ordre
+        """
+        return self._connect().execute(
+            "SELECT seq, op, contract_id FROM changes WHERE seq > ? ORDER BY seq", (seq,)
+        ).fetchall()
+
+    def count(self) -> int:
+        return self._connect().execute("SELECT COUNT(*) FROM contracts").fetchone()[0]
+
+    def version(self) -> int:
+        """Numéro de la dernière modification, croissant à chaque écriture"""
+        return self._connect().execute("SELECT COALESCE(MAX(seq), 0) FROM changes").fetchone()[0]
+
+    def export_json(self, path: str = CONTRACTS_JSON):
+        """
+        Exporte le catalogue au format contracts.json (écriture atomique, sans le bloc normalisé)
+
+        Args:
+            path (str): Fichier de destination
+        """
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump([without_normalized(contract) for contract in self.all()], f, indent=2, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store() -> ContractStore:
+    """Instance partagée du catalogue, créée au premier appel"""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = ContractStore()
+        return _store
+
+
+def close_store():
+    """Ferme la connexion du thread courant à l'instance partagée, si elle existe (avant un fork)"""
+    with _store_lock:
+        if _store is not None:
+            _store.close()
+
+
+if __name__ == "__main__":
+    # Usage : python contract_store.py export [fichier]
+    if len(sys.argv) >= 2 and sys.argv[1] == "export":
+        output = sys.argv[2] if len(sys.argv) > 2 else CONTRACTS_JSON
+        store = get_store()
+        store.export_json(output)
+        print(f"✅ {store.count()} contrats exportés vers {output}")
+    else:
+        print("Usage : python contract_store.py export [fichier]")
@@ -0,0 +1,140 @@
+"""
+Index de dominance du catalogue
+Répond à « quels contrats couvrent tous les besoins ? » (rangs 4-6 de ranking_logic.md)
+sans parcourir le catalogue : seuils triés par garantie et intersection de bitsets
+"""
+
+import threading
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from guarantee_matrix import GuaranteeMatrix, get_guarantee_matrix, unit_code
+from value_analyzer import GuaranteeAnalyzer, ValueType
+
+# Les 7 garanties du formulaire (examples.json) et leur unité usuelle,
+# utilisée quand un seuil est donné sans unité
+INDEX_DIMENSIONS = {
+    "honoraires_chirurgien_optam": ValueType.PERCENTAGE,
+    "chambre_particuliere": ValueType.EUROS,
+    "consultation_generaliste_optam": ValueType.PERCENTAGE,
+    "soins_dentaires": ValueType.PERCENTAGE,
+    "implantologie": ValueType.EUROS,
+    "orthodontie": ValueType.PERCENTAGE,
+    "verres_complexes": ValueType.EUROS,
+}
+
+
+def parse_thresholds(thresholds: Dict[str, str], analyzer: Optional[GuaranteeAnalyzer] = None,
+                     dimensions: Dict[str, str] = INDEX_DIMENSIONS) -> List[Dict]:
+    """
+    Convertit des seuils bruts ("125 % BR", "150 €" ou "150") en besoins
+
+    Args:
+        thresholds (Dict[str, str]): Seuil par garantie indexée
+        analyzer (GuaranteeAnalyzer): Analyseur de valeurs
+        dimensions (Dict[str, str]): Garanties acceptées et leur unité usuelle
+
+    Returns:
+        List[Dict]: Besoins au format de ranking.parse_user_needs (les seuils nuls sont ignorés)
+
+    Raises:
+        ValueError: Si une garantie n'est pas indexée
+    """
+    analyzer = analyzer or GuaranteeAnalyzer()
+    needs = []
+    for guarantee_name, raw_value in thresholds.items():
+        if guarantee_name not in dimensions:
+            raise ValueError(f"Garantie non indexée : {guarantee_name}")
+        analysis = analyzer.analyze_value(str(raw_value))
+        if analysis["numeric_value"] <= 0:
+            continue
+        value_type = analysis["type"]
+        if value_type == ValueType.UNKNOWN:
+            value_type = dimensions[guarantee_name]
+        needs.append({"guarantee": guarantee_name, "value": analysis["numeric_value"], "type": value_type})
+    return needs
+
+
+class CoverageIndex:
+    """
+    Pour chaque garantie et chaque unité : valeurs distinctes triées, et pour chacune
+    le bitset (entier Python) des contrats dont la valeur est supérieure ou égale
+    """
+
+    def __init__(self, matrix: GuaranteeMatrix, dimensions: Dict[str, str] = INDEX_DIMENSIONS):
+        self.matrix = matrix
+        self.dimensions = dimensions
+        self._postings: Dict[tuple, tuple] = {}   # (garantie, code d'unité) -> (seuils, bitsets)
+
+        size = len(matrix)
+        for guarantee_name in dimensions:
+            j = matrix.column_index.get(guarantee_name)
+            if j is None:
+                continue
+            values = matrix.values[:, j]
+            units = matrix.units[:, j]
+            for code in np.unique(units[units != 0]):
+                in_unit = units == code
+                thresholds = np.unique(values[in_unit])
+                bitsets = [
+                    _to_bitset(in_unit & (values >= threshold), size)
+                    for threshold in thresholds
+                ]
+                self._postings[(guarantee_name, int(code))] = (thresholds, bitsets)
+
+    def parse_needs(self, thresholds: Dict[str, str], analyzer: Optional[GuaranteeAnalyzer] = None) -> List[Dict]:
+        """Seuils bruts -> besoins, pour les garanties de cet index (voir parse_thresholds)"""
+        return parse_thresholds(thresholds, analyzer, self.dimensions)
+
+    def covering(self, needs: List[Dict]) -> np.ndarray:
+        """
+        Contrats dont chaque garantie demandée est dans la même unité et au moins égale au besoin
+
+        Une recherche dichotomique par besoin, puis un ET entre bitsets.
+
+        Args:
+            needs (List[Dict]): Besoins ({"guarantee", "value", "type"})
+
+        Returns:
+            np.ndarray: Indices des contrats dans la matrice, dans l'ordre du catalogue
+        """
+        size = len(self.matrix)
+        result = (1 << size) - 1
+        for need in needs:
+            postings = self._postings.get((need["guarantee"], unit_code(need["type"], need["value"])))
+            if postings is None:
+                return np.empty(0, dtype=np.int64)
+            thresholds, bitsets = postings
+            k = int(np.searchsorted(thresholds, need["value"], side="left"))
+            if k == len(thresholds):
+                return np.empty(0, dtype=np.int64)
+            result &= bitsets[k]
+            if not result:
+                return np.empty(0, dtype=np.int64)
+        return _from_bitset(result, size)
+
+
+def _to_bitset(mask: np.ndarray, size: int) -> int:
+    """Masque booléen -> entier dont le bit i correspond à la ligne i"""
+    return int.from_bytes(np.packbits(mask, bitorder="little").tobytes(), "little") if size else 0
+
+
+def _from_bitset(bitset: int, size: int) -> np.ndarray:
+    """Entier -> indices des bits à 1"""
+    raw = np.frombuffer(bitset.to_bytes((size + 7) // 8, "little"), dtype=np.uint8)
+    return np.flatnonzero(np.unpackbits(raw, bitorder="little")[:size])
+
+
+_index_lock = threading.Lock()
+_index_cache: Optional[CoverageIndex] = None
+
+
+def get_coverage_index() -> CoverageIndex:
+    """Index du catalogue courant, reconstruit avec la matrice compilée"""
+    global _index_cache
+    matrix = get_guarantee_matrix()
+    with _index_lock:
+        if _index_cache is None or _index_cache.matrix is not matrix:
+            _index_cache = CoverageIndex(matrix)
+        return _index_cache
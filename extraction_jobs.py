@@ -0,0 +1,217 @@
+"""
+File d'attente des extractions PDF
+Pool de workers borné ; l'état des jobs est partagé entre processus via SQLite
+"""
+
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Optional
+
+from contract_store import CONTRACTS_DB
+
+logger = logging.getLogger(__name__)
+
+EXTRACT_WORKERS = int(os.environ.get("EXTRACT_WORKERS", 2))
+EXTRACT_MAX_PENDING = int(os.environ.get("EXTRACT_MAX_PENDING", 20))
+EXTRACT_JOB_TTL = int(os.environ.get("EXTRACT_JOB_TTL", 24 * 3600))
+# Un job en attente ou en cours sans nouvelle (avancement compris) depuis ce délai est déclaré échoué
+EXTRACT_JOB_TIMEOUT = int(os.environ.get("EXTRACT_JOB_TIMEOUT", 3600))
+
+STATUS_QUEUED = "queued"
+STATUS_RUNNING = "running"
+STATUS_DONE = "done"
+STATUS_FAILED = "failed"
+ACTIVE_STATUSES = (STATUS_QUEUED, STATUS_RUNNING)
+
+ORPHANED_JOB_ERROR = "The extraction worker stopped before the job finished."
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS extraction_jobs (
+    id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    http_status INTEGER,
+    payload TEXT,
+    owner_pid INTEGER
+);
+"""
+
+
+def _process_alive(pid: Optional[int]) -> bool:
+    """Indique si le processus existe encore (toujours vrai hors POSIX, où le délai seul s'applique)"""
+    if not pid or os.name != "posix":
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class QueueFullError(Exception):
+    """Levée quand trop d'extractions sont déjà en attente"""
+
+
+class JobQueue:
+    """Exécute les extractions en arrière-plan et conserve leur état"""
+
+    def __init__(self, db_path: str = CONTRACTS_DB, max_workers: int = EXTRACT_WORKERS,
+                 max_pending: int = EXTRACT_MAX_PENDING):
+        """
+        Args:
+            db_path (str): Base SQLite où sont conservés les jobs
+            max_workers (int): Nombre d'extractions simultanées par processus
+            max_pending (int): Nombre maximum de jobs en attente ou en cours par processus
+        """
+        self.db_path = db_path
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="extract")
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._local = threading.local()
+        conn = self._connect()
+        conn.executescript(SCHEMA)
+        # Bases créées avant l'enregistrement du processus propriétaire
+        if "owner_pid" not in {row[1] for row in conn.execute("PRAGMA table_info(extraction_jobs)")}:
+            conn.execute("ALTER TABLE extraction_jobs ADD COLUMN owner_pid INTEGER")
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _update(self, job_id: str, status: str, http_status: Optional[int] = None, payload=None):
+        self._connect().execute(
+            "UPDATE extraction_jobs SET status = ?, updated_at = ?, http_status = ?, payload = ? WHERE id = ?",
+            (status, time.time(), http_status,
+             None if payload is None else json.dumps(payload, ensure_ascii=False), job_id),
+        )
+
+    def submit(self, func: Callable, *args, **kwargs) -> str:
+        """
+        Planifie une extraction
+
+        Args:
+            func (Callable): Fonction retournant un tuple (payload, code HTTP)
+
+        Returns:
+            str: Identifiant du job
+
+        Raises:
+            QueueFullError: Si la file d'attente est pleine
+        """
+        if not self._slots.acquire(blocking=False):
+            raise QueueFullError("Trop d'extractions en attente, réessayez plus tard.")
+
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        try:
+            conn = self._connect()
+            conn.execute("DELETE FROM extraction_jobs WHERE updated_at < ?", (now - EXTRACT_JOB_TTL,))
+            conn.execute(
+                "INSERT INTO extraction_jobs (id, status, created_at, updated_at, owner_pid) VALUES (?, ?, ?, ?, ?)",
+                (job_id, STATUS_QUEUED, now, now, os.getpid()),
+            )
+            self._executor.submit(self._run, job_id, func, args, kwargs)
+        except Exception:
+            self._slots.release()
+            raise
+        return job_id
+
+    def submit_with_progress(self, func: Callable, *args, **kwargs) -> str:
+        """
+        Planifie un job qui publie son avancement
+
+        func reçoit en premier argument une fonction report(payload) : chaque appel remplace
+        le résultat provisoire visible via get() tant que le job est en cours.
+
+        Returns:
+            str: Identifiant du job
+
+        Raises:
+            QueueFullError: Si la file d'attente est pleine
+        """
+        return self.submit(func, *args, _with_progress=True, **kwargs)
+
+    def _run(self, job_id: str, func: Callable, args: tuple, kwargs: dict):
+        try:
+            self._update(job_id, STATUS_RUNNING)
+            if kwargs.pop("_with_progress", False):
+                args = (lambda payload: self._update(job_id, STATUS_RUNNING, None, payload),) + args
+            payload, http_status = func(*args, **kwargs)
+            status = STATUS_DONE if http_status < 400 else STATUS_FAILED
+            self._update(job_id, status, http_status, payload)
+        except Exception as e:
+            logger.exception("An unexpected error occurred in extraction job %s: %s", job_id, e)
+            self._update(job_id, STATUS_FAILED, 500, {"error": "An unexpected server error occurred."})
+        finally:
+            self._slots.release()
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        """
+        État d'un job
+
+        Un job en attente ou en cours dont le worker a disparu (redémarrage, timeout gunicorn) ou
+        qui n'a plus donné de nouvelles depuis EXTRACT_JOB_TIMEOUT est déclaré échoué : les
+        exécuteurs sont propres à chaque processus, personne d'autre ne le terminera.
+
+        Returns:
+            Dict: {"job_id", "status", "http_status", "result"}, ou None si le job est inconnu
+        """
+        conn = self._connect()
+        row = conn.execute(
+            "SELECT status, http_status, payload, updated_at, owner_pid FROM extraction_jobs WHERE id = ?", (job_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        status, http_status, payload, updated_at, owner_pid = row
+        if status in ACTIVE_STATUSES and (
+            not _process_alive(owner_pid) or time.time() - updated_at > EXTRACT_JOB_TIMEOUT
+        ):
+            logger.warning("Extraction job %s orphaned (worker %s gone or timed out), marking it failed",
+                           job_id, owner_pid)
+            status, http_status, payload = STATUS_FAILED, 500, json.dumps({"error": ORPHANED_JOB_ERROR})
+            # Sans effet si le job s'est terminé entre-temps
+            conn.execute(
+                f"UPDATE extraction_jobs SET status = ?, updated_at = ?, http_status = ?, payload = ? "
+                f"WHERE id = ? AND status IN ({','.join('?' * len(ACTIVE_STATUSES))})",
+                (status, time.time(), http_status, payload, job_id, *ACTIVE_STATUSES),
+            )
+            row = conn.execute(
+                "SELECT status, http_status, payload FROM extraction_jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+            if row is None:
+                return None
+            status, http_status, payload = row
+        return {
+            "job_id": job_id,
+            "status": status,
+            "http_status": http_status,
+            "result": json.loads(payload) if payload else None,
+        }
+
+
+_queue = None
+_queue_pid = None
+_queue_lock = threading.Lock()
+
+
+def get_job_queue() -> JobQueue:
+    """File d'attente du processus courant, créée au premier appel (les threads ne survivent pas au fork)"""
+    global _queue, _queue_pid
+    with _queue_lock:
+        if _queue is None or _queue_pid != os.getpid():
+            _queue = JobQueue()
+            _queue_pid = os.getpid()
+        return _queue
@@ -0,0 +1,166 @@
+"""
+Matrice compilée des garanties du catalogue
+Une colonne par garantie, valeurs numériques et masques d'unité issus de GuaranteeAnalyzer
+"""
+
+import logging
+import threading
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from contract_store import ContractStore, get_store
+from value_analyzer import NORMALIZED_KEY, GuaranteeAnalyzer, ValueType
+
+logger = logging.getLogger(__name__)
+
+# Codes d'unité stockés dans la matrice (0 = garantie absente ou non couverte)
+UNIT_NONE = 0
+UNIT_PERCENTAGE = 1
+UNIT_EUROS = 2
+UNIT_OTHER = 3
+
+# Champs texte des niveaux, lisibles sans décoder le niveau complet (voir catalog_snapshot)
+TEXT_FIELDS = ("insurer", "contract_name", "level_name", "contract_type", "level_id")
+
+UNIT_CODES = {
+    ValueType.PERCENTAGE: UNIT_PERCENTAGE,
+    ValueType.EUROS: UNIT_EUROS,
+    ValueType.UNKNOWN: UNIT_OTHER,
+}
+
+
+def unit_code(value_type: str, numeric_value: float) -> int:
+    """Code d'unité d'une valeur analysée (UNIT_NONE si aucune valeur chiffrée)"""
+    if numeric_value <= 0:
+        return UNIT_NONE
+    return UNIT_CODES.get(value_type, UNIT_OTHER)
+
+
+class GuaranteeMatrix:
+    """Catalogue compilé : une ligne par niveau de contrat, une colonne par garantie"""
+
+    def __init__(self, contracts: List[Dict], analyzer: Optional[GuaranteeAnalyzer] = None,
+                 contract_ids: Optional[List[int]] = None):
+        """
+        Args:
+            contracts (List[Dict]): Niveaux du catalogue, une ligne chacun
+            analyzer (GuaranteeAnalyzer): Analyseur des valeurs brutes
+            contract_ids (List[int]): Identifiants internes des niveaux (ContractStore), numéro
+                de ligne à défaut
+        """
+        analyzer = analyzer or GuaranteeAnalyzer()
+        self.contracts = contracts
+        self.contract_ids = np.asarray(
+            contract_ids if contract_ids is not None else range(len(contracts)), dtype=np.int64
+        )
+
+        # Colonnes dans l'ordre de première apparition dans le catalogue
+        self.columns: List[str] = []
+        self.column_categories: Dict[str, str] = {}
+        for contract in contracts:
+            for category, guarantees in (contract.get("benefits") or {}).items():
+                if not isinstance(guarantees, dict):
+                    continue
+                for guarantee_name in guarantees:
+                    if guarantee_name not in self.column_categories:
+                        self.column_categories[guarantee_name] = category
+                        self.columns.append(guarantee_name)
+        self.column_index = {name: j for j, name in enumerate(self.columns)}
+
+        shape = (len(contracts), len(self.columns))
+        self.values = np.zeros(shape, dtype=np.float64)
+        self.units = np.zeros(shape, dtype=np.int8)
+        self.is_addition = np.zeros(shape, dtype=bool)
+
+        for i, contract in enumerate(contracts):
+            # Bloc normalisé à l'ingestion s'il existe, sinon analyse des valeurs brutes
+            normalized = contract.get(NORMALIZED_KEY) or {}
+            for category, guarantees in (contract.get("benefits") or {}).items():
+                if not isinstance(guarantees, dict):
+                    continue
+                for guarantee_name, raw_value in guarantees.items():
+                    j = self.column_index[guarantee_name]
+                    if self.units[i, j] != UNIT_NONE:
+                        continue
+                    entry = normalized.get(category, {}).get(guarantee_name) or analyzer.normalize_value(raw_value)
+                    self.values[i, j] = entry["value"]
+                    self.units[i, j] = unit_code(entry["type"], entry["value"])
+                    self.is_addition[i, j] = entry["is_addition"]
+
+        # Rang lexicographique des level_id, utilisé pour départager les égalités
+        level_ids = np.array([str(c.get("level_id", "")) for c in contracts])
+        self.level_id_order = np.empty(len(contracts), dtype=np.int64)
+        self.level_id_order[np.argsort(level_ids, kind="stable")] = np.arange(len(contracts))
+
+    def __len__(self) -> int:
+        return len(self.contracts)
+
+    def text(self, row: int, field: str) -> str:
+        """Champ texte d'un niveau (voir TEXT_FIELDS)"""
+        return str(self.contracts[row].get(field) or "")
+
+    def text_column(self, field: str) -> np.ndarray:
+        """Champ texte de tous les niveaux, dans l'ordre des lignes"""
+        return np.array([str(contract.get(field) or "") for contract in self.contracts], dtype=object)
+
+    def summary(self, row: int) -> Dict[str, str]:
+        """Champs texte d'un niveau, suffisants pour l'afficher (voir ranking.contract_display_name)"""
+        return {field: self.text(row, field) for field in TEXT_FIELDS}
+
+    def gather(self, guarantee_names: List[str]):
+        """
+        Extrait les colonnes demandées, dans l'ordre donné
+
+        Les garanties absentes du catalogue donnent des colonnes vides.
+
+        Args:
+            guarantee_names (List[str]): Noms techniques des garanties
+
+        Returns:
+            tuple: (valeurs, codes d'unité, masque is_addition), chacun de forme (contrats, garanties)
+        """
+        shape = (len(self.contracts), len(guarantee_names))
+        values = np.zeros(shape, dtype=np.float64)
+        units = np.zeros(shape, dtype=np.int8)
+        is_addition = np.zeros(shape, dtype=bool)
+        for k, guarantee_name in enumerate(guarantee_names):
+            j = self.column_index.get(guarantee_name)
+            if j is not None:
+                values[:, k] = self.values[:, j]
+                units[:, k] = self.units[:, j]
+                is_addition[:, k] = self.is_addition[:, j]
+        return values, units, is_addition
+
+
+_matrix_lock = threading.Lock()
+_matrix_cache: Dict[str, tuple] = {}
+
+
+def get_guarantee_matrix(store: Optional[ContractStore] = None) -> GuaranteeMatrix:
+    """
+    Retourne la matrice compilée du catalogue, reconstruite uniquement si le catalogue a changé
+
+    Args:
+        store (ContractStore): Catalogue source, par défaut le catalogue partagé
+
+    Returns:
+        GuaranteeMatrix: Matrice compilée
+    """
+    # Import local : catalog_snapshot étend GuaranteeMatrix
+    from catalog_snapshot import load_or_build
+
+    store = store or get_store()
+    version = store.version()
+
+    with _matrix_lock:
+        cached = _matrix_cache.get(store.db_path)
+        if cached and cached[0] == version:
+            return cached[1]
+
+        # Nouvelle version : la matrice partagée est remplacée d'un bloc, les requêtes en cours
+        # gardent l'ancienne jusqu'à leur fin
+        matrix = load_or_build(store, version)
+        _matrix_cache[store.db_path] = (version, matrix)
+        logger.info("Loaded guarantee matrix: %d levels x %d guarantees", len(matrix), len(matrix.columns))
+        return matrix
@@ -0,0 +1,25 @@
+"""
+Configuration gunicorn, lue automatiquement par : gunicorn app:app
+L'application est chargée et le catalogue compilé dans le processus maître, avant le fork :
+les workers démarrent sans rien recharger et partagent ces pages en copie sur écriture
+"""
+
+import gc
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8000')}"
+workers = int(os.environ.get("WEB_CONCURRENCY", 2))
+# Threads par worker : /compare/stream et les longues comparaisons ?mode=llm occupent un thread chacune
+threads = int(os.environ.get("GUNICORN_THREADS", 4))
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", 120))
+preload_app = True
+
+
+def on_starting(server):
+    """Compile le catalogue une fois, dans le maître, avant le fork des workers"""
+    import app
+
+    # warm_catalog referme ses connexions SQLite : chaque worker ouvre les siennes après le fork
+    app.warm_catalog()
+    # Objets du démarrage exclus du ramasse-miettes : ses parcours ne recopient pas les pages partagées
+    gc.freeze()
@@ -0,0 +1,246 @@
+"""
+Métriques de l'application au format Prometheus
+Compteurs et histogrammes exposés sur /metrics, stockés dans SQLite : tous les workers
+incrémentent les mêmes séries, et n'importe lequel répond au scrape avec les totaux communs
+"""
+
+import abc
+import bisect
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+METRICS_DB = os.environ.get("METRICS_DB", "metrics.db")
+
+# Bornes des histogrammes de durée (secondes) et de taille de prompt (tokens)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+TOKEN_BUCKETS = (100, 250, 500, 1000, 2500, 5000, 10000, 25000, 50000, 100000, 250000)
+
+# Une ligne par série et par champ : "" pour un compteur, "le=<borne>", "sum" et "count" pour un histogramme
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS metric_samples (
+    name TEXT NOT NULL,
+    labels TEXT NOT NULL,
+    field TEXT NOT NULL,
+    value REAL NOT NULL,
+    PRIMARY KEY (name, labels, field)
+);
+"""
+
+_registry: List["_Metric"] = []
+_registry_lock = threading.Lock()
+_local = threading.local()
+
+
+def _connect() -> sqlite3.Connection:
+    """Connexion propre au thread, rouverte après un fork"""
+    conn = getattr(_local, "conn", None)
+    if conn is None or _local.pid != os.getpid():
+        conn = sqlite3.connect(METRICS_DB, timeout=30, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        # Perdre les derniers incréments sur une panne machine est acceptable pour des métriques
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(SCHEMA)
+        _local.conn = conn
+        _local.pid = os.getpid()
+    return conn
+
+
+def close():
+    """Ferme la connexion du thread courant (avant un fork) ; la prochaine mesure en rouvre une"""
+    conn = getattr(_local, "conn", None)
+    if conn is not None:
+        conn.close()
+        _local.conn = None
+
+
+def _add(name: str, key: tuple, amounts: Dict[str, float]):
+    """Ajoute les montants aux champs d'une série, en une transaction ; une erreur n'interrompt pas la requête"""
+    labels = json.dumps(key, ensure_ascii=False)
+    try:
+        conn = _connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.executemany(
+                "INSERT INTO metric_samples (name, labels, field, value) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (name, labels, field) DO UPDATE SET value = value + excluded.value",
+                [(name, labels, field, amount) for field, amount in amounts.items()],
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+    except sqlite3.Error as e:
+        logger.warning("Could not record metric %s: %s", name, e)
+
+
+def _read(name: str) -> Dict[tuple, Dict[str, float]]:
+    """Champs de chaque série d'une métrique, cumulés sur tous les workers"""
+    series: Dict[tuple, Dict[str, float]] = {}
+    try:
+        rows = _connect().execute(
+            "SELECT labels, field, value FROM metric_samples WHERE name = ?", (name,)
+        ).fetchall()
+    except sqlite3.Error as e:
+        logger.warning("Could not read metric %s: %s", name, e)
+        return series
+    for labels, field, value in rows:
+        series.setdefault(tuple(json.loads(labels)), {})[field] = value
+    return series
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(pairs: Sequence[Tuple[str, str]]) -> str:
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _format_number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class _Metric(abc.ABC):
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        with _registry_lock:
+            _registry.append(self)
+
+    def _key(self, labels: Dict[str, str]) -> tuple:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} attend les labels {self.labelnames}, reçu {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for key, fields in sorted(_read(self.name).items()):
+            lines.extend(self._samples(key, fields))
+        return lines
+
+    @abc.abstractmethod
+    def _samples(self, key: tuple, fields: Dict[str, float]) -> List[str]:
+        """Lignes d'une série, à partir de ses champs stockés"""
+
+
+class Counter(_Metric):
+    """Compteur croissant, par combinaison de labels"""
+
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        _add(self.name, self._key(labels), {"": amount})
+
+    def value(self, **labels) -> float:
+        return _read(self.name).get(self._key(labels), {}).get("", 0)
+
+    def _samples(self, key: tuple, fields: Dict[str, float]) -> List[str]:
+        return [f"{self.name}{_format_labels(list(zip(self.labelnames, key)))} {_format_number(fields.get('', 0))}"]
+
+
+class Histogram(_Metric):
+    """Histogramme à bornes fixes (le : inférieur ou égal), par combinaison de labels"""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        bounds = self.buckets + (float("inf"),)
+        bucket = _format_number(bounds[bisect.bisect_left(self.buckets, value)])
+        _add(self.name, self._key(labels), {f"le={bucket}": 1, "sum": value, "count": 1})
+
+    @contextmanager
+    def time(self, **labels):
+        """Mesure la durée du bloc ; une exception est comptée dans STAGE_ERRORS si labels décrit une étape"""
+        start = time.perf_counter()
+        try:
+            yield
+        except BaseException:
+            if "stage" in labels and "pipeline" in labels:
+                STAGE_ERRORS.inc(pipeline=labels["pipeline"], stage=labels["stage"])
+            raise
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def count(self, **labels) -> int:
+        return int(_read(self.name).get(self._key(labels), {}).get("count", 0))
+
+    def _samples(self, key: tuple, fields: Dict[str, float]) -> List[str]:
+        pairs = list(zip(self.labelnames, key))
+        lines, cumulative = [], 0
+        for bound in self.buckets + (float("inf"),):
+            bound = _format_number(bound)
+            cumulative += int(fields.get(f"le={bound}", 0))
+            lines.append(f"{self.name}_bucket{_format_labels(pairs + [('le', bound)])} {cumulative}")
+        lines.append(f"{self.name}_sum{_format_labels(pairs)} {_format_number(fields.get('sum', 0))}")
+        lines.append(f"{self.name}_count{_format_labels(pairs)} {int(fields.get('count', 0))}")
+        return lines
+
+
+def render() -> str:
+    """Toutes les métriques, cumulées sur les workers, au format texte de Prometheus"""
+    with _registry_lock:
+        metrics = list(_registry)
+    return "\n".join(line for metric in metrics for line in metric.render()) + "\n"
+
+
+# Étapes des pipelines : extract (save_upload, page_selection, upload, rules_file, generate, parse,
+# save_result, catalog_write, total), compare (catalog_load, rank, render, prompt_build, generate),
+# combinations (catalog_load, rank) et polish (generate)
+STAGE_SECONDS = Histogram(
+    "brokins_stage_duration_seconds", "Durée de chaque étape des pipelines", ("pipeline", "stage")
+)
+STAGE_ERRORS = Counter(
+    "brokins_stage_errors_total", "Étapes interrompues par une exception", ("pipeline", "stage")
+)
+HTTP_SECONDS = Histogram(
+    "brokins_http_request_duration_seconds", "Durée des requêtes HTTP", ("endpoint", "method", "status")
+)
+MODEL_CALLS = Counter(
+    "brokins_model_calls_total", "Appels au modèle par issue (ok, quota, error, discarded)", ("pipeline", "outcome")
+)
+MODEL_RETRIES = Counter(
+    "brokins_model_retries_total", "Nouvelles tentatives d'appel au modèle", ("pipeline", "reason")
+)
+MODEL_TOKENS = Counter(
+    "brokins_model_tokens_total", "Tokens facturés par le modèle (in : prompt, out : réponse)", ("pipeline", "direction")
+)
+PROMPT_TOKENS = Histogram(
+    "brokins_prompt_tokens", "Taille estimée des prompts envoyés", ("pipeline",), buckets=TOKEN_BUCKETS
+)
+QUOTA_ERRORS = Counter(
+    "brokins_quota_errors_total", "Erreurs 429 reçues de l'API", ("limiter",)
+)
+CACHE_LOOKUPS = Counter(
+    "brokins_cache_lookups_total", "Consultations des caches (hit, miss)", ("cache", "result")
+)
+
+
+def record_usage(pipeline: str, response):
+    """Comptabilise les tokens d'une réponse du modèle, si l'API les indique"""
+    usage = getattr(response, "usage_metadata", None)
+    if usage is None:
+        return
+    MODEL_TOKENS.inc(getattr(usage, "prompt_token_count", 0) or 0, pipeline=pipeline, direction="in")
+    MODEL_TOKENS.inc(getattr(usage, "candidates_token_count", 0) or 0, pipeline=pipeline, direction="out")
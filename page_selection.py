@@ -0,0 +1,153 @@
+"""
+Présélection locale des pages d'un PDF de contrat
+Le texte de chaque page est extrait localement ; seules les pages du tableau des garanties
+(noms de niveaux demandés et mots-clés des garanties) sont envoyées au modèle
+"""
+
+import logging
+import os
+import re
+import tempfile
+import unicodedata
+from typing import List, Optional, Tuple, Union
+
+logger = logging.getLogger(__name__)
+
+# En dessous de ce nombre de pages, le PDF est envoyé tel quel
+PAGE_SELECTION_MIN_PAGES = int(os.environ.get("PAGE_SELECTION_MIN_PAGES", 4))
+# Nombre de mots-clés distincts à partir duquel une page est considérée comme un tableau de garanties
+PAGE_SELECTION_MIN_KEYWORDS = int(os.environ.get("PAGE_SELECTION_MIN_KEYWORDS", 3))
+# Écart maximal (en pages) comblé entre deux pages retenues
+PAGE_SELECTION_MAX_GAP = 1
+
+# Mots-clés des tableaux de garanties, sans accents et en minuscules
+GUARANTEE_KEYWORDS = (
+    "hospitalisation", "chambre particuliere", "honoraires", "chirurg", "optam",
+    "consultation", "generaliste", "specialiste", "dentaire", "implant", "orthodont",
+    "prothese", "optique", "verres", "monture", "brss", "% br", "base de remboursement",
+    "tableau des garanties",
+)
+
+
+def _normalize_text(text: str) -> str:
+    """Minuscules, sans accents, espaces consécutifs fusionnés"""
+    text = unicodedata.normalize("NFKD", text or "")
+    text = "".join(char for char in text if not unicodedata.combining(char))
+    return re.sub(r"\s+", " ", text).lower()
+
+
+def select_pages(texts: List[str], level_names: Union[List[str], str, None] = None) -> Optional[List[int]]:
+    """
+    Pages à envoyer au modèle
+
+    Les pages citant au moins PAGE_SELECTION_MIN_KEYWORDS mots-clés de garanties sont candidates.
+    Si des niveaux sont demandés, on garde les candidates qui citent l'un d'eux, suivies des
+    candidates contiguës (suite du tableau) ; sinon toutes les candidates. Les trous
+    d'au plus PAGE_SELECTION_MAX_GAP pages sont comblés.
+
+    Args:
+        texts (List[str]): Texte de chaque page, normalisé par _normalize_text
+        level_names (list or str): Niveaux demandés, ou "all" / None pour tous
+
+    Returns:
+        List[int] or None: Indices des pages (à partir de 0), ou None pour envoyer le PDF complet
+    """
+    if len(texts) < PAGE_SELECTION_MIN_PAGES:
+        return None
+
+    candidates = [
+        i for i, text in enumerate(texts)
+        if sum(keyword in text for keyword in GUARANTEE_KEYWORDS) >= PAGE_SELECTION_MIN_KEYWORDS
+    ]
+    if not candidates:
+        # PDF scanné ou mise en page inhabituelle : on ne prend pas de risque
+        return None
+
+    selected = candidates
+    if isinstance(level_names, list):
+        names = [_normalize_text(name).strip() for name in level_names if name and name.strip()]
+        named = [i for i in candidates if any(name in texts[i] for name in names)]
+        if named:
+            candidate_set = set(candidates)
+            selected = set(named)
+            for i in named:
+                following = i + 1
+                while following in candidate_set:
+                    selected.add(following)
+                    following += 1
+            selected = sorted(selected)
+
+    pages = [selected[0]]
+    for i in selected[1:]:
+        if i - pages[-1] <= PAGE_SELECTION_MAX_GAP + 1:
+            pages.extend(range(pages[-1] + 1, i + 1))
+        else:
+            pages.append(i)
+    if len(pages) >= len(texts):
+        return None
+    return pages
+
+
+def format_page_range(pages: List[int]) -> str:
+    """Indices de pages (à partir de 0) -> plage au format de source.page_range ("6-7", "3", "2-3, 8")"""
+    ranges = []
+    start = previous = pages[0]
+    for page in pages[1:] + [None]:
+        if page is not None and page == previous + 1:
+            previous = page
+            continue
+        ranges.append(f"{start + 1}" if start == previous else f"{start + 1}-{previous + 1}")
+        if page is not None:
+            start = previous = page
+    return ", ".join(ranges)
+
+
+def _load_pypdf():
+    """pypdf, importé à la première extraction plutôt qu'au démarrage des workers"""
+    try:
+        import pypdf
+    except ImportError:  # Installation sans pypdf : le PDF complet est envoyé
+        logger.warning("pypdf is not installed: page selection is disabled, full PDFs are sent to the model")
+        return None
+    return pypdf
+
+
+def reduce_pdf(pdf_path: str, level_names: Union[List[str], str, None] = None) -> Tuple[str, str]:
+    """
+    Construit un PDF réduit aux pages utiles
+
+    Le PDF complet est conservé (et "all" retourné) si pypdf est absent, si le texte des pages
+    n'est pas exploitable ou si aucune page ne peut être écartée.
+
+    Args:
+        pdf_path (str): PDF du contrat
+        level_names (list or str): Niveaux demandés, ou "all" / None pour tous
+
+    Returns:
+        tuple: (chemin du PDF à envoyer, plage de pages retenue) ; le chemin est un fichier
+        temporaire, à supprimer par l'appelant, s'il diffère de pdf_path
+    """
+    pypdf = _load_pypdf()
+    if pypdf is None:
+        return pdf_path, "all"
+
+    try:
+        reader = pypdf.PdfReader(pdf_path)
+        pages = select_pages([_normalize_text(page.extract_text()) for page in reader.pages], level_names)
+        if pages is None:
+            return pdf_path, "all"
+
+        writer = pypdf.PdfWriter()
+        for i in pages:
+            writer.add_page(reader.pages[i])
+        fd, reduced_path = tempfile.mkstemp(suffix=".pdf", prefix="pages_")
+        with os.fdopen(fd, "wb") as f:
+            writer.write(f)
+    except Exception as e:
+        logger.warning("Page selection failed for %s, sending the full PDF: %s", os.path.basename(pdf_path), e)
+        return pdf_path, "all"
+
+    page_range = format_page_range(pages)
+    logger.info("Page selection: %d/%d pages kept (%s) for %s",
+                len(pages), len(reader.pages), page_range, os.path.basename(pdf_path))
+    return reduced_path, page_range
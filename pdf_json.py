@@ -1,63 +1,147 @@
+import hashlib
 import json
+import logging
 import os
-import time
+import re
 import threading
-import google.generativeai as genai
+import time
+
+from contract_store import get_store
+from metrics import CACHE_LOOKUPS, MODEL_CALLS, MODEL_RETRIES, STAGE_SECONDS, record_usage
+from page_selection import reduce_pdf
+from rate_limiter import QuotaExceededError, get_rate_limiter
+from reference_files import file_digest, get_reference_file, invalidate_reference_file
+
+logger = logging.getLogger(__name__)
 
-# Protection contre les appels simultanés
-_extraction_lock = threading.Lock()
-_last_extraction_time = 0
-MIN_DELAY_BETWEEN_CALLS = 2  # 2 secondes minimum entre les appels
+# Les extractions tournent en arrière-plan : elles peuvent attendre un jeton plus longtemps que /compare
+EXTRACTION_MAX_WAIT = float(os.environ.get("EXTRACTION_MAX_WAIT", 120))
 
+# Cache des extractions, adressé par le contenu du PDF et des fichiers de référence
+EXTRACTION_CACHE_DIR = os.path.join("extractions", "cache")
+RULES_PDF_PATH = "regles.pdf"
+EXAMPLES_PATH = "examples.json"
 
-def extract_contract_level_from_pdf(pdf_path, level_name, append_to_file=0):
+# Valeur de level_names demandant l'extraction de tous les niveaux du PDF
+ALL_LEVELS = "all"
+
+
+def extraction_cache_key(pdf_path, level_name):
     """
-    Extrait les données structurées d'un niveau de contrat d'assurance à partir d'un fichier PDF
-    en utilisant Gemini 2.5 Pro.
+    Clé de cache d'une extraction : contenu du PDF, niveau demandé et versions de regles.pdf et examples.json.
 
     Args:
         pdf_path (str): Le chemin vers le fichier PDF à analyser.
-        level_name (str): Le nom du niveau à extraire (ex. "Niveau 1").
-        append_to_file (int): Si 1, le JSON extrait est ajouté à contracts.json. Par défaut à 0.
+        level_name (str): Le nom du niveau à extraire (ou la liste des niveaux d'un lot, un par ligne).
 
     Returns:
-        str or dict: Une chaîne JSON contenant les garanties extraites, ou un dictionnaire d'erreur.
+        str: La clé SHA-256 de l'extraction.
     """
-    global _last_extraction_time
-    
-    # Protection contre les appels simultanés et rate limiting
-    with _extraction_lock:
-        current_time = time.time()
-        time_since_last_call = current_time - _last_extraction_time
-        
-        if time_since_last_call < MIN_DELAY_BETWEEN_CALLS:
-            sleep_time = MIN_DELAY_BETWEEN_CALLS - time_since_last_call
-            print(f"⏳ Rate limiting: Attente de {sleep_time:.1f}s avant l'appel API...")
-            time.sleep(sleep_time)
-        
-        _last_extraction_time = time.time()
-    
-    contract_file_gai = None
-    rules_file_gai = None
+    parts = [
+        file_digest(pdf_path),
+        level_name.strip(),
+        file_digest(RULES_PDF_PATH),
+        file_digest(EXAMPLES_PATH),
+    ]
+    return hashlib.sha256("\0".join(parts).encode("utf-8")).hexdigest()
+
+
+def _read_cached_extraction(cache_key):
+    """Retourne le texte d'une extraction déjà réalisée, ou None."""
+    cache_path = os.path.join(EXTRACTION_CACHE_DIR, f"{cache_key}.json")
     try:
-        # 1. API Key
-        api_key = os.environ.get("GOOGLE_API_KEY")
-        if not api_key:
-            raise ValueError("La variable d'environnement GOOGLE_API_KEY n'est pas définie.")
-        
-        genai.configure(api_key=api_key)
+        with open(cache_path, "r", encoding="utf-8") as f:
+            return json.load(f)["extracted_text"]
+    except (FileNotFoundError, json.JSONDecodeError, KeyError):
+        return None
 
-        # 2. Load example JSON structure
-        with open("examples.json", "r", encoding="utf-8") as f:
-            examples = json.load(f)
 
-        if not isinstance(examples, list) or len(examples) == 0:
-            raise ValueError("Le fichier examples.json est vide ou mal formaté.")
+def _write_cached_extraction(cache_key, pdf_path, level_name, extracted_text):
+    """Enregistre une extraction réussie dans le cache (écriture atomique)."""
+    os.makedirs(EXTRACTION_CACHE_DIR, exist_ok=True)
+    cache_path = os.path.join(EXTRACTION_CACHE_DIR, f"{cache_key}.json")
+    tmp_path = f"{cache_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    entry = {
+        "pdf_name": os.path.basename(pdf_path),
+        "level_name": level_name,
+        "created_at": int(time.time()),
+        "extracted_text": extracted_text,
+    }
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(entry, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, cache_path)
 
-        example_json = json.dumps(examples[0], indent=2, ensure_ascii=False)
 
-        # 3. Prepare prompt
-        prompt = f"""
+def parse_extraction_output(extracted_text):
+    """
+    Décode la réponse du modèle, éventuellement entourée de balises ```json.
+
+    Args:
+        extracted_text (str): Le texte retourné par le modèle.
+
+    Returns:
+        dict or list: Le JSON décodé.
+
+    Raises:
+        json.JSONDecodeError: Si la réponse ne contient pas de JSON valide.
+    """
+    match = re.search(r'```json\s*([\s\S]*?)\s*```', extracted_text)
+    return json.loads(match.group(1) if match else extracted_text)
+
+
+def _is_valid_json_output(extracted_text):
+    """Vérifie que la réponse du modèle contient un JSON exploitable."""
+    try:
+        parse_extraction_output(extracted_text)
+        return True
+    except json.JSONDecodeError:
+        return False
+
+
+def _record_page_range(extracted_text, page_range):
+    """Renseigne source.page_range (pages du PDF d'origine) dans chaque niveau extrait."""
+    try:
+        extracted = parse_extraction_output(extracted_text)
+    except json.JSONDecodeError:
+        return extracted_text
+    for level in extracted if isinstance(extracted, list) else [extracted]:
+        if isinstance(level, dict):
+            source = level.get("source") if isinstance(level.get("source"), dict) else {}
+            source["page_range"] = page_range
+            level["source"] = source
+    return json.dumps(extracted, ensure_ascii=False, indent=2)
+
+
+def _append_to_catalog(extracted_text):
+    """Ajoute le ou les niveaux extraits au catalogue de contrats, en une seule transaction."""
+    try:
+        new_contract_data = parse_extraction_output(extracted_text)
+        with STAGE_SECONDS.time(pipeline="extract", stage="catalog_write"):
+            if isinstance(new_contract_data, list):
+                get_store().add_many(new_contract_data)
+            else:
+                get_store().add(new_contract_data)
+        logger.info("Appended extracted data to the contract store")
+
+    except json.JSONDecodeError:
+        logger.error("Extracted content is not valid JSON, not appended to the contract store")
+    except Exception as e:
+        logger.exception("An unexpected error occurred while appending to the contract store: %s", e)
+
+
+def _load_example_json():
+    """Charge le premier exemple de examples.json, utilisé comme modèle de sortie."""
+    with open(EXAMPLES_PATH, "r", encoding="utf-8") as f:
+        examples = json.load(f)
+
+    if not isinstance(examples, list) or len(examples) == 0:
+        raise ValueError("Le fichier examples.json est vide ou mal formaté.")
+
+    return json.dumps(examples[0], indent=2, ensure_ascii=False)
+
+
+def _level_prompt(level_name, example_json):
+    return f"""
 Tu es une IA experte en extraction de données contractuelles à partir de documents PDF.
 
 **Ta mission est double :**
@@ -76,89 +160,202 @@ Le format de sortie doit être un **JSON strict**, comme cet exemple :
 ➡️ Retourne exclusivement le JSON, sans explication ou texte additionnel.
 """
 
-        # 4. Upload files to Google AI
-        print("Uploading contract file to Google AI...")
-        contract_file_gai = genai.upload_file(path=pdf_path, display_name=os.path.basename(pdf_path))
-        print(f"Contract file uploaded successfully: {contract_file_gai.uri}")
 
-        rules_pdf_path = "regles.pdf"
+def _batch_prompt(level_names, example_json):
+    if level_names:
+        levels = "\n".join(f'- "{name}"' for name in level_names)
+        scope = f"L'extraction concerne les niveaux suivants, dans cet ordre :\n{levels}"
+    else:
+        scope = "L'extraction concerne **tous les niveaux** (formules) présents dans le PDF, dans leur ordre d'apparition."
+
+    return f"""
+Tu es une IA experte en extraction de données contractuelles à partir de documents PDF.
+
+**Ta mission est double :**
+1.  **Analyser le PDF de règles (`regles.pdf`)** pour comprendre les instructions d'extraction.
+2.  **Extraire les données du PDF du contrat** en suivant scrupuleusement ces règles.
+
+{scope}
+
+Le format de sortie doit être un **tableau JSON strict** contenant **un objet par niveau**, chaque objet ayant exactement la structure de cet exemple :
+```json
+{example_json}
+```
+
+Chaque niveau doit avoir son propre `level_id` unique et son `level_name` tel qu'écrit dans le PDF.
+
+🔍 **Instruction cruciale :** Le PDF `regles.pdf` fourni contient les directives impératives pour l'extraction. Tu dois t'y conformer.
+
+➡️ Retourne exclusivement le tableau JSON, sans explication ou texte additionnel.
+"""
+
+
+def extract_contract_level_from_pdf(pdf_path, level_name, append_to_file=0, force=False):
+    """
+    Extrait les données structurées d'un niveau de contrat d'assurance à partir d'un fichier PDF
+    en utilisant Gemini 2.5 Pro.
+
+    Une extraction déjà réalisée pour le même PDF, le même niveau et les mêmes fichiers de
+    référence est relue depuis extractions/cache sans appel au modèle.
+
+    Args:
+        pdf_path (str): Le chemin vers le fichier PDF à analyser.
+        level_name (str): Le nom du niveau à extraire (ex. "Niveau 1").
+        append_to_file (int): Si 1, le JSON extrait est ajouté au catalogue de contrats. Par défaut à 0.
+        force (bool): Si True, ignore le cache et relance l'extraction. Par défaut à False.
+
+    Returns:
+        str or dict: Une chaîne JSON contenant les garanties extraites, ou un dictionnaire d'erreur.
+    """
+    extracted_text = _extract_from_pdf(
+        pdf_path, level_name, lambda example_json: _level_prompt(level_name, example_json), force
+    )
+    if isinstance(extracted_text, str) and append_to_file == 1:
+        _append_to_catalog(extracted_text)
+    return extracted_text
+
+
+def extract_contract_levels_from_pdf(pdf_path, level_names=ALL_LEVELS, append_to_file=0, force=False):
+    """
+    Extrait plusieurs niveaux d'un même PDF en un seul appel au modèle.
+
+    Args:
+        pdf_path (str): Le chemin vers le fichier PDF à analyser.
+        level_names (list or str): Les noms des niveaux à extraire, ou ALL_LEVELS pour tous les niveaux du PDF.
+        append_to_file (int): Si 1, tous les niveaux extraits sont ajoutés au catalogue en une seule transaction.
+        force (bool): Si True, ignore le cache et relance l'extraction. Par défaut à False.
+
+    Returns:
+        str or dict: Une chaîne contenant un tableau JSON (un objet par niveau), ou un dictionnaire d'erreur.
+    """
+    if level_names == ALL_LEVELS or not level_names:
+        level_names = []
+    level_spec = "\n".join(level_names) if level_names else ALL_LEVELS
+
+    extracted_text = _extract_from_pdf(
+        pdf_path, level_spec, lambda example_json: _batch_prompt(level_names, example_json), force
+    )
+    if isinstance(extracted_text, str) and append_to_file == 1:
+        _append_to_catalog(extracted_text)
+    return extracted_text
+
+
+def _extract_from_pdf(pdf_path, level_spec, build_prompt, force=False):
+    """
+    Envoie le PDF et le prompt au modèle, en passant par le cache des extractions.
+
+    Args:
+        pdf_path (str): Le chemin vers le fichier PDF à analyser.
+        level_spec (str): Le ou les niveaux demandés, utilisés pour la clé de cache.
+        build_prompt (callable): Construit le prompt à partir de l'exemple JSON.
+        force (bool): Si True, ignore le cache.
+
+    Returns:
+        str or dict: Le texte retourné par le modèle, ou un dictionnaire d'erreur.
+    """
+    try:
+        cache_key = extraction_cache_key(pdf_path, level_spec)
+    except OSError as e:
+        logger.warning("Could not compute extraction cache key, cache disabled: %s", e)
+        cache_key = None
+
+    if cache_key and not force:
+        cached_text = _read_cached_extraction(cache_key)
+        CACHE_LOOKUPS.inc(cache="extraction", result="miss" if cached_text is None else "hit")
+        if cached_text is not None:
+            logger.info("Extraction cache hit: %s", cache_key)
+            return cached_text
+
+    # SDK importé au premier appel au modèle (un résultat en cache n'en a pas besoin)
+    import google.generativeai as genai
+    from google.api_core.exceptions import NotFound, PermissionDenied
+
+    contract_file_gai = None
+    rules_file_gai = None
+    upload_path = pdf_path
+    try:
+        # 1. API Key
+        api_key = os.environ.get("GOOGLE_API_KEY")
+        if not api_key:
+            raise ValueError("La variable d'environnement GOOGLE_API_KEY n'est pas définie.")
+        
+        genai.configure(api_key=api_key)
+
+        # 2. Load example JSON structure and prepare prompt
+        prompt = build_prompt(_load_example_json())
+
+        # 3. Keep only the guarantees pages, then upload files to Google AI
+        level_names = None if level_spec == ALL_LEVELS else level_spec.split("\n")
+        with STAGE_SECONDS.time(pipeline="extract", stage="page_selection"):
+            upload_path, page_range = reduce_pdf(pdf_path, level_names)
+
+        logger.info("Uploading contract file to Google AI")
+        with STAGE_SECONDS.time(pipeline="extract", stage="upload"):
+            contract_file_gai = genai.upload_file(path=upload_path, display_name=os.path.basename(pdf_path))
+        logger.debug("Contract file uploaded: %s", contract_file_gai.uri)
+
+        rules_pdf_path = RULES_PDF_PATH
         if not os.path.exists(rules_pdf_path):
             raise FileNotFoundError("Le fichier regles.pdf est introuvable.")
 
-        print("Uploading rules file to Google AI...")
-        rules_file_gai = genai.upload_file(path=rules_pdf_path, display_name="regles.pdf")
-        print(f"Rules file uploaded successfully: {rules_file_gai.uri}")
+        # Le fichier de règles est envoyé une fois puis réutilisé entre les extractions
+        with STAGE_SECONDS.time(pipeline="extract", stage="rules_file"):
+            rules_file_gai = get_reference_file(rules_pdf_path, display_name="regles.pdf")
 
-        # 5. Call Gemini Pro 2.5 avec retry logic
+        # 4. Call Gemini Pro 2.5, cadencé par le limiteur partagé entre workers
         model = genai.GenerativeModel("gemini-2.5-pro")
         
-        print("Generating content with Gemini...")
+        logger.info("Generating content with Gemini")
         max_retries = 3
         for attempt in range(max_retries):
             try:
-                response = model.generate_content([prompt, rules_file_gai, contract_file_gai])
-                print("Content generation complete.")
+                with STAGE_SECONDS.time(pipeline="extract", stage="generate"):
+                    response = get_rate_limiter().call(
+                        model.generate_content, [prompt, rules_file_gai, contract_file_gai],
+                        max_wait=EXTRACTION_MAX_WAIT,
+                    )
+                MODEL_CALLS.inc(pipeline="extract", outcome="ok")
+                record_usage("extract", response)
                 break
-            except Exception as e:
-                if "429" in str(e) or "quota" in str(e).lower():
-                    if attempt < max_retries - 1:
-                        wait_time = (attempt + 1) * 30  # 30s, 60s, 90s
-                        print(f"⚠️ Quota épuisé (tentative {attempt + 1}/{max_retries}). Attente de {wait_time}s...")
-                        time.sleep(wait_time)
-                        continue
+            except (NotFound, PermissionDenied) as e:
+                # Le handle réutilisé a expiré ou été supprimé côté API : on renvoie le fichier
+                if attempt < max_retries - 1:
+                    logger.warning("Fichier de règles indisponible (%s), nouvel envoi", e)
+                    MODEL_RETRIES.inc(pipeline="extract", reason="reference_file")
+                    invalidate_reference_file(rules_pdf_path)
+                    rules_file_gai = get_reference_file(rules_pdf_path, display_name="regles.pdf")
+                    continue
                 raise e
 
         extracted_text = response.text.strip()
+        if upload_path != pdf_path:
+            # Le modèle n'a vu que les pages retenues : leur numérotation ne correspond pas au PDF d'origine
+            extracted_text = _record_page_range(extracted_text, page_range)
 
-        if append_to_file == 1:
+        if cache_key and _is_valid_json_output(extracted_text):
             try:
-                new_contract_data = json.loads(extracted_text)
-
-                contracts_file = "contracts.json"
-                contracts_data = []
-
-                if os.path.exists(contracts_file):
-                    try:
-                        with open(contracts_file, "r", encoding="utf-8") as f:
-                            content = f.read()
-                            if content:
-                                contracts_data = json.loads(content)
-                    except (json.JSONDecodeError, IOError) as e:
-                        print(f"Warning: Could not read or parse {contracts_file}. It will be overwritten. Error: {e}")
-                        contracts_data = []
-                
-                if not isinstance(contracts_data, list):
-                    print(f"Warning: Data in {contracts_file} is not a list. It will be overwritten with a new list.")
-                    contracts_data = []
-
-                contracts_data.append(new_contract_data)
-
-                with open(contracts_file, "w", encoding="utf-8") as f:
-                    json.dump(contracts_data, f, indent=2, ensure_ascii=False)
-                
-                print(f"Successfully appended extracted data to {contracts_file}")
-
-            except json.JSONDecodeError:
-                print("Error: Extracted content is not valid JSON. Cannot append to file.")
-            except Exception as e:
-                print(f"An unexpected error occurred while appending to file: {e}")
+                _write_cached_extraction(cache_key, pdf_path, level_spec, extracted_text)
+            except OSError as e:
+                logger.warning("Could not write extraction cache: %s", e)
 
         return extracted_text
 
+    except QuotaExceededError as e:
+        MODEL_CALLS.inc(pipeline="extract", outcome="quota")
+        logger.warning("Erreur : %s", e)
+        return {"error": str(e), "retry_after": round(e.retry_after)}
+
     except (ValueError, json.JSONDecodeError, FileNotFoundError) as e:
-        print(f"Erreur : {e}")
+        logger.error("Erreur : %s", e)
         return {"error": str(e)}
 
     except Exception as e:
-        print(f"Erreur inattendue : {e}")
+        logger.exception("Erreur inattendue : %s", e)
         return {"error": "Une erreur inattendue est survenue lors de l'extraction du contrat depuis le PDF."}
 
     finally:
         if contract_file_gai:
-            print(f"Deleting uploaded contract file: {contract_file_gai.name}")
+            logger.debug("Deleting uploaded contract file: %s", contract_file_gai.name)
             genai.delete_file(contract_file_gai.name)
-            print("Contract file deleted.")
-        if rules_file_gai:
-            print(f"Deleting uploaded rules file: {rules_file_gai.name}")
-            genai.delete_file(rules_file_gai.name)
-            print("Rules file deleted.")
\ No newline at end of file
+        if upload_path != pdf_path and os.path.exists(upload_path):
+            os.remove(upload_path)
\ No newline at end of file
@@ -0,0 +1,331 @@
+"""
+Moteur de classement local des contrats
+Applique la logique de ranking_logic.md sans appel au modèle génératif
+"""
+
+from typing import Dict, Iterator, List
+
+import numpy as np
+
+from guarantee_matrix import GuaranteeMatrix, unit_code
+from value_analyzer import GuaranteeAnalyzer
+
+TOP_N = 10
+
+# Écarts relatifs maximum et score associé (bandes de couleur du prompt)
+PROXIMITY_BANDS = [
+    (0.05, 1.0),   # Identique ou ±5% : vert foncé
+    (0.20, 0.8),   # ±5-20% : vert standard
+    (0.50, 0.6),   # ±20-50% : vert clair
+    (1.00, 0.4),   # ±50-100% : orange clair
+    (2.00, 0.2),   # ±100-200% : orange foncé
+]                  # >200% ou absence : rouge (0)
+
+# Libellé de chaque bande dans les colonnes points forts / faibles (dernière : rouge)
+BAND_LABELS = ["identique", "très proche", "proche", "écart marqué", "écart important", "hors cible"]
+
+BAND_EDGES = np.array([max_gap for max_gap, _ in PROXIMITY_BANDS])
+BAND_SCORES = np.array([score for _, score in PROXIMITY_BANDS] + [0.0])
+
+# Les scores sont arrondis pour que les égalités soient départagées par level_id,
+# quel que soit l'ordre de sommation
+SCORE_DECIMALS = 9
+
+# Pondération du score global
+WEIGHT_PROXIMITY = 0.5
+WEIGHT_COVERAGE = 0.3
+WEIGHT_COHERENCE = 0.2
+
+# Critères d'éligibilité des rangs
+RANK1_MAX_RELATIVE_GAP = 0.10   # Rang 1 : ±10%
+RANK2_MAX_ABSOLUTE_GAP = 50     # Rangs 2-3 : ±50 unités
+
+# (nombre de places, pourcentage min, pourcentage max) par palier
+TIERS = [
+    (1, 95, 100),   # Rang 1 : presque identique
+    (2, 85, 94),    # Rangs 2-3 : marge acceptable
+    (3, 75, 84),    # Rangs 4-6 : couvrent tous les besoins
+    (None, 50, 74), # Rangs 7-10 : les plus proches parmi les restants
+]
+
+
+def contract_display_name(contract: Dict) -> str:
+    """Nom complet d'un niveau de contrat pour l'affichage"""
+    parts = [contract.get("insurer", ""), contract.get("contract_name", "")]
+    name = " ".join(part for part in parts if part)
+    level_name = contract.get("level_name")
+    return f"{name} - {level_name}" if level_name else name
+
+
+def parse_user_needs(user_data: Dict, analyzer: GuaranteeAnalyzer) -> List[Dict]:
+    """
+    Extrait les besoins chiffrés du profil utilisateur
+
+    Args:
+        user_data (Dict): Profil issu du formulaire ({catégorie: {garantie: valeur}})
+        analyzer (GuaranteeAnalyzer): Analyseur de valeurs
+
+    Returns:
+        List[Dict]: Besoins exprimés (les valeurs nulles sont ignorées)
+    """
+    needs = []
+    for category, guarantees in (user_data or {}).items():
+        if not isinstance(guarantees, dict):
+            continue
+        for guarantee_name, raw_value in guarantees.items():
+            analysis = analyzer.analyze_value(str(raw_value))
+            if analysis["numeric_value"] <= 0:
+                continue
+            needs.append({
+                "category": category,
+                "guarantee": guarantee_name,
+                "value": analysis["numeric_value"],
+                "type": analysis["type"],
+                "unit": analysis["unit"],
+            })
+    return needs
+
+
+def _find_guarantee(benefits: Dict, category: str, guarantee_name: str):
+    """Cherche une garantie dans sa catégorie, puis dans les autres catégories"""
+    section = benefits.get(category)
+    if isinstance(section, dict) and guarantee_name in section:
+        return section[guarantee_name]
+    for guarantees in benefits.values():
+        if isinstance(guarantees, dict) and guarantee_name in guarantees:
+            return guarantees[guarantee_name]
+    return None
+
+
+def score_profile(matrix: GuaranteeMatrix, needs: List[Dict]) -> Dict:
+    """
+    Évalue tous les niveaux du catalogue face aux besoins en une seule opération matricielle
+
+    Args:
+        matrix (GuaranteeMatrix): Catalogue compilé
+        needs (List[Dict]): Besoins retournés par parse_user_needs
+
+    Returns:
+        Dict: Tableaux NumPy par contrat (score, écarts max, couverture) et par garantie
+    """
+    values, units, _ = matrix.gather([need["guarantee"] for need in needs])
+    need_values = np.array([need["value"] for need in needs], dtype=np.float64)
+    need_units = np.array([unit_code(need["type"], need["value"]) for need in needs], dtype=np.int8)
+
+    comparable = units == need_units
+    gap = values - need_values
+    relative_gap = np.abs(gap) / need_values if needs else gap
+    covered = comparable & (gap >= 0)
+    bands = np.where(comparable, BAND_SCORES[np.searchsorted(BAND_EDGES, relative_gap)], 0.0)
+
+    if needs:
+        proximity = bands.mean(axis=1)
+        coverage = covered.mean(axis=1)
+        coherence = comparable.mean(axis=1)
+    else:
+        proximity = coverage = coherence = np.ones(len(matrix))
+
+    all_comparable = comparable.all(axis=1)
+    return {
+        "values": values,
+        "comparable": comparable,
+        "gap": gap,
+        "relative_gap": relative_gap,
+        "covered": covered,
+        "score": np.round(
+            WEIGHT_PROXIMITY * proximity
+            + WEIGHT_COVERAGE * coverage
+            + WEIGHT_COHERENCE * coherence,
+            SCORE_DECIMALS,
+        ),
+        "max_relative_gap": np.where(all_comparable, relative_gap.max(axis=1, initial=0.0), np.inf),
+        "max_absolute_gap": np.where(all_comparable, np.abs(gap).max(axis=1, initial=0.0), np.inf),
+        "covers_all": covered.all(axis=1),
+    }
+
+
+def _tier_masks(scores: Dict) -> List[np.ndarray]:
+    """Masques d'éligibilité de chaque palier, dans l'ordre de TIERS"""
+    return [
+        scores["max_relative_gap"] <= RANK1_MAX_RELATIVE_GAP,
+        scores["max_absolute_gap"] <= RANK2_MAX_ABSOLUTE_GAP,
+        scores["covers_all"],
+        np.ones(len(scores["score"]), dtype=bool),
+    ]
+
+
+def _build_result(matrix: GuaranteeMatrix, row: int, needs: List[Dict], scores: Dict) -> Dict:
+    """Détaille un contrat sélectionné, garantie par garantie"""
+    contract = matrix.contracts[row]
+    benefits = contract.get("benefits") or {}
+    details = []
+    for k, need in enumerate(needs):
+        comparable = bool(scores["comparable"][row, k])
+        details.append({
+            "need": need,
+            "raw_value": _find_guarantee(benefits, need["category"], need["guarantee"]),
+            "value": float(scores["values"][row, k]) if comparable else None,
+            "gap": float(scores["gap"][row, k]) if comparable else None,
+            "relative_gap": float(scores["relative_gap"][row, k]) if comparable else None,
+            "covered": bool(scores["covered"][row, k]),
+        })
+    return {
+        "contract": contract,
+        "details": details,
+        "score": float(scores["score"][row]),
+    }
+
+
+def best_rows(score: np.ndarray, eligible: np.ndarray, level_id_order: np.ndarray, k: int) -> np.ndarray:
+    """
+    Les k meilleurs contrats éligibles : meilleur score d'abord, level_id pour départager
+
+    Seuls les candidats au moins aussi bons que le k-ième sont triés (égalités comprises).
+    """
+    candidates = np.flatnonzero(eligible)
+    if len(candidates) > k:
+        kth = np.partition(-score[candidates], k - 1)[k - 1]
+        candidates = candidates[-score[candidates] <= kth]
+    return candidates[np.lexsort((level_id_order[candidates], -score[candidates]))][:k]
+
+
+def select_tiers(score: np.ndarray, masks: List[np.ndarray], level_id_order: np.ndarray, top_n: int) -> List[tuple]:
+    """
+    Répartit les top_n places entre les paliers de TIERS
+
+    Chaque palier prend les meilleurs contrats éligibles restants ; les places
+    non pourvues d'un palier sont reportées sur le dernier palier.
+
+    Returns:
+        List[tuple]: (ligne de la matrice, indice du palier), dans l'ordre du classement
+    """
+    used = np.zeros(len(score), dtype=bool)
+    selected = []
+    for tier_index, ((slots, _, _), mask) in enumerate(zip(TIERS, masks)):
+        remaining = top_n - len(selected)
+        if remaining <= 0:
+            break
+        slots = remaining if slots is None else min(slots, remaining)
+        picks = best_rows(score, mask & ~used, level_id_order, slots)
+        used[picks] = True
+        selected.extend((int(row), tier_index) for row in picks)
+    return selected
+
+
+def rank_contracts(user_data: Dict, matrix: GuaranteeMatrix, top_n: int = TOP_N) -> List[Dict]:
+    """
+    Classe les contrats selon la logique de ranking_logic.md (voir select_tiers)
+
+    Args:
+        user_data (Dict): Profil issu du formulaire
+        matrix (GuaranteeMatrix): Catalogue compilé
+        top_n (int): Nombre de contrats à retourner
+
+    Returns:
+        List[Dict]: Contrats classés avec rang, palier et pourcentage de correspondance
+    """
+    needs = parse_user_needs(user_data, GuaranteeAnalyzer())
+    scores = score_profile(matrix, needs)
+
+    selected = []
+    for row, tier_index in select_tiers(scores["score"], _tier_masks(scores), matrix.level_id_order, top_n):
+        _, min_pct, max_pct = TIERS[tier_index]
+        result = _build_result(matrix, row, needs, scores)
+        result["tier"] = tier_index + 1
+        result["percentage"] = min_pct + round(result["score"] * (max_pct - min_pct))
+        selected.append(result)
+
+    for rank, result in enumerate(selected, start=1):
+        result["rank"] = rank
+    return selected
+
+
+def proximity_band(detail: Dict) -> int:
+    """Indice de la bande de couleur d'une garantie évaluée (len(PROXIMITY_BANDS) : rouge)"""
+    if detail["relative_gap"] is None:
+        return len(PROXIMITY_BANDS)
+    return int(np.searchsorted(BAND_EDGES, detail["relative_gap"]))
+
+
+def _format_value(detail: Dict) -> str:
+    """Formate la valeur d'un contrat pour les colonnes points forts / faibles"""
+    if detail["value"] is None:
+        return "non couvert" if detail["raw_value"] in (None, "", "-") else str(detail["raw_value"])
+    return str(detail["raw_value"])
+
+
+def _format_gap(detail: Dict, band: int) -> str:
+    """Écart au besoin et libellé de sa bande, ex: "+20% du besoin, très proche" """
+    if detail["relative_gap"] is None:
+        return BAND_LABELS[band]
+    if detail["gap"] == 0:
+        return "égal au besoin"
+    percent = round(100 * detail["gap"] / detail["need"]["value"])
+    return f"{percent:+d}% du besoin, {BAND_LABELS[band]}"
+
+
+def describe_evaluation(evaluation: Dict, analyzer: GuaranteeAnalyzer) -> Dict:
+    """
+    Liste les points forts et points faibles d'un contrat évalué
+
+    Chaque garantie est située dans les bandes du prompt (±5%, ±20%, ±50%, ±100%, ±200%) :
+    les points forts vont du plus proche au plus éloigné du besoin, les points faibles
+    du plus grave au moins grave.
+
+    Returns:
+        Dict: {"strengths": [...], "weaknesses": [...], "bands": {garantie: indice de bande}}
+    """
+    strengths, weaknesses, bands = [], [], {}
+    for detail in evaluation["details"]:
+        band = proximity_band(detail)
+        bands[detail["need"]["guarantee"]] = band
+        label = analyzer.format_guarantee_label(detail["need"]["guarantee"])
+        need_display = f"{detail['need']['value']:g} {detail['need']['unit']}".strip()
+        text = f"{label} : {_format_value(detail)} (besoin {need_display} ; {_format_gap(detail, band)})"
+        (strengths if detail["covered"] else weaknesses).append((band, text))
+
+    strengths.sort(key=lambda item: item[0])
+    weaknesses.sort(key=lambda item: -item[0])
+    return {
+        "strengths": [text for _, text in strengths],
+        "weaknesses": [text for _, text in weaknesses],
+        "bands": bands,
+    }
+
+
+TABLE_HEADER = [
+    "| Contrat | Pourcentage de correspondance | Points forts | Points faibles |",
+    "|--------|-------------------------------|--------------|----------------|",
+]
+
+
+def render_markdown_rows(ranked: List[Dict]) -> Iterator[str]:
+    """
+    Produit les lignes du tableau Markdown une à une, sans l'en-tête
+
+    Args:
+        ranked (List[Dict]): Résultat de rank_contracts
+
+    Yields:
+        str: Une ligne "| Contrat | Pourcentage | Points forts | Points faibles |" par contrat
+    """
+    analyzer = GuaranteeAnalyzer()
+    for evaluation in ranked:
+        description = describe_evaluation(evaluation, analyzer)
+        strengths = "; ".join(description["strengths"]) or "-"
+        weaknesses = "; ".join(description["weaknesses"]) or "-"
+        name = evaluation.get("name") or contract_display_name(evaluation["contract"])
+        yield f"| {name} | {evaluation['percentage']}% | {strengths} | {weaknesses} |"
+
+
+def render_markdown_table(ranked: List[Dict]) -> str:
+    """
+    Produit le tableau Markdown attendu par le frontend
+
+    Args:
+        ranked (List[Dict]): Résultat de rank_contracts
+
+    Returns:
+        str: Tableau Markdown (Contrat | Pourcentage | Points forts | Points faibles)
+    """
+    return "\n".join(TABLE_HEADER + list(render_markdown_rows(ranked)))
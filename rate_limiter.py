@@ -0,0 +1,251 @@
+"""
+Limiteur de débit partagé pour les appels Gemini
+Seau à jetons stocké dans SQLite (commun à tous les workers), backoff exponentiel avec gigue
+et disjoncteur qui échoue immédiatement tant que le quota est épuisé
+"""
+
+import logging
+import os
+import random
+import re
+import sqlite3
+import threading
+import time
+from typing import Callable, Optional
+
+from metrics import QUOTA_ERRORS
+
+logger = logging.getLogger(__name__)
+
+RATE_LIMIT_DB = os.environ.get("RATE_LIMIT_DB", "rate_limit.db")
+GEMINI_REQUESTS_PER_MINUTE = float(os.environ.get("GEMINI_REQUESTS_PER_MINUTE", 30))
+GEMINI_BURST = float(os.environ.get("GEMINI_BURST", 3))
+
+# Backoff après une erreur de quota sans indication du serveur
+BACKOFF_BASE = 2.0
+BACKOFF_MAX = 300.0
+
+# Disjoncteur : après N erreurs de quota consécutives, plus aucun appel pendant la pause
+CIRCUIT_BREAKER_THRESHOLD = 3
+CIRCUIT_BREAKER_COOLDOWN = 60.0
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS rate_limits (
+    name TEXT PRIMARY KEY,
+    tokens REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    blocked_until REAL NOT NULL DEFAULT 0,
+    failures INTEGER NOT NULL DEFAULT 0
+);
+"""
+
+_RETRY_HINT_PATTERNS = [
+    re.compile(r"retry in ([\d.]+)\s*s", re.IGNORECASE),
+    re.compile(r"retry_delay\s*\{\s*seconds:\s*(\d+)", re.IGNORECASE),
+]
+
+
+class QuotaExceededError(Exception):
+    """Levée quand le quota ne permet pas d'appeler le modèle dans le délai accordé"""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def is_quota_error(error: Exception) -> bool:
+    """Indique si une exception de l'API correspond à un dépassement de quota (HTTP 429)"""
+    try:
+        from google.api_core import exceptions as google_exceptions
+        if isinstance(error, google_exceptions.TooManyRequests):
+            return True
+    except ImportError:
+        pass
+    return getattr(error, "code", None) == 429
+
+
+def retry_hint(error: Exception) -> Optional[float]:
+    """
+    Délai d'attente suggéré par le serveur, s'il est présent dans l'erreur
+
+    Args:
+        error (Exception): Erreur de quota retournée par l'API
+
+    Returns:
+        float: Délai en secondes, ou None
+    """
+    for detail in getattr(error, "details", None) or []:
+        delay = getattr(detail, "retry_delay", None)
+        if delay is not None and (delay.seconds or delay.nanos):
+            return delay.seconds + delay.nanos / 1e9
+    message = str(error)
+    for pattern in _RETRY_HINT_PATTERNS:
+        match = pattern.search(message)
+        if match:
+            return float(match.group(1))
+    return None
+
+
+class RateLimiter:
+    """Seau à jetons partagé entre processus, avec backoff et disjoncteur"""
+
+    def __init__(self, name: str = "gemini", db_path: str = RATE_LIMIT_DB,
+                 requests_per_minute: float = GEMINI_REQUESTS_PER_MINUTE, burst: float = GEMINI_BURST,
+                 clock: Callable[[], float] = time.time, sleep: Callable[[float], None] = time.sleep):
+        """
+        Args:
+            name (str): Nom du quota partagé
+            db_path (str): Base SQLite commune aux workers
+            requests_per_minute (float): Débit soutenu autorisé
+            burst (float): Nombre d'appels autorisés d'affilée
+            clock (Callable): Horloge, remplaçable pour les tests
+            sleep (Callable): Fonction d'attente, remplaçable pour les tests
+        """
+        self.name = name
+        self.db_path = db_path
+        self.rate = requests_per_minute / 60.0
+        self.burst = burst
+        self._clock = clock
+        self._sleep = sleep
+        self._local = threading.local()
+        self._connect().executescript(SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _update_state(self, update: Callable):
+        """Lit, modifie et réécrit l'état du seau dans une transaction exclusive"""
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            now = self._clock()
+            row = conn.execute(
+                "SELECT tokens, updated_at, blocked_until, failures FROM rate_limits WHERE name = ?",
+                (self.name,),
+            ).fetchone()
+            tokens, updated_at, blocked_until, failures = row or (self.burst, now, 0.0, 0)
+            tokens = min(self.burst, tokens + max(0.0, now - updated_at) * self.rate)
+
+            result, tokens, blocked_until, failures = update(now, tokens, blocked_until, failures)
+            conn.execute(
+                "INSERT OR REPLACE INTO rate_limits (name, tokens, updated_at, blocked_until, failures) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (self.name, tokens, now, blocked_until, failures),
+            )
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+        return result
+
+    def try_acquire(self) -> float:
+        """
+        Prend un jeton si possible
+
+        Returns:
+            float: 0 si le jeton est accordé, sinon le délai d'attente estimé en secondes
+        """
+        def update(now, tokens, blocked_until, failures):
+            if now < blocked_until:
+                return blocked_until - now, tokens, blocked_until, failures
+            if tokens >= 1:
+                return 0.0, tokens - 1, blocked_until, failures
+            return (1 - tokens) / self.rate, tokens, blocked_until, failures
+
+        return self._update_state(update)
+
+    def acquire(self, max_wait: float):
+        """
+        Attend un jeton, au plus max_wait secondes
+
+        Raises:
+            QuotaExceededError: Si le jeton ne peut pas être obtenu dans le délai
+        """
+        deadline = self._clock() + max_wait
+        while True:
+            wait = self.try_acquire()
+            if wait <= 0:
+                return
+            if self._clock() + wait > deadline:
+                raise QuotaExceededError(
+                    f"Quota Gemini épuisé, réessayez dans {wait:.0f}s.", retry_after=wait
+                )
+            self._sleep(wait)
+
+    def record_success(self):
+        self._update_state(lambda now, tokens, blocked_until, failures: (None, tokens, blocked_until, 0))
+
+    def record_quota_error(self, hint: Optional[float] = None) -> float:
+        """
+        Enregistre une erreur de quota et bloque les appels pendant le backoff
+
+        Args:
+            hint (float): Délai suggéré par le serveur, prioritaire sur le backoff exponentiel
+
+        Returns:
+            float: Durée du blocage en secondes
+        """
+        def update(now, tokens, blocked_until, failures):
+            failures += 1
+            if hint is not None:
+                delay = hint + random.uniform(0, 1)
+            else:
+                delay = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** (failures - 1)) * random.uniform(0.5, 1.0)
+            if failures >= CIRCUIT_BREAKER_THRESHOLD:
+                delay = max(delay, CIRCUIT_BREAKER_COOLDOWN)
+            blocked_until = max(blocked_until, now + delay)
+            return blocked_until - now, 0.0, blocked_until, failures
+
+        return self._update_state(update)
+
+    def call(self, func: Callable, *args, max_wait: float = 30, max_attempts: int = 3, **kwargs):
+        """
+        Appelle func en respectant le quota, avec nouvelles tentatives sur erreur 429
+
+        Args:
+            func (Callable): Appel à l'API
+            max_wait (float): Attente maximale cumulée par tentative avant d'abandonner
+            max_attempts (int): Nombre maximum de tentatives
+
+        Returns:
+            Le résultat de func
+
+        Raises:
+            QuotaExceededError: Si le quota reste épuisé
+        """
+        for attempt in range(max_attempts):
+            self.acquire(max_wait)
+            try:
+                result = func(*args, **kwargs)
+            except Exception as e:
+                if not is_quota_error(e):
+                    raise
+                blocked_for = self.record_quota_error(retry_hint(e))
+                QUOTA_ERRORS.inc(limiter=self.name)
+                logger.warning("Quota épuisé (tentative %d/%d), appels suspendus %.0fs", attempt + 1, max_attempts, blocked_for)
+                if attempt == max_attempts - 1:
+                    raise QuotaExceededError(
+                        f"Quota Gemini épuisé, réessayez dans {blocked_for:.0f}s.", retry_after=blocked_for
+                    ) from e
+                continue
+            self.record_success()
+            return result
+
+
+_limiter = None
+_limiter_lock = threading.Lock()
+
+
+def get_rate_limiter() -> RateLimiter:
+    """Limiteur partagé pour tous les appels Gemini du processus"""
+    global _limiter
+    with _limiter_lock:
+        if _limiter is None:
+            _limiter = RateLimiter()
+        return _limiter
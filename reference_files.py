@@ -0,0 +1,132 @@
+"""
+Cache des documents de référence envoyés au modèle (regles.pdf)
+Le fichier est envoyé une seule fois par processus, puis réutilisé jusqu'à son expiration distante
+"""
+
+import hashlib
+import logging
+import os
+import threading
+import time
+from typing import Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# Les fichiers envoyés via l'API Gemini expirent après 48 h : on les renouvelle avant
+REFERENCE_FILE_TTL = float(os.environ.get("REFERENCE_FILE_TTL", 47 * 3600))
+
+# Empreintes des fichiers, recalculées seulement si leur taille ou leur date change
+_digest_cache: Dict[str, tuple] = {}
+_digest_lock = threading.Lock()
+
+
+def file_digest(path: str) -> str:
+    """
+    Empreinte SHA-256 d'un fichier, mémorisée tant que sa taille et sa date ne changent pas
+
+    Args:
+        path (str): Chemin du fichier
+
+    Returns:
+        str: Empreinte hexadécimale
+    """
+    stat = os.stat(path)
+    signature = (stat.st_size, stat.st_mtime_ns)
+    with _digest_lock:
+        cached = _digest_cache.get(path)
+    if cached and cached[0] == signature:
+        return cached[1]
+
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    with _digest_lock:
+        _digest_cache[path] = (signature, digest.hexdigest())
+    return digest.hexdigest()
+
+
+class ReferenceFileCache:
+    """Handles distants des documents de référence, indexés par empreinte du fichier"""
+
+    def __init__(self, file_api=None, ttl: float = REFERENCE_FILE_TTL, clock: Callable[[], float] = time.time):
+        """
+        Args:
+            file_api: Objet exposant upload_file(path=, display_name=) et delete_file(name),
+                par défaut le module google.generativeai
+            ttl (float): Durée de réutilisation d'un handle, en secondes
+            clock (Callable): Horloge, remplaçable pour les tests
+        """
+        self._file_api = file_api
+        self.ttl = ttl
+        self._clock = clock
+        self._handles: Dict[str, Dict] = {}   # empreinte -> {"path", "handle", "uploaded_at"}
+        self._lock = threading.Lock()
+
+    @property
+    def file_api(self):
+        if self._file_api is None:
+            import google.generativeai as genai
+            self._file_api = genai
+        return self._file_api
+
+    def get(self, path: str, display_name: Optional[str] = None):
+        """
+        Retourne le handle distant du fichier, en l'envoyant si nécessaire
+
+        Le fichier est renvoyé si son contenu a changé ou si le handle approche de son expiration.
+
+        Args:
+            path (str): Chemin local du document
+            display_name (str): Nom affiché côté API, par défaut le nom du fichier
+
+        Returns:
+            Le handle retourné par upload_file
+        """
+        digest = file_digest(path)
+        with self._lock:
+            entry = self._handles.get(digest)
+            if entry and self._clock() - entry["uploaded_at"] < self.ttl:
+                return entry["handle"]
+
+            # Handles périmés ou correspondant à une ancienne version du même fichier
+            stale = [key for key, e in self._handles.items() if key == digest or e["path"] == path]
+            for key in stale:
+                self._delete_remote(self._handles.pop(key)["handle"])
+
+            logger.info("Uploading reference file %s to Google AI", path)
+            handle = self.file_api.upload_file(path=path, display_name=display_name or os.path.basename(path))
+            logger.info("Reference file uploaded: %s", handle.uri)
+            self._handles[digest] = {"path": path, "handle": handle, "uploaded_at": self._clock()}
+            return handle
+
+    def invalidate(self, path: str):
+        """Oublie le handle d'un fichier (par exemple s'il a été supprimé côté API)"""
+        with self._lock:
+            for key in [key for key, e in self._handles.items() if e["path"] == path]:
+                self._delete_remote(self._handles.pop(key)["handle"])
+
+    def clear(self):
+        """Supprime tous les handles connus"""
+        with self._lock:
+            for entry in self._handles.values():
+                self._delete_remote(entry["handle"])
+            self._handles.clear()
+
+    def _delete_remote(self, handle):
+        try:
+            self.file_api.delete_file(handle.name)
+        except Exception as e:
+            logger.warning("Could not delete remote reference file %s: %s", handle.name, e)
+
+
+_reference_files = ReferenceFileCache()
+
+
+def get_reference_file(path: str, display_name: Optional[str] = None):
+    """Handle partagé par le processus pour un document de référence"""
+    return _reference_files.get(path, display_name)
+
+
+def invalidate_reference_file(path: str):
+    _reference_files.invalidate(path)
@@ -0,0 +1,340 @@
+"""
+Index des plus proches voisins du catalogue
+Arbre k-d sur les 7 garanties du formulaire, chaque dimension étant ramenée à l'échelle
+du slider correspondant (% BR et € deviennent comparables) ; mis à jour à partir du journal
+des modifications du catalogue
+"""
+
+import heapq
+import logging
+import math
+import threading
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from contract_store import ContractStore, get_store
+from coverage_index import INDEX_DIMENSIONS
+from value_analyzer import NORMALIZED_KEY, GuaranteeAnalyzer
+
+logger = logging.getLogger(__name__)
+
+KD_LEAF_SIZE = 16
+SIMILAR_DEFAULT_K = 10
+
+
+def dimension_scales(analyzer: GuaranteeAnalyzer, dimensions: Dict[str, str] = INDEX_DIMENSIONS) -> np.ndarray:
+    """Échelle de chaque dimension : le maximum du slider de la garantie dans son unité usuelle"""
+    scales = []
+    for guarantee_name, value_type in dimensions.items():
+        config = dict(analyzer.default_slider_configs[value_type])
+        config.update(analyzer.get_guarantee_specific_config(guarantee_name, value_type))
+        scales.append(float(config["max"]))
+    return np.array(scales)
+
+
+def guarantee_vector(contract: Dict, scales: np.ndarray, analyzer: GuaranteeAnalyzer,
+                     dimensions: Dict[str, str] = INDEX_DIMENSIONS) -> np.ndarray:
+    """
+    Vecteur normalisé d'un niveau de contrat
+
+    Une garantie absente, non couverte ou exprimée dans une autre unité vaut 0.
+
+    Args:
+        contract (Dict): Niveau de contrat (avec ou sans bloc normalisé)
+        scales (np.ndarray): Échelles retournées par dimension_scales
+        analyzer (GuaranteeAnalyzer): Analyseur, pour les niveaux sans bloc normalisé
+
+    Returns:
+        np.ndarray: Une coordonnée par dimension
+    """
+    normalized = contract.get(NORMALIZED_KEY) or analyzer.normalize_benefits(contract.get("benefits"))
+    vector = np.zeros(len(dimensions))
+    for k, (guarantee_name, value_type) in enumerate(dimensions.items()):
+        entry = next((g[guarantee_name] for g in normalized.values() if guarantee_name in g), None)
+        if entry and entry["type"] == value_type and entry["value"] > 0:
+            vector[k] = entry["value"] / scales[k]
+    return vector
+
+
+class _Leaf:
+    __slots__ = ("points", "ids")
+
+    def __init__(self, points: np.ndarray, ids: List[int]):
+        self.points = points
+        self.ids = ids
+
+
+class _Split:
+    __slots__ = ("axis", "value", "left", "right")
+
+    def __init__(self, axis: int, value: float, left, right):
+        self.axis = axis
+        self.value = value
+        self.left = left     # coordonnées <= value
+        self.right = right   # coordonnées >= value
+
+
+class KDTree:
+    """
+    Arbre k-d à feuilles de taille bornée
+
+    Les insertions descendent jusqu'à une feuille, qui est redécoupée quand elle double ;
+    les suppressions retirent le point de sa feuille. L'arbre est reconstruit entièrement
+    quand sa taille a doublé ou diminué de moitié depuis la dernière construction.
+    """
+
+    def __init__(self, dimensions: int, leaf_size: int = KD_LEAF_SIZE):
+        self.dimensions = dimensions
+        self.leaf_size = leaf_size
+        self._leaves: Dict[int, _Leaf] = {}
+        self._root = _Leaf(np.empty((0, dimensions)), [])
+        self._built_size = 0
+
+    def __len__(self) -> int:
+        return len(self._leaves)
+
+    def build(self, ids: List[int], points: np.ndarray):
+        self._leaves = {}
+        self._root = self._build(np.asarray(points, dtype=np.float64).reshape(-1, self.dimensions), list(ids))
+        self._built_size = len(ids)
+
+    def _build(self, points: np.ndarray, ids: List[int]):
+        spread = points.max(axis=0) - points.min(axis=0) if len(ids) else np.zeros(self.dimensions)
+        if len(ids) <= self.leaf_size or not spread.any():
+            leaf = _Leaf(points, ids)
+            for point_id in ids:
+                self._leaves[point_id] = leaf
+            return leaf
+
+        axis = int(np.argmax(spread))
+        order = np.argsort(points[:, axis], kind="stable")
+        left, right = order[:len(order) // 2], order[len(order) // 2:]
+        return _Split(
+            axis, float(points[right[0], axis]),
+            self._build(points[left], [ids[i] for i in left]),
+            self._build(points[right], [ids[i] for i in right]),
+        )
+
+    def insert(self, point_id: int, point: np.ndarray):
+        if point_id in self._leaves:
+            self.remove(point_id)
+        self._root = self._insert(self._root, point_id, np.asarray(point, dtype=np.float64))
+        if len(self) > 2 * max(self._built_size, self.leaf_size):
+            self._rebuild()
+
+    def _insert(self, node, point_id: int, point: np.ndarray):
+        if isinstance(node, _Split):
+            if point[node.axis] < node.value:
+                node.left = self._insert(node.left, point_id, point)
+            else:
+                node.right = self._insert(node.right, point_id, point)
+            return node
+
+        node.points = np.vstack([node.points, point])
+        node.ids.append(point_id)
+        self._leaves[point_id] = node
+        if len(node.ids) > 2 * self.leaf_size:
+            return self._build(node.points, node.ids)
+        return node
+
+    def remove(self, point_id: int):
+        leaf = self._leaves.pop(point_id, None)
+        if leaf is None:
+            return
+        position = leaf.ids.index(point_id)
+        leaf.ids.pop(position)
+        leaf.points = np.delete(leaf.points, position, axis=0)
+        if len(self) < self._built_size // 2:
+            self._rebuild()
+
+    def _rebuild(self):
+        leaves = {id(leaf): leaf for leaf in self._leaves.values()}.values()
+        ids = [point_id for leaf in leaves for point_id in leaf.ids]
+        points = np.vstack([leaf.points for leaf in leaves]) if ids else np.empty((0, self.dimensions))
+        self.build(ids, points)
+
+    @staticmethod
+    def _query(query: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """(requête, poids) : les coordonnées NaN valent 0 et ne comptent pas dans la distance"""
+        query = np.asarray(query, dtype=np.float64)
+        weights = (~np.isnan(query)).astype(np.float64)
+        return np.nan_to_num(query, nan=0.0), weights
+
+    def nearest(self, query: np.ndarray, k: int) -> List[Tuple[float, int]]:
+        """
+        Les k points les plus proches (distance euclidienne sur les coordonnées renseignées de la requête)
+
+        Returns:
+            List[Tuple[float, int]]: (distance, identifiant), du plus proche au plus lointain
+        """
+        heap: List[Tuple[float, int]] = []   # (-distance², -identifiant) : le pire en tête
+        if k > 0:
+            self._nearest(self._root, *self._query(query), k, heap)
+        return sorted((math.sqrt(-neg_d2), -neg_id) for neg_d2, neg_id in heap)
+
+    def _nearest(self, node, query: np.ndarray, weights: np.ndarray, k: int, heap: list):
+        if isinstance(node, _Leaf):
+            if not node.ids:
+                return
+            distances = (((node.points - query) ** 2) * weights).sum(axis=1)
+            for d2, point_id in zip(distances.tolist(), node.ids):
+                candidate = (-d2, -point_id)
+                if len(heap) < k:
+                    heapq.heappush(heap, candidate)
+                elif candidate > heap[0]:
+                    heapq.heapreplace(heap, candidate)
+            return
+
+        # Axe ignoré par la requête : le plan de coupe ne borne pas la distance, les deux côtés sont parcourus
+        diff = (query[node.axis] - node.value) * weights[node.axis]
+        near, far = (node.left, node.right) if diff <= 0 else (node.right, node.left)
+        self._nearest(near, query, weights, k, heap)
+        if len(heap) < k or diff * diff <= -heap[0][0]:
+            self._nearest(far, query, weights, k, heap)
+
+    def within(self, query: np.ndarray, radius: float) -> List[Tuple[float, int]]:
+        """
+        Points à une distance inférieure ou égale à radius (coordonnées renseignées de la requête)
+
+        Returns:
+            List[Tuple[float, int]]: (distance, identifiant), du plus proche au plus lointain
+        """
+        found: List[Tuple[float, int]] = []
+        self._within(self._root, *self._query(query), radius * radius, found)
+        return sorted((math.sqrt(d2), point_id) for d2, point_id in found)
+
+    def _within(self, node, query: np.ndarray, weights: np.ndarray, radius2: float, found: list):
+        if isinstance(node, _Leaf):
+            if not node.ids:
+                return
+            distances = (((node.points - query) ** 2) * weights).sum(axis=1)
+            found.extend((d2, node.ids[i]) for i, d2 in enumerate(distances.tolist()) if d2 <= radius2)
+            return
+
+        diff = (query[node.axis] - node.value) * weights[node.axis]
+        near, far = (node.left, node.right) if diff <= 0 else (node.right, node.left)
+        self._within(near, query, weights, radius2, found)
+        if diff * diff <= radius2:
+            self._within(far, query, weights, radius2, found)
+
+
+class SimilarityIndex:
+    """Arbre k-d du catalogue, tenu à jour à partir de ContractStore.changes_since"""
+
+    def __init__(self, store: ContractStore, dimensions: Dict[str, str] = INDEX_DIMENSIONS):
+        self.store = store
+        self.dimensions = dimensions
+        self.analyzer = GuaranteeAnalyzer()
+        self.scales = dimension_scales(self.analyzer, dimensions)
+        self.tree = KDTree(len(dimensions))
+        # level_id de chaque niveau indexé ; les niveaux eux-mêmes sont relus à la demande dans le catalogue
+        self.level_ids: Dict[int, Optional[str]] = {}
+        # Nombre de niveaux par level_id, pour exclure les homonymes sans parcourir le catalogue
+        self.level_counts: Counter = Counter()
+        self.version = 0
+        self._lock = threading.Lock()
+
+    def sync(self):
+        """Applique les modifications du catalogue survenues depuis la dernière synchronisation"""
+        with self._lock:
+            changes = self.store.changes_since(self.version)
+            if not changes:
+                return
+
+            inserted, deleted = set(), set()
+            for _, op, contract_id in changes:
+                if op == "insert":
+                    inserted.add(contract_id)
+                else:
+                    inserted.discard(contract_id)
+                    deleted.add(contract_id)
+            added = self.store.get_many(sorted(inserted))
+
+            for contract_id in deleted:
+                if contract_id in self.level_ids:
+                    self.level_counts[self.level_ids.pop(contract_id)] -= 1
+                self.tree.remove(contract_id)
+            vectors = {cid: self.vector(contract) for cid, contract in added.items()}
+            if len(self.tree) == 0:
+                ids = sorted(vectors)
+                self.tree.build(ids, np.array([vectors[cid] for cid in ids]).reshape(-1, len(self.dimensions)))
+            else:
+                for contract_id in sorted(vectors):
+                    self.tree.insert(contract_id, vectors[contract_id])
+            self.level_ids.update((cid, contract.get("level_id")) for cid, contract in added.items())
+            self.level_counts.update(contract.get("level_id") for contract in added.values())
+            self.level_counts += Counter()   # retire les level_id supprimés
+            self.version = changes[-1][0]
+            logger.info("Similarity index synced to version %d: %d levels", self.version, len(self.tree))
+
+    def vector(self, contract: Dict) -> np.ndarray:
+        return guarantee_vector(contract, self.scales, self.analyzer, self.dimensions)
+
+    def needs_vector(self, needs: List[Dict]) -> np.ndarray:
+        """
+        Vecteur d'un profil
+
+        Les garanties non renseignées valent NaN : la distance n'est mesurée que sur les garanties
+        du profil, un seuil unique ne favorise donc pas les niveaux qui couvrent le moins de garanties.
+
+        Raises:
+            ValueError: Si un besoin n'est pas exprimé dans l'unité usuelle de sa garantie
+        """
+        names = list(self.dimensions)
+        vector = np.full(len(names), np.nan)
+        for need in needs:
+            k = names.index(need["guarantee"])
+            if need["type"] != self.dimensions[need["guarantee"]]:
+                raise ValueError(f"Unité inattendue pour {need['guarantee']} : {need['type']}")
+            vector[k] = need["value"] / self.scales[k]
+        return vector
+
+    def nearest(self, vector: np.ndarray, k: int = SIMILAR_DEFAULT_K,
+                exclude_level_id: Optional[str] = None) -> List[Dict]:
+        """
+        Les k niveaux les plus proches d'un vecteur (ses coordonnées NaN sont ignorées, voir needs_vector)
+
+        Returns:
+            List[Dict]: {"distance", "contract"}, du plus proche au plus lointain
+        """
+        self.sync()
+        with self._lock:
+            # Les niveaux exclus (même level_id) sont au plus aussi nombreux que les homonymes
+            extra = self.level_counts[exclude_level_id] if exclude_level_id is not None else 0
+            matches = self.tree.nearest(vector, k + extra)
+            return self._results(matches, exclude_level_id, k)
+
+    def within(self, vector: np.ndarray, radius: float, exclude_level_id: Optional[str] = None) -> List[Dict]:
+        """Niveaux à une distance inférieure ou égale à radius, du plus proche au plus lointain"""
+        self.sync()
+        with self._lock:
+            return self._results(self.tree.within(vector, radius), exclude_level_id)
+
+    def _results(self, matches: List[Tuple[float, int]], exclude_level_id: Optional[str],
+                 limit: Optional[int] = None) -> List[Dict]:
+        matches = [
+            (distance, contract_id) for distance, contract_id in matches
+            if exclude_level_id is None or self.level_ids[contract_id] != exclude_level_id
+        ][:limit]
+        # Seuls les niveaux retournés sont décodés ; un niveau supprimé entre-temps est omis
+        contracts = self.store.get_many([contract_id for _, contract_id in matches])
+        return [
+            {"distance": distance, "contract": contracts[contract_id]}
+            for distance, contract_id in matches
+            if contract_id in contracts
+        ]
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_similarity_index() -> SimilarityIndex:
+    """Index partagé du catalogue, créé au premier appel"""
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = SimilarityIndex(get_store())
+        return _index
@@ -37,7 +37,7 @@ document.addEventListener('DOMContentLoaded', () => {
         };
 
         try {
-            const response = await fetch('/compare', {
+            const response = await fetch('/compare/stream', {
                 method: 'POST',
                 headers: {
                     'Content-Type': 'application/json'
@@ -49,13 +49,20 @@ document.addEventListener('DOMContentLoaded', () => {
                 throw new Error(`HTTP error! status: ${response.status}`);
             }
 
-            const result = await response.json();
-            
-            if (result.error) {
-                throw new Error(result.error);
-            }
+            // Each "row" event carries one line of the markdown table
+            const lines = [];
+            await readEvents(response, (event, payload) => {
+                if (event === 'row') {
+                    lines.push(payload.line);
+                    displayResults(lines.join('\n'));
+                } else if (event === 'error') {
+                    throw new Error(payload.error);
+                }
+            });
 
-            displayResults(result.table);
+            if (lines.length === 0) {
+                displayResults(null);
+            }
 
         } catch (error) {
             resultsDiv.innerHTML = `<p>Une erreur est survenue: ${error.message}</p>`;
@@ -63,6 +70,38 @@ document.addEventListener('DOMContentLoaded', () => {
         }
     });
 
+    // Minimal Server-Sent Events parser for a fetch() response body
+    async function readEvents(response, onEvent) {
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+
+        while (true) {
+            const { value, done } = await reader.read();
+            if (done) {
+                break;
+            }
+            buffer += decoder.decode(value, { stream: true });
+
+            let boundary;
+            while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+                const block = buffer.slice(0, boundary);
+                buffer = buffer.slice(boundary + 2);
+
+                let event = 'message';
+                let dataText = '';
+                block.split('\n').forEach(line => {
+                    if (line.startsWith('event: ')) {
+                        event = line.slice(7);
+                    } else if (line.startsWith('data: ')) {
+                        dataText += line.slice(6);
+                    }
+                });
+                onEvent(event, dataText ? JSON.parse(dataText) : {});
+            }
+        }
+    }
+
     function displayResults(data) {
         if (!data) {
             resultsDiv.innerHTML = '<p>Aucune réponse du modèle.</p>';
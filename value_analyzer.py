@@ -5,7 +5,8 @@ Détecte le type de valeur (euros, pourcentage) et configure les sliders appropr
 
 import re
 import json
-from typing import Dict, List, Tuple, Union
+from functools import lru_cache
+from typing import Dict, Iterable, List, Tuple, Union
 
 class ValueType:
     """Types de valeurs supportés"""
@@ -14,24 +15,107 @@ class ValueType:
     MIXED = "mixed"
     UNKNOWN = "unknown"
 
+# Une seule expression compilée : chaque alternative est un lookahead qui parcourt toute la valeur,
+# donc un pourcentage l'emporte sur un montant en €, puis en "euros", puis sur un nombre seul,
+# où qu'ils se trouvent dans la chaîne (ex: "100% BR", "500 % BRSS", "+30 €", "3 séances")
+_NUMBER = r"(\d+(?:\.\d+)?)"
+_VALUE_PATTERN = re.compile(
+    r"^(?:"
+    rf"(?=.*?{_NUMBER}\s*%(?:\s*(BRSS|BR)\b)?)"
+    rf"|(?=.*?{_NUMBER}\s*€)"
+    rf"|(?=.*?{_NUMBER}\s*euros?)"
+    rf"|(?=.*?{_NUMBER})"
+    r")",
+    re.IGNORECASE | re.DOTALL,
+)
+
+ANALYSIS_CACHE_SIZE = 4096
+
+# Clé du bloc normalisé enregistré avec chaque niveau de contrat
+NORMALIZED_KEY = "normalized"
+
+
+def is_covered(value) -> bool:
+    """Indique si une valeur brute correspond à une garantie couverte (ni vide, ni "-", ni "non couvert")"""
+    return bool(value) and value != "-" and str(value).lower() not in ["non couvert", "nc"]
+
+
+def _analyze(value) -> Dict:
+    """Analyse d'une valeur en une seule recherche (voir GuaranteeAnalyzer.analyze_value)"""
+    if not value or value == "-" or value.lower() in ["non couvert", "nc"]:
+        return {
+            "type": ValueType.UNKNOWN,
+            "numeric_value": 0,
+            "original_value": value,
+            "unit": "",
+            "is_addition": False,
+            "display_value": value
+        }
+    
+    # Nettoyer la valeur
+    clean_value = str(value).strip()
+    
+    # Détecter si c'est un ajout (+)
+    is_addition = clean_value.startswith('+')
+    
+    match = _VALUE_PATTERN.match(clean_value)
+    percentage, base, euros, euros_word, number = match.groups() if match else (None,) * 5
+    
+    if percentage is not None:
+        numeric_value = float(percentage)
+        return {
+            "type": ValueType.PERCENTAGE,
+            "numeric_value": numeric_value,
+            "original_value": value,
+            "unit": "%",
+            "base": (base or "").upper(),
+            "is_addition": is_addition,
+            "display_value": f"{numeric_value}% BR"
+        }
+    
+    if euros is not None or euros_word is not None:
+        numeric_value = float(euros if euros is not None else euros_word)
+        return {
+            "type": ValueType.EUROS,
+            "numeric_value": numeric_value,
+            "original_value": value,
+            "unit": "€",
+            "is_addition": is_addition,
+            "display_value": f"{numeric_value}€"
+        }
+    
+    # Si aucune unité n'est reconnue, garder le premier nombre
+    if number is not None:
+        numeric_value = float(number)
+        return {
+            "type": ValueType.UNKNOWN,
+            "numeric_value": numeric_value,
+            "original_value": value,
+            "unit": "",
+            "is_addition": is_addition,
+            "display_value": str(numeric_value)
+        }
+    
+    return {
+        "type": ValueType.UNKNOWN,
+        "numeric_value": 0,
+        "original_value": value,
+        "unit": "",
+        "is_addition": False,
+        "display_value": value
+    }
+
+
+@lru_cache(maxsize=ANALYSIS_CACHE_SIZE)
+def _analyze_cached(value) -> Dict:
+    # Les valeurs du catalogue se répètent beaucoup ; l'appelant reçoit une copie
+    return _analyze(value)
+
+
 class GuaranteeAnalyzer:
     """Analyseur de garanties pour déterminer les types de valeurs et configurer les sliders"""
     
     def __init__(self):
-        # Patterns de reconnaissance
-        self.percentage_patterns = [
-            r'(\d+(?:\.\d+)?)\s*%',           # 100%, 125.5%
-            r'(\d+(?:\.\d+)?)\s*% BR',        # 100% BR
-            r'(\d+(?:\.\d+)?)\s*% BRSS',      # 500% BRSS
-            r'\+(\d+(?:\.\d+)?)\s*% BR',      # +100% BR
-        ]
-        
-        self.euros_patterns = [
-            r'(\d+(?:\.\d+)?)\s*€',           # 100€, 125.50€
-            r'(\d+(?:\.\d+)?)\s*euros?',      # 100 euro, 125 euros
-            r'\+(\d+(?:\.\d+)?)\s*€',         # +30€
-        ]
-        
         # Configuration des sliders par défaut
         self.default_slider_configs = {
             ValueType.PERCENTAGE: {
@@ -58,71 +142,58 @@ class GuaranteeAnalyzer:
             value (str): Valeur extraite (ex: "125 % BR", "30 €", "+100% BR")
             
         Returns:
-            Dict: Informations sur la valeur analysée
+            Dict: Informations sur la valeur analysée (nouveau dictionnaire à chaque appel)
         """
-        if not value or value == "-" or value.lower() in ["non couvert", "nc"]:
-            return {
-                "type": ValueType.UNKNOWN,
-                "numeric_value": 0,
-                "original_value": value,
-                "unit": "",
-                "is_addition": False
-            }
-        
-        # Nettoyer la valeur
-        clean_value = str(value).strip()
-        
-        # Détecter si c'est un ajout (+)
-        is_addition = clean_value.startswith('+')
-        
-        # Analyser les pourcentages
-        for pattern in self.percentage_patterns:
-            match = re.search(pattern, clean_value, re.IGNORECASE)
-            if match:
-                numeric_value = float(match.group(1))
-                return {
-                    "type": ValueType.PERCENTAGE,
-                    "numeric_value": numeric_value,
-                    "original_value": value,
-                    "unit": "%",
-                    "is_addition": is_addition,
-                    "display_value": f"{numeric_value}% BR"
-                }
+        if value is None or isinstance(value, str):
+            return dict(_analyze_cached(value))
+        return _analyze(value)
+    
+    def analyze_many(self, values: Iterable[str]) -> List[Dict]:
+        """
+        Analyse une série de valeurs, chaque valeur distincte n'étant analysée qu'une fois
         
-        # Analyser les euros
-        for pattern in self.euros_patterns:
-            match = re.search(pattern, clean_value, re.IGNORECASE)
-            if match:
-                numeric_value = float(match.group(1))
-                return {
-                    "type": ValueType.EUROS,
-                    "numeric_value": numeric_value,
-                    "original_value": value,
-                    "unit": "€",
-                    "is_addition": is_addition,
-                    "display_value": f"{numeric_value}€"
-                }
+        Args:
+            values (Iterable[str]): Valeurs extraites
+            
+        Returns:
+            List[Dict]: Analyses, dans l'ordre des valeurs
+        """
+        return [self.analyze_value(value) for value in values]
+    
+    def normalize_value(self, value) -> Dict:
+        """
+        Forme typée d'une valeur brute, telle qu'enregistrée dans le catalogue
         
-        # Si aucun pattern ne correspond, essayer d'extraire un nombre
-        number_match = re.search(r'(\d+(?:\.\d+)?)', clean_value)
-        if number_match:
-            numeric_value = float(number_match.group(1))
-            return {
-                "type": ValueType.UNKNOWN,
-                "numeric_value": numeric_value,
-                "original_value": value,
-                "unit": "",
-                "is_addition": is_addition,
-                "display_value": str(numeric_value)
-            }
+        Args:
+            value: Valeur extraite (ex: "500 % BRSS", "+100 €", "non couvert")
+            
+        Returns:
+            Dict: {"value", "type", "unit", "base", "is_addition", "covered"}
+        """
+        analysis = self.analyze_value(None if value is None else str(value))
+        return {
+            "value": analysis["numeric_value"],
+            "type": analysis["type"],
+            "unit": analysis["unit"],
+            "base": analysis.get("base", ""),
+            "is_addition": analysis["is_addition"],
+            "covered": is_covered(value)
+        }
+    
+    def normalize_benefits(self, benefits: Dict) -> Dict:
+        """
+        Normalise toutes les garanties d'un contrat, catégorie par catégorie
         
+        Args:
+            benefits (Dict): Dictionnaire des garanties du contrat
+            
+        Returns:
+            Dict: Même structure que benefits, avec les valeurs normalisées
+        """
         return {
-            "type": ValueType.UNKNOWN,
-            "numeric_value": 0,
-            "original_value": value,
-            "unit": "",
-            "is_addition": False,
-            "display_value": value
+            category: {name: self.normalize_value(value) for name, value in guarantees.items()}
+            for category, guarantees in (benefits or {}).items()
+            if isinstance(guarantees, dict)
         }
     
     def analyze_contract_benefits(self, benefits: Dict) -> Dict:
@@ -321,6 +392,24 @@ class GuaranteeAnalyzer:
         
         return label_mapping.get(guarantee_name, guarantee_name.replace("_", " ").title())
 
+def normalize_contract(contract: Dict, analyzer: GuaranteeAnalyzer = None) -> Dict:
+    """
+    Ajoute à un niveau de contrat le bloc normalisé de ses garanties
+    
+    Args:
+        contract (Dict): Niveau de contrat au format examples.json
+        analyzer (GuaranteeAnalyzer): Analyseur à utiliser
+        
+    Returns:
+        Dict: Copie du contrat avec la clé "normalized"
+    """
+    analyzer = analyzer or GuaranteeAnalyzer()
+    return {**contract, NORMALIZED_KEY: analyzer.normalize_benefits(contract.get("benefits"))}
+
+def without_normalized(contract: Dict) -> Dict:
+    """Contrat sans son bloc normalisé (format contracts.json d'origine)"""
+    return {key: value for key, value in contract.items() if key != NORMALIZED_KEY}
+
 def analyze_extracted_contract(contract_data: Dict) -> Dict:
     """
     Fonction principale pour analyser un contrat extrait